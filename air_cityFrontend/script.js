@@ -185,6 +185,8 @@ async function handleExport() {
     if (message) message.innerHTML = "";
 
     const aggregation = document.getElementById("aggregation").value;
+    const format = document.getElementById("format")?.value || "xlsx";
+    const dataMode = document.getElementById("dataMode")?.value || "live";
     const startDate = document.getElementById("startDate").value;
     const startTime = document.getElementById("startTime").value;
     const endDate = document.getElementById("endDate").value;
@@ -204,7 +206,11 @@ async function handleExport() {
       cities: selectedCities,
       pollutants: selectedPollutants.map(n => pollutantMap[n]),
       gaps: 1,
-      gap_value: "NULL"
+      gap_value: "NULL",
+      format,
+      data_mode: dataMode,
+      // multi-city exports: each city becomes downloadable as soon as it is done
+      incremental: selectedCities.length > 1
     };
     
     const response = await fetch(`${baseUrl}/export`, {
@@ -217,44 +223,108 @@ async function handleExport() {
     const jobId = result.job_id;
     const filePath = result.file_path;
 
-    const interval = setInterval(async () => {
+    // server-pushed progress (SSE); on a stream error (expired job, proxy without SSE)
+    // onerror below closes it and polls /progress instead
+    const events = new EventSource(`${baseUrl}/progress/${jobId}/stream`);
+
+    const setProgress = (pct, label) => {
+      if (progressBar) progressBar.style.width = pct + "%";
+      if (progressText) progressText.innerText = label || pct + "%";
+    };
+
+    // waiting for a free export worker
+    events.addEventListener("queued", async () => {
       const prog = await fetch(`${baseUrl}/progress/${jobId}`);
       const data = await prog.json();
-
-      // backend failure
-      if (data.error || data.progress === -1) {
-        clearInterval(interval);
-        alert("Export failed: " + (data.error || "Unknown error"));
-        resetProgressUI();
-        return;
+      if (data.status === "queued" && progressText) {
+        progressText.innerText = `Queued (position ${data.queue_position})`;
       }
+    });
 
-      // update progress
-      if (progressBar) progressBar.style.width = data.progress + "%";
-      if (progressText) progressText.innerText = data.progress + "%";
+    events.addEventListener("progress", (e) => {
+      const data = JSON.parse(e.data);
+      const eta = data.eta_s > 0 ? ` · ~${Math.ceil(data.eta_s)}s left` : "";
+      const sites = data.sites_total ? ` · ${data.sites_done}/${data.sites_total} stations` : "";
+      setProgress(data.progress, `${data.progress}%${sites}${eta}`);
+    });
 
-      // download only at 100
-      if (data.progress === 100) {
-        clearInterval(interval);
+    events.addEventListener("phase", (e) => {
+      const data = JSON.parse(e.data);
+      if (data.phase === "write" && progressText) progressText.innerText = "Writing file…";
+    });
 
-        const download = await fetch(
-          `${baseUrl}/download?file_path=${encodeURIComponent(filePath)}`
-        );
-        const blob = await download.blob();
-        const url = window.URL.createObjectURL(blob);
+    // one city finished (incremental export) -> link to its own file
+    events.addEventListener("part_ready", (e) => {
+      const data = JSON.parse(e.data);
+      if (!message) return;
+      const link = document.createElement("a");
+      link.href = `${baseUrl}/download?file_path=${encodeURIComponent(data.file_path)}`;
+      link.innerText = `${data.city} ready (${data.parts_done}/${data.parts_total})`;
+      link.style.display = "block";
+      message.appendChild(link);
+    });
 
-        const a = document.createElement("a");
-        a.href = url;
-        a.download = `city_air_quality_${Date.now()}.xlsx`;
-        document.body.appendChild(a);
-        a.click();
-        a.remove();
+    // backend failure
+    events.addEventListener("failed", (e) => {
+      events.close();
+      const data = JSON.parse(e.data);
+      alert("Export failed: " + (data.error || "Unknown error"));
+      resetProgressUI();
+    });
 
-        window.URL.revokeObjectURL(url);
+    const downloadResult = async () => {
+      setProgress(100);
 
-        showModal(); // user closes with ×
-      }
-    }, 1000);
+      const download = await fetch(
+        `${baseUrl}/download?file_path=${encodeURIComponent(filePath)}`
+      );
+      const blob = await download.blob();
+      const url = window.URL.createObjectURL(blob);
+
+      const a = document.createElement("a");
+      a.href = url;
+      a.download = `city_air_quality_${Date.now()}${format === "xlsx" ? ".xlsx" : `.${format}.zip`}`;
+      document.body.appendChild(a);
+      a.click();
+      a.remove();
+
+      window.URL.revokeObjectURL(url);
+
+      showModal(); // user closes with ×
+    };
+
+    // download once the job is done
+    events.addEventListener("done", async () => {
+      events.close();
+      await downloadResult();
+    });
+
+    // stream unavailable (expired job, proxy without SSE, ...) -> stop reconnecting, poll instead
+    events.onerror = () => {
+      events.close();
+      const poll = async () => {
+        try {
+          const prog = await fetch(`${baseUrl}/progress/${jobId}`);
+          const data = await prog.json();
+          if (!prog.ok) throw new Error(data.detail || `HTTP ${prog.status}`);
+          if (data.status === "done") return downloadResult();
+          if (data.status === "failed") {
+            alert("Export failed: " + (data.error || "Unknown error"));
+            return resetProgressUI();
+          }
+          if (data.status === "queued") {
+            if (progressText) progressText.innerText = `Queued (position ${data.queue_position})`;
+          } else {
+            setProgress(data.progress);
+          }
+          setTimeout(poll, 2000);
+        } catch (err) {
+          alert("Export progress unavailable: " + err.message);
+          resetProgressUI();
+        }
+      };
+      poll();
+    };
 
   } catch (err) {
     alert("Error: " + err.message);
@@ -1,12 +1,46 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import httpx
 import pandas as pd
-from typing import List, Literal
-from urllib.parse import quote
+from threading import Lock
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
 
-BASE_URL = "https://atmos.urbansciences.in/adp/v4/getDeviceDataParamClone"
-API_KEY = "ncapAPIKey"
+from . import cache, cpu_pool
+from .columns import no_rows, typed_frame
+from .metrics import span
+from .progress import bump
+from .retry import RetryBudget, breaker_for, sleep_before_retry, take_retry
+
+ATMOS_BASE_URL = os.getenv("ATMOS_BASE_URL", "https://atmos.urbansciences.in").rstrip("/")
+BASE_URL = f"{ATMOS_BASE_URL}/adp/v4/getDeviceDataParamClone"
+API_KEY = os.getenv("ATMOS_API_KEY", "ncapAPIKey")
+
+# HTTP client settings (REQUEST_TIMEOUT = read/write/pool timeout in seconds)
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+
+# "pyarrow" (multi-threaded, infers dt_time as datetime64) or "c"
+CSV_ENGINE = os.getenv("CSV_ENGINE", "pyarrow")
+
+HTTP2 = os.getenv("HTTP2", "0") == "1"  # needs `httpx[http2]` (h2) installed
+
+# long windows are split into chunks of this many days (0 = never split),
+# fetched CHUNK_CONCURRENCY at a time; a failed chunk is retried CHUNK_RETRIES times
+CHUNK_DAYS = {
+    "15min": int(os.getenv("CHUNK_DAYS_15MIN", "7")),
+    "hourly": int(os.getenv("CHUNK_DAYS_HOURLY", "31")),
+}
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "8"))
+CHUNK_RETRIES = int(os.getenv("CHUNK_RETRIES", "2"))
+TIME_FMT = "%Y-%m-%dT%H:%M"
 
 Aggregation = Literal["15min", "hourly", "daily", "monthly", "yearly"]
-DataMode = Literal["api", "raw15"]
+DataMode = Literal["api", "raw15", "local"]  # local = app.mirror store, no ATMOS call
 
 TS_MAP = {
     "hourly": "hh",
@@ -15,7 +49,129 @@ TS_MAP = {
     "yearly": "YY",
 }
 
-def fetch_csv(
+
+# ----------------------------- errors -----------------------------
+
+class AtmosError(Exception):
+    """Base class for everything that can go wrong talking to ATMOS."""
+    retryable = True
+
+
+class AtmosTimeout(AtmosError):
+    """Connect/read timeout."""
+
+
+class AtmosHTTPError(AtmosError):
+    """Non-2xx status from ATMOS."""
+
+    def __init__(self, status_code: int, message: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}{': ' + message if message else ''}")
+        self.status_code = status_code
+        # 429 / 5xx are worth retrying, other 4xx will fail the same way again
+        self.retryable = status_code == 429 or status_code >= 500
+        self.retry_after = retry_after  # seconds, from the Retry-After header
+
+
+class AtmosBadResponse(AtmosError):
+    """2xx response whose body is not a CSV (HTML error page, JSON, garbage)."""
+
+
+class AtmosCircuitOpen(AtmosError):
+    """Not sent: the circuit breaker for the ATMOS host is open (see app.retry)."""
+    retryable = False
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - pd.Timestamp.now(tz="UTC")).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+# ----------------------------- client -----------------------------
+
+_client: Optional[httpx.Client] = None
+_client_pid: Optional[int] = None
+_client_lock = Lock()
+
+
+def get_client() -> httpx.Client:
+    """
+    One shared keep-alive connection pool per process
+    (re-created after a fork so workers never share sockets).
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = httpx.Client(
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                ),
+                http2=HTTP2,
+                follow_redirects=True,
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def close_client():
+    global _client, _chunk_pool
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        if _chunk_pool is not None:
+            _chunk_pool.shutdown(wait=False)
+            _chunk_pool = None
+    cpu_pool.shutdown()
+
+
+_chunk_pool: Optional[ThreadPoolExecutor] = None
+_chunk_pool_pid: Optional[int] = None
+
+
+def _get_chunk_pool() -> ThreadPoolExecutor:
+    """Shared pool for chunk downloads, so chunk concurrency is bounded per process."""
+    global _chunk_pool, _chunk_pool_pid
+    with _client_lock:
+        if _chunk_pool is None or _chunk_pool_pid != os.getpid():
+            _chunk_pool = ThreadPoolExecutor(max_workers=max(1, CHUNK_CONCURRENCY), thread_name_prefix="atmos-chunk")
+            _chunk_pool_pid = os.getpid()
+        return _chunk_pool
+
+
+class _ByteStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks (lets read_csv consume a streamed body)."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def build_url(
     site_ids: List[str],
     params: List[str],
     start: str,
@@ -24,17 +180,7 @@ def fetch_csv(
     gap_value: str,
     aggregation: Aggregation,
     data_mode: DataMode = "api",
-) -> pd.DataFrame:
-    """
-    data_mode:
-      - "api"   : use API aggregated values (hh/dd/MM/YY)
-      - "raw15" : fetch 15-min values (ts=mm, avg=15)
-
-    aggregation:
-      - "15min" is only meaningful with data_mode="raw15"
-      - hourly/daily/monthly/yearly use API if data_mode="api"
-    """
-
+) -> str:
     if data_mode == "raw15" or aggregation == "15min":
         ts_ref = "mm"     # minute resolution
         avg_window = 15   # 15-min average
@@ -45,7 +191,7 @@ def fetch_csv(
     site_str = ",".join(site_ids)
     param_str = ",".join(params)
 
-    url = (
+    return (
         f"{BASE_URL}/imei/{site_str}"
         f"/params/{param_str}"
         f"/startdate/{start}"
@@ -56,8 +202,222 @@ def fetch_csv(
         f"?gaps={gaps}&gap_value={quote(gap_value)}"
     )
 
+
+def fetch_csv(
+    site_ids: List[str],
+    params: List[str],
+    start: str,
+    end: str,
+    gaps: int,
+    gap_value: str,
+    aggregation: Aggregation,
+    data_mode: DataMode = "api",
+    cache_stats: Optional[Dict[str, int]] = None,
+    retry_budget: Optional[RetryBudget] = None,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    Same as download_csv, but served from the on-disk cache (app.cache) when
+    CACHE_ENABLED and use_cache; only the time ranges not cached yet are downloaded.
+    cache_stats (optional) collects cache hit/partial/miss counts and the
+    number of requests / bytes actually downloaded.
+    Long windows are downloaded in chunks (see download_chunked); chunk retries
+    are taken from retry_budget (the job's, optional).
+    data_mode="local" reads the mirrored store instead (app.mirror.read_frame).
+    Time spent here is added to cache_stats["fetch_csv_ms"] (summed over threads).
+    """
+    with span(cache_stats, "fetch_csv"):
+        if data_mode == "local":
+            from .mirror import read_frame
+            return read_frame(site_ids, params, start, end, aggregation)
+
+        download = partial(download_chunked, stats=cache_stats, budget=retry_budget)
+        if cache.CACHE_ENABLED and use_cache:
+            return cache.fetch_through(
+                download, site_ids, params, start, end, gaps, gap_value,
+                aggregation, data_mode, stats=cache_stats
+            )
+        return download(site_ids, params, start, end, gaps, gap_value, aggregation, data_mode)
+
+
+def split_range(start: str, end: str, aggregation: Aggregation, data_mode: DataMode = "api") -> List[Tuple[str, str]]:
+    """
+    [start, end] as consecutive non-overlapping (start, end) windows of CHUNK_DAYS.
+    Inner boundaries fall on midnight so no aggregation bucket straddles two chunks.
+    """
+    if data_mode == "raw15":
+        aggregation = "15min"
+    days = CHUNK_DAYS.get(aggregation, 0)
+    s = pd.Timestamp(start)
+    e = pd.Timestamp(end)
+    if days <= 0 or e - s <= pd.Timedelta(days=days):
+        return [(start, end)]
+
+    step = pd.Timedelta(days=days)
+    bounds = [s]
+    cursor = s.floor("d") + step
+    while cursor < e:
+        bounds.append(cursor)
+        cursor += step
+
+    minute = pd.Timedelta(minutes=1)
+    windows = [(a, b - minute) for a, b in zip(bounds, bounds[1:])] + [(bounds[-1], e)]
+    return [(a.strftime(TIME_FMT), b.strftime(TIME_FMT)) for a, b in windows]
+
+
+def download_chunked(
+    site_ids: List[str],
+    params: List[str],
+    start: str,
+    end: str,
+    gaps: int,
+    gap_value: str,
+    aggregation: Aggregation,
+    data_mode: DataMode = "api",
+    stats: Optional[Dict[str, int]] = None,
+    budget: Optional[RetryBudget] = None,
+) -> pd.DataFrame:
+    """
+    download_csv over split_range() windows, fetched concurrently and concatenated.
+
+    Each chunk is retried on its own (CHUNK_RETRIES, with backoff, while the
+    budget lasts). When some chunks still fail the rows of the others are
+    returned, with the failures listed in
+    df.attrs["failed_chunks"] = [{"start", "end", "error", "retries"}]; when
+    nothing came back at all the first chunk error is raised.
+    """
+    windows = split_range(start, end, aggregation, data_mode)
+    if len(windows) == 1:
+        return download_csv(site_ids, params, start, end, gaps, gap_value, aggregation, data_mode, stats=stats)
+
+    def fetch_window(window):
+        """(df or the final AtmosError, retries made)"""
+        a, b = window
+        for attempt in range(CHUNK_RETRIES + 1):
+            try:
+                return download_csv(site_ids, params, a, b, gaps, gap_value, aggregation, data_mode, stats=stats), attempt
+            except AtmosError as e:
+                if not e.retryable or attempt == CHUNK_RETRIES or not take_retry(budget):
+                    return e, attempt
+                bump(stats, "retries")
+                sleep_before_retry(attempt, getattr(e, "retry_after", None))
+
+    outcomes = list(_get_chunk_pool().map(fetch_window, windows))
+
+    frames = [df for df, _ in outcomes if isinstance(df, pd.DataFrame) and not df.empty]
+    errors = [(window, e, retries) for window, (e, retries) in zip(windows, outcomes) if isinstance(e, AtmosError)]
+
+    if errors and not frames:
+        raise errors[0][1]
+    if not frames:
+        return no_rows()
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    df.attrs["failed_chunks"] = [
+        {"start": a, "end": b, "error": str(e), "retries": retries} for (a, b), e, retries in errors
+    ]
+    return df
+
+
+def download_csv(
+    site_ids: List[str],
+    params: List[str],
+    start: str,
+    end: str,
+    gaps: int,
+    gap_value: str,
+    aggregation: Aggregation,
+    data_mode: DataMode = "api",
+    stats: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """
+    data_mode:
+      - "api"   : use API aggregated values (hh/dd/MM/YY)
+      - "raw15" : fetch 15-min values (ts=mm, avg=15)
+
+    aggregation:
+      - "15min" is only meaningful with data_mode="raw15"
+      - hourly/daily/monthly/yearly use API if data_mode="api"
+
+    The body is streamed straight into the CSV parser (or, with PARSE_PROCESSES and a
+    Content-Length of at least PARSE_OFFLOAD_MIN_BYTES, downloaded whole and parsed in
+    the app.cpu_pool worker processes) and comes back typed
+    (columns.typed_frame: dt_time datetime64, values float64, station id str),
+    so nothing downstream parses again. An empty body gives columns.no_rows(); a body without
+    a dt_time column and everything else that goes wrong raises an AtmosError
+    (AtmosTimeout / AtmosHTTPError / AtmosBadResponse). While the host's
+    circuit breaker is open nothing is sent and AtmosCircuitOpen is raised.
+    stats (optional) gets "requests", "bytes_fetched", "parse_ms" (time spent
+    reading the body into the parser, summed over threads), "http_ms" and
+    "circuit_open" counts.
+    """
+    url = build_url(site_ids, params, start, end, gaps, gap_value, aggregation, data_mode)
+
+    breaker = breaker_for(urlsplit(url).netloc)
+    if not breaker.allow():
+        bump(stats, "circuit_open")
+        raise AtmosCircuitOpen(f"circuit open for {urlsplit(url).netloc} (upstream error rate too high)")
+
+    bump(stats, "requests")
+    failed = True
     try:
-        return pd.read_csv(url)
-    except Exception:
-        return pd.DataFrame()
+        with span(stats, "http"):
+            df = _stream_csv(url, stats)
+        failed = False
+        return df
+    except AtmosError as e:
+        # only upstream trouble (timeouts, 429/5xx, garbage) counts against the host
+        failed = e.retryable
+        raise
+    finally:
+        breaker.record(failed)
+
+
+def _data_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """A parsed body that is not a data response (e.g. a one-line "Rate limit exceeded") -> AtmosBadResponse."""
+    if "dt_time" not in df.columns:
+        raise AtmosBadResponse(f"dt_time missing. cols={list(df.columns)[:12]}")
+    return df
+
+
+def _stream_csv(url: str, stats: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    try:
+        with get_client().stream("GET", url) as resp:
+            if resp.status_code >= 400:
+                body = resp.read()[:200].decode("utf-8", "replace")
+                retry_after = _parse_retry_after(resp.headers.get("retry-after"))
+                raise AtmosHTTPError(resp.status_code, body.strip(), retry_after)
+
+            content_type = resp.headers.get("content-type", "").lower()
+            if "html" in content_type or "json" in content_type:
+                body = resp.read()[:200].decode("utf-8", "replace")
+                raise AtmosBadResponse(f"non-CSV body ({content_type}): {body.strip()}")
+
+            if cpu_pool.offloads(resp.headers.get("content-length")):
+                # two-stage: this thread only downloads, parsing is done by the CPU stage
+                try:
+                    body = resp.read()
+                finally:
+                    bump(stats, "bytes_fetched", resp.num_bytes_downloaded)
+                if not body:
+                    return no_rows()
+                with span(stats, "parse"):
+                    return _data_frame(cpu_pool.parse_csv(body, CSV_ENGINE))
+
+            stream = io.BufferedReader(_ByteStream(resp.iter_bytes()))
+            try:
+                if not stream.peek(1):
+                    return no_rows()
+                with span(stats, "parse"):
+                    return _data_frame(typed_frame(pd.read_csv(stream, engine=CSV_ENGINE)))
+            finally:
+                bump(stats, "bytes_fetched", resp.num_bytes_downloaded)
 
+    except httpx.TimeoutException as e:
+        raise AtmosTimeout(f"timeout after {REQUEST_TIMEOUT:g}s ({type(e).__name__})") from e
+    except httpx.HTTPError as e:
+        raise AtmosError(f"transport error: {e}") from e
+    except pd.errors.EmptyDataError:
+        return no_rows()
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise AtmosBadResponse(f"non-CSV body: {e}") from e
@@ -0,0 +1,305 @@
+"""
+Per-station, per-parameter data availability learned from past fetches (SQLite).
+
+For every (site_id, param) the index keeps one contiguous checked range
+(checked_from .. checked_until, minutes inclusive) and the first / last
+timestamp with valid data inside it (NULL = nothing valid). It is fed by every
+clean live fetch (pipeline._fetch_site: no failed chunks, no upstream error;
+a column the station does not return counts as "no data"). The last
+AVAILABILITY_SETTLE_DAYS before a fetch are not recorded, since ATMOS may still
+backfill them.
+
+plan() uses it before a station is fetched:
+  - a parameter whose export window lies in a known-empty part of its checked
+    range is skipped while that check is less than AVAILABILITY_RECHECK_DAYS old;
+  - a parameter the station never reported over AVAILABILITY_MIN_PROBE_DAYS, or
+    has not reported for AVAILABILITY_DEAD_DAYS, is skipped while that check is
+    less than AVAILABILITY_RECHECK_DAYS old (then it is fetched again, which
+    refreshes it);
+  - otherwise the fetch window is narrowed to the part not known to be empty.
+A fetch that found no data at all for a parameter may be an upstream hiccup,
+so a row whose last fetch came back empty is only used once
+AVAILABILITY_CONFIRMATIONS fetches in a row agreed. Only answers from ATMOS
+itself count: while a row is unconfirmed or due for a recheck, the plan asks
+for a fetch that bypasses the ATMOS cache (Plan.upstream), and empty answers
+that may have come from the cache do not add to the count. Skipped parameters end up
+in the ERRORS sheet as "No data expected".
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .progress import bump
+
+AVAILABILITY_ENABLED = os.getenv("AVAILABILITY_ENABLED", "1") == "1"
+AVAILABILITY_PATH = os.getenv("AVAILABILITY_PATH", os.path.join("cache", "availability.sqlite"))
+AVAILABILITY_SETTLE_DAYS = float(os.getenv("AVAILABILITY_SETTLE_DAYS", "2"))
+AVAILABILITY_MIN_PROBE_DAYS = float(os.getenv("AVAILABILITY_MIN_PROBE_DAYS", "30"))
+AVAILABILITY_DEAD_DAYS = float(os.getenv("AVAILABILITY_DEAD_DAYS", "90"))
+AVAILABILITY_RECHECK_DAYS = float(os.getenv("AVAILABILITY_RECHECK_DAYS", "7"))
+AVAILABILITY_CONFIRMATIONS = int(os.getenv("AVAILABILITY_CONFIRMATIONS", "2"))
+
+TIME_FMT = "%Y-%m-%dT%H:%M"
+MINUTE = pd.Timedelta(minutes=1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS availability (
+    site_id       TEXT NOT NULL,
+    param         TEXT NOT NULL,
+    checked_from  TEXT NOT NULL,     -- TIME_FMT, inclusive
+    checked_until TEXT NOT NULL,     -- TIME_FMT, inclusive
+    first_ts      TEXT,              -- first valid data in the checked range (NULL = none)
+    last_ts       TEXT,              -- end of the last valid bucket in the checked range
+    checked_at    REAL NOT NULL,     -- unix time of the last fetch that updated the row
+    empty_fetches INTEGER NOT NULL DEFAULT 0,  -- fetches in a row that found no valid data
+    PRIMARY KEY (site_id, param)
+) WITHOUT ROWID;
+"""
+
+# columns added after the first release; ALTERed into existing databases
+ADDED_COLUMNS = {"empty_fetches": "INTEGER NOT NULL DEFAULT 0"}
+
+# aggregation -> pandas offset of one bucket
+BUCKET = {
+    "15min": pd.Timedelta(minutes=15),
+    "hourly": pd.Timedelta(hours=1),
+    "daily": pd.Timedelta(days=1),
+    "monthly": pd.DateOffset(months=1),
+    "yearly": pd.DateOffset(years=1),
+}
+
+_local = threading.local()
+
+
+class Plan(NamedTuple):
+    params: List[str]          # parameters to fetch
+    start: str                 # fetch window (TIME_FMT), possibly narrower than the export's
+    end: str
+    skipped: Dict[str, str]    # param -> ERRORS message
+    upstream: bool = False     # fetch from ATMOS, not the cache (confirms / rechecks what the index knows)
+
+
+def _conn() -> sqlite3.Connection:
+    """One connection per thread (and per process)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(os.path.abspath(AVAILABILITY_PATH)), exist_ok=True)
+        conn = sqlite3.connect(AVAILABILITY_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(availability)")}
+        for name, decl in ADDED_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE availability ADD COLUMN {name} {decl}")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _ts(value: Optional[str]) -> Optional[pd.Timestamp]:
+    return None if value is None else pd.Timestamp(value)
+
+
+def _fmt(ts: pd.Timestamp) -> str:
+    return ts.strftime(TIME_FMT)
+
+
+def _bucket_start(ts: pd.Timestamp, aggregation: str) -> pd.Timestamp:
+    if aggregation == "monthly":
+        return ts.to_period("M").start_time
+    if aggregation == "yearly":
+        return ts.to_period("Y").start_time
+    return ts.floor(BUCKET.get(aggregation, BUCKET["hourly"]))
+
+
+def _bucket_end(ts: pd.Timestamp, aggregation: str) -> pd.Timestamp:
+    """Last minute of the bucket containing ts."""
+    return _bucket_start(ts, aggregation) + BUCKET.get(aggregation, BUCKET["hourly"]) - MINUTE
+
+
+def _empty_ranges(row) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Inclusive ranges known to hold no valid data."""
+    checked_from, checked_until = _ts(row["checked_from"]), _ts(row["checked_until"])
+    if row["first_ts"] is None:
+        return [(checked_from, checked_until)]
+    out = []
+    first, last = _ts(row["first_ts"]), _ts(row["last_ts"])
+    if first > checked_from:
+        out.append((checked_from, first - MINUTE))
+    if last < checked_until:
+        out.append((last + MINUTE, checked_until))
+    return out
+
+
+def _remaining(start: pd.Timestamp, end: pd.Timestamp, empty) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Bounding range of [start, end] minus the empty ranges (None = nothing left)."""
+    pieces = [(start, end)]
+    for lo, hi in empty:
+        cut = []
+        for a, b in pieces:
+            if hi < a or lo > b:
+                cut.append((a, b))
+                continue
+            if a < lo:
+                cut.append((a, lo - MINUTE))
+            if b > hi:
+                cut.append((hi + MINUTE, b))
+        pieces = cut
+    if not pieces:
+        return None
+    return min(a for a, _ in pieces), max(b for _, b in pieces)
+
+
+def _days(delta: pd.Timedelta) -> float:
+    return delta / pd.Timedelta(days=1)
+
+
+def _trusted(row, now: float) -> bool:
+    """Recent enough, and not resting on a single empty answer."""
+    if now - row["checked_at"] > AVAILABILITY_RECHECK_DAYS * 86400:
+        return False
+    return row["empty_fetches"] == 0 or row["empty_fetches"] >= AVAILABILITY_CONFIRMATIONS
+
+
+def _skip_reason(row, start: pd.Timestamp) -> Optional[str]:
+    """Skip a window that reaches past the checked range, for stations/params known to be silent."""
+    checked_from, checked_until = _ts(row["checked_from"]), _ts(row["checked_until"])
+    if row["first_ts"] is None:
+        if _days(checked_until - checked_from) >= AVAILABILITY_MIN_PROBE_DAYS:
+            return f"No data expected: not reported by this station ({row['checked_from']} to {row['checked_until']} checked)"
+        return None
+    last = _ts(row["last_ts"])
+    if start > last and _days(checked_until - last) >= AVAILABILITY_DEAD_DAYS:
+        return f"No data expected: no data since {row['last_ts']} ({row['checked_until']} checked)"
+    return None
+
+
+def plan(site_id: str, params: List[str], start: str, end: str, aggregation: str, stats=None) -> Plan:
+    """What to fetch for one station (all params over the export window when nothing is known)."""
+    if not AVAILABILITY_ENABLED:
+        return Plan(list(params), start, end, {})
+
+    marks = ",".join("?" * len(params))
+    rows = {
+        row["param"]: row
+        for row in _conn().execute(
+            f"SELECT * FROM availability WHERE site_id = ? AND param IN ({marks})", (site_id, *params)
+        ).fetchall()
+    } if params else {}
+
+    window_start, window_end = pd.Timestamp(start), pd.Timestamp(end)
+    now = time.time()
+    keep, skipped, lo, hi = [], {}, None, None
+    upstream = False
+    for param in params:
+        row = rows.get(param)
+        if row is None:
+            keep.append(param)
+            lo, hi = window_start, window_end
+            continue
+        left = _remaining(window_start, window_end, _empty_ranges(row))
+        if not _trusted(row, now):
+            keep.append(param)
+            lo, hi = window_start, window_end
+            # the index would skip or narrow this window: check with ATMOS, not the cache
+            upstream = upstream or left != (window_start, window_end) or _skip_reason(row, window_start) is not None
+            continue
+        if left is None:
+            skipped[param] = (
+                f"No data expected: no data from {start} to {end} in earlier fetches "
+                f"({row['checked_from']} to {row['checked_until']} checked)"
+            )
+            continue
+        reason = _skip_reason(row, window_start)
+        if reason:
+            skipped[param] = reason
+            continue
+        keep.append(param)
+        lo = left[0] if lo is None else min(lo, left[0])
+        hi = left[1] if hi is None else max(hi, left[1])
+
+    if skipped:
+        bump(stats, "availability_skipped", len(skipped))
+    if not keep:
+        return Plan([], start, end, skipped)
+    if upstream:
+        bump(stats, "availability_rechecks")
+
+    # whole buckets, inside the export window
+    lo = max(window_start, _bucket_start(lo, aggregation))
+    hi = min(window_end, _bucket_end(hi, aggregation))
+    if (lo, hi) != (window_start, window_end):
+        bump(stats, "availability_narrowed")
+    return Plan(keep, _fmt(lo), _fmt(hi), skipped, upstream)
+
+
+def record(
+    site_id: str, start: str, end: str, aggregation: str, observed: Dict[str, Optional[np.ndarray]],
+    upstream: bool = True,
+):
+    """
+    Merge one clean fetch of [start, end] into the index.
+    observed: {param: datetime64 bucket starts with valid data (empty / None = no data)}.
+    upstream: the answer certainly came from ATMOS (not the cache); only those
+    confirm an empty answer.
+    """
+    if not AVAILABILITY_ENABLED or not observed:
+        return
+    now = time.time()
+    checked_from = pd.Timestamp(start)
+    checked_until = min(pd.Timestamp(end), pd.Timestamp.now().floor("min") - pd.Timedelta(days=AVAILABILITY_SETTLE_DAYS))
+    if checked_until < checked_from:
+        return
+
+    conn = _conn()
+    marks = ",".join("?" * len(observed))
+    existing = {
+        row["param"]: row
+        for row in conn.execute(
+            f"SELECT * FROM availability WHERE site_id = ? AND param IN ({marks})", (site_id, *observed)
+        ).fetchall()
+    }
+
+    updates = []
+    for param, times in observed.items():
+        first = last = None
+        if times is not None and len(times):
+            times = pd.DatetimeIndex(times)
+            times = times[times <= checked_until]
+            if len(times):
+                first, last = times.min(), min(checked_until, _bucket_end(times.max(), aggregation))
+
+        lo, hi = checked_from, checked_until
+        empty_fetches = 1 if first is None else 0
+        row = existing.get(param)
+        if row is not None:
+            old_lo, old_hi = _ts(row["checked_from"]), _ts(row["checked_until"])
+            # contiguous with what is known -> union; otherwise the newer range replaces it
+            if lo <= old_hi + MINUTE and hi >= old_lo - MINUTE:
+                lo, hi = min(lo, old_lo), max(hi, old_hi)
+                if first is None:
+                    empty_fetches = row["empty_fetches"] + 1 if upstream else max(1, row["empty_fetches"])
+                if row["first_ts"] is not None:
+                    old_first, old_last = _ts(row["first_ts"]), _ts(row["last_ts"])
+                    first = old_first if first is None else min(first, old_first)
+                    last = old_last if last is None else max(last, old_last)
+
+        updates.append((
+            site_id, param, _fmt(lo), _fmt(hi),
+            None if first is None else _fmt(first), None if last is None else _fmt(last), now, empty_fetches,
+        ))
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO availability "
+        "(site_id, param, checked_from, checked_until, first_ts, last_ts, checked_at, empty_fetches) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        updates,
+    )
@@ -0,0 +1,343 @@
+"""
+Persistent on-disk cache of ATMOS station time series (SQLite).
+
+Every (site_id, param, aggregation, gaps, gap_value) is one cache key. Points
+are stored per key, and a coverage table remembers which time ranges of that
+key were already fetched, so a request only downloads the sub-ranges that are
+missing and stitches them together with what is on disk.
+
+Ranges close to the time they were fetched (CACHE_MUTABLE_WINDOW) may still
+change upstream; they are trusted for CACHE_TTL seconds and then re-fetched.
+When the database grows past CACHE_MAX_BYTES the least recently used keys are
+evicted.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .columns import find_site_col, resolve_columns, typed_frame
+from .progress import bump
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join("cache", "atmos_cache.sqlite"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(1024 ** 3)))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(6 * 3600)))
+CACHE_MUTABLE_WINDOW = int(os.getenv("CACHE_MUTABLE_WINDOW", str(2 * 86400)))
+
+TIME_FMT = "%Y-%m-%dT%H:%M"
+MINUTE = 60
+
+# pandas bucket for each aggregation (missing sub-ranges are widened to whole buckets)
+BUCKET = {"15min": "15min", "hourly": "h", "daily": "D", "monthly": "M", "yearly": "Y"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    key   TEXT    NOT NULL,
+    ts    INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (key, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    key        TEXT    NOT NULL,
+    start      INTEGER NOT NULL,
+    end        INTEGER NOT NULL,
+    fetched_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_key ON coverage (key);
+CREATE TABLE IF NOT EXISTS keys (
+    key         TEXT PRIMARY KEY,
+    last_access INTEGER NOT NULL
+);
+"""
+
+_local = threading.local()
+_evict_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    """One connection per thread (and per process)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(os.path.abspath(CACHE_PATH)), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+# ----------------------------- time helpers -----------------------------
+# timestamps are naive (ATMOS local time) and stored as epoch seconds "as if UTC"
+
+def _epoch(value: str) -> int:
+    return int(pd.Timestamp(value).value // 10 ** 9)
+
+
+def _now() -> int:
+    return int(pd.Timestamp.now().value // 10 ** 9)
+
+
+def _fmt(epoch: int) -> str:
+    return pd.Timestamp(epoch, unit="s").strftime(TIME_FMT)
+
+
+def _snap(start: int, end: int, aggregation: str) -> Tuple[int, int]:
+    """Widen [start, end] to whole aggregation buckets."""
+    bucket = BUCKET.get(aggregation, "h")
+    s = pd.Timestamp(start, unit="s")
+    e = pd.Timestamp(end, unit="s")
+    if bucket in ("M", "Y"):
+        s = s.to_period(bucket).start_time
+        e = e.to_period(bucket).end_time.floor("min")
+    else:
+        s = s.floor(bucket)
+        e = e.floor(bucket) + pd.tseries.frequencies.to_offset(bucket) - pd.Timedelta(minutes=1)
+    return int(s.value // 10 ** 9), int(e.value // 10 ** 9)
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out = []
+    for s, e in sorted(ranges):
+        if out and s <= out[-1][1] + MINUTE:
+            out[-1] = (out[-1][0], max(out[-1][1], e))
+        else:
+            out.append((s, e))
+    return out
+
+
+def _missing(covered: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    gaps = []
+    cursor = start
+    for s, e in covered:
+        if e < cursor:
+            continue
+        if s > end:
+            break
+        if s > cursor:
+            gaps.append((cursor, s - MINUTE))
+        cursor = max(cursor, e + MINUTE)
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+# ----------------------------- storage -----------------------------
+
+def _key(site_id: str, param: str, aggregation: str, gaps: int, gap_value: str) -> str:
+    return f"{site_id}|{param}|{aggregation}|{gaps}|{gap_value}"
+
+
+def _covered(conn: sqlite3.Connection, key: str, now: int) -> List[Tuple[int, int]]:
+    ranges = []
+    for s, e, fetched_at in conn.execute("SELECT start, end, fetched_at FROM coverage WHERE key = ?", (key,)):
+        if now - fetched_at > CACHE_TTL:
+            # past its TTL only the part that was already settled when fetched counts
+            e = min(e, fetched_at - CACHE_MUTABLE_WINDOW)
+        if e >= s:
+            ranges.append((s, e))
+    return _merge(ranges)
+
+
+def _store(conn, df, site_ids, params, keys, ranges: List[Tuple[int, int]]):
+    """
+    Write a fetched frame into the cache and mark ranges covered for every
+    requested (site, param) key - also those that came back without rows (dead
+    station, column not reported), so they are not downloaded again. A frame
+    without dt_time is not a data response and records nothing.
+    """
+    if df is None or "dt_time" not in df.columns:
+        return
+    if df.empty:
+        groups = []
+    elif len(site_ids) == 1:
+        groups = [(site_ids[0], df)]
+    else:
+        site_col = find_site_col(df)
+        if site_col is None:
+            return  # rows can't be attributed to a station
+        groups = df.groupby(df[site_col].astype(str).str.strip(), sort=False)
+
+    now = _now()
+    requested = [keys[(site_id, param)] for site_id in site_ids for param in params]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for site_id, sub in groups:
+            if site_id not in site_ids:
+                continue
+            # df is typed at parse time (columns.typed_frame)
+            times = sub["dt_time"]
+            mask = times.notna().to_numpy()
+            if not mask.any():
+                continue
+            epochs = times[mask].to_numpy().astype("datetime64[s]").astype(np.int64).tolist()
+
+            for param, col in resolve_columns(sub, params).items():
+                numeric = sub[col].to_numpy(dtype=float, na_value=np.nan)[mask]
+                values = numeric.astype(object)
+                values[np.isnan(numeric)] = None
+                key = keys[(site_id, param)]
+
+                conn.executemany(
+                    "INSERT OR REPLACE INTO points (key, ts, value) VALUES (?, ?, ?)",
+                    zip([key] * len(epochs), epochs, values.tolist()),
+                )
+        conn.executemany(
+            "INSERT INTO coverage (key, start, end, fetched_at) VALUES (?, ?, ?, ?)",
+            [(key, start, end, now) for key in requested for start, end in ranges],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO keys (key, last_access) VALUES (?, ?)",
+            [(key, now) for key in requested],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _load(conn, site_ids, params, keys, start: int, end: int) -> pd.DataFrame:
+    """Rebuild the ATMOS-shaped frame (dt_time, [site_id], <params>) from the cache."""
+    by_key = {key: site_param for site_param, key in keys.items()}
+    key_list = list(by_key)
+
+    rows = []
+    for i in range(0, len(key_list), 500):
+        chunk = key_list[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        rows.extend(conn.execute(
+            f"SELECT key, ts, value FROM points WHERE key IN ({marks}) AND ts BETWEEN ? AND ?",
+            (*chunk, start, end),
+        ).fetchall())
+        conn.execute(f"UPDATE keys SET last_access = ? WHERE key IN ({marks})", (_now(), *chunk))
+
+    columns = (["site_id"] if len(site_ids) > 1 else []) + ["dt_time"] + list(params)
+    if not rows:
+        return pd.DataFrame(columns=columns)
+
+    # pivot (key, ts, value) rows to one row per (site_id, ts) sorted like the upstream CSV,
+    # with integer codes instead of per-row string handling (hot path of small cached windows)
+    key_codes, key_uniques = pd.factorize(pd.Series([r[0] for r in rows]))
+    sites = sorted({by_key[k][0] for k in key_uniques})
+    site_code = np.array([sites.index(by_key[k][0]) for k in key_uniques], dtype=np.int64)
+    param_code = np.array([params.index(by_key[k][1]) for k in key_uniques], dtype=np.int64)
+    ts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    values = np.array([r[2] for r in rows], dtype=float)  # None -> nan
+
+    row_ids, row_of = np.unique((site_code[key_codes] << 34) + ts, return_inverse=True)
+    wide_values = np.full((len(row_ids), len(params)), np.nan)
+    wide_values[row_of, param_code[key_codes]] = values
+
+    wide = pd.DataFrame(wide_values, columns=list(params))
+    wide.insert(0, "dt_time", pd.to_datetime(row_ids & ((1 << 34) - 1), unit="s"))
+    wide.insert(0, "site_id", np.array(sites, dtype=object)[row_ids >> 34])
+    return typed_frame(wide[columns])
+
+
+def _evict_if_needed(conn: sqlite3.Connection):
+    """Size-based LRU eviction down to 90% of CACHE_MAX_BYTES."""
+    if CACHE_MAX_BYTES <= 0:
+        return
+
+    def used_bytes():
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    with _evict_lock:
+        if used_bytes() <= CACHE_MAX_BYTES:
+            return
+        target = int(CACHE_MAX_BYTES * 0.9)
+        while used_bytes() > target:
+            victims = [k for (k,) in conn.execute("SELECT key FROM keys ORDER BY last_access LIMIT 50")]
+            if not victims:
+                break
+            marks = ",".join("?" * len(victims))
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("points", "coverage", "keys"):
+                conn.execute(f"DELETE FROM {table} WHERE key IN ({marks})", victims)
+            conn.execute("COMMIT")
+
+
+# ----------------------------- entry point -----------------------------
+
+def fetch_through(
+    fetch_fn: Callable[..., pd.DataFrame],
+    site_ids: List[str],
+    params: List[str],
+    start: str,
+    end: str,
+    gaps: int,
+    gap_value: str,
+    aggregation: str,
+    data_mode: str = "api",
+    stats: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """
+    Serve a fetch_csv call from the cache, downloading (with fetch_fn) only the
+    sub-ranges not covered yet. stats gets "cache_hits" / "cache_partial" / "cache_misses".
+
+    Chunks fetch_fn reports in df.attrs["failed_chunks"] are not marked covered
+    (so they are fetched again next time) and are passed on in the result's attrs.
+    """
+    if data_mode == "raw15" or aggregation == "15min":
+        aggregation = "15min"
+
+    s, e = _epoch(start), _epoch(end)
+    conn = _conn()
+    now = _now()
+
+    keys = {
+        (site_id, param): _key(site_id, param, aggregation, gaps, gap_value)
+        for site_id in site_ids for param in params
+    }
+    missing_by_key = {key: _missing(_covered(conn, key, now), s, e) for key in keys.values()}
+    missing = _merge([gap for gaps_ in missing_by_key.values() for gap in gaps_])
+
+    failed_chunks = []
+
+    def download(a: int, b: int, start_str: str, end_str: str, sites=site_ids, wanted=params) -> pd.DataFrame:
+        df = fetch_fn(
+            site_ids=sites, params=wanted, start=start_str, end=end_str,
+            gaps=gaps, gap_value=gap_value, aggregation=aggregation, data_mode=data_mode,
+        )
+        failed = df.attrs.get("failed_chunks") or []
+        failed_chunks.extend(failed)
+        ok = _missing(_merge([(_epoch(c["start"]), _epoch(c["end"])) for c in failed]), a, b)
+        _store(conn, df, sites, wanted, keys, ok)
+        return df
+
+    if not missing:
+        bump(stats, "cache_hits")
+        return _load(conn, site_ids, params, keys, s, e)
+
+    if all(gaps_ == [(s, e)] for gaps_ in missing_by_key.values()):
+        # nothing cached for this window -> one plain call, returned as-is
+        bump(stats, "cache_misses")
+        df = download(s, e, start, end)
+        _evict_if_needed(conn)
+        return df
+
+    bump(stats, "cache_partial")
+    for a, b in missing:
+        # only the stations / params that still have a gap in this range
+        gappy = [
+            site_param for site_param, key in keys.items()
+            if any(gs <= b and ge >= a for gs, ge in missing_by_key[key])
+        ]
+        sites = [site_id for site_id in site_ids if any(site == site_id for site, _ in gappy)]
+        wanted = [param for param in params if any(p == param for _, p in gappy)]
+        a, b = _snap(a, b, aggregation)
+        download(a, b, _fmt(a), _fmt(b), sites, wanted)
+    _evict_if_needed(conn)
+    df = _load(conn, site_ids, params, keys, s, e)
+    if failed_chunks:
+        df.attrs["failed_chunks"] = failed_chunks
+    return df
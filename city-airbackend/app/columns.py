@@ -0,0 +1,72 @@
+from typing import Dict, Iterable
+
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_float_dtype, is_string_dtype
+
+# column that identifies the station in a multi-site response
+SITE_COLUMNS = ("site_id", "siteid", "imei", "device_id", "deviceid", "device")
+
+
+def _match(cleaned, target: str):
+    for col, col_clean in cleaned:
+        if col_clean == target:
+            return col
+    for col, col_clean in cleaned:
+        if target in col_clean:
+            return col
+    return None
+
+
+def find_pollutant_col(df: pd.DataFrame, pollutant_code: str):
+    """
+    Column holding `pollutant_code` in an ATMOS response. An exact (case/space
+    insensitive) match wins, otherwise the first column containing the code.
+    """
+    return resolve_columns(df, [pollutant_code]).get(pollutant_code)
+
+
+def resolve_columns(df: pd.DataFrame, pollutant_codes: Iterable[str]) -> Dict[str, str]:
+    """{pollutant_code: column} for all codes found, with one pass over the column names."""
+    cleaned = [(col, str(col).lower().replace(" ", "")) for col in df.columns if col != "dt_time"]
+    out = {}
+    for code in pollutant_codes:
+        col = _match(cleaned, code.lower().replace(" ", ""))
+        if col is not None:
+            out[code] = col
+    return out
+
+
+def typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The single parse stage of an ATMOS response: dt_time as datetime64, the
+    station column as str and every other column as float64 (gap markers and
+    junk -> NaN). Columns that already have their type (what the pyarrow CSV
+    engine infers for a normal response) are left untouched, so this is cheap.
+    """
+    if df.empty:
+        return df
+    site_col = find_site_col(df)
+    converted = {}
+    for col in df.columns:
+        values = df[col]
+        if col == "dt_time":
+            if not is_datetime64_any_dtype(values):
+                converted[col] = pd.to_datetime(values, errors="coerce")
+        elif col == site_col:
+            if not is_string_dtype(values):
+                converted[col] = values.astype(str)
+        elif not is_float_dtype(values):
+            converted[col] = pd.to_numeric(values, errors="coerce").astype(float)
+    return df.assign(**converted) if converted else df
+
+
+def no_rows() -> pd.DataFrame:
+    """A clean answer without rows (empty body): typed, but only the dt_time column."""
+    return pd.DataFrame({"dt_time": pd.Series(dtype="datetime64[s]")})
+
+
+def find_site_col(df: pd.DataFrame):
+    for col in df.columns:
+        if str(col).lower().replace(" ", "") in SITE_COLUMNS:
+            return col
+    return None
@@ -0,0 +1,100 @@
+"""
+CPU stage of the fetch pipeline: CSV bodies parsed in worker processes.
+
+The I/O threads (atmos_client) only download; a response whose Content-Length
+is at least PARSE_OFFLOAD_MIN_BYTES is read whole and handed to a
+ProcessPoolExecutor that parses it into typed columns (columns.typed_frame) and
+sends it back as an Arrow IPC buffer, which is rebuilt here without re-parsing.
+Smaller responses, and those of unknown length, keep the streaming parse. Parsing then scales across cores and
+no longer holds the API process's GIL.
+
+PARSE_PROCESSES: worker processes (default: cores - 1, at most 4; 0 = parse in
+the I/O thread, streaming, as before). Workers are started with forkserver, so
+scripts that run exports directly need the usual `if __name__ == "__main__"` guard.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from .columns import typed_frame
+
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(max(0, min(4, (os.cpu_count() or 1) - 1)))))
+PARSE_OFFLOAD_MIN_BYTES = int(os.getenv("PARSE_OFFLOAD_MIN_BYTES", str(256 * 1024)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return PARSE_PROCESSES > 0
+
+
+def offloads(content_length: Optional[str]) -> bool:
+    """Whether a response of this Content-Length is downloaded whole for the pool (unknown: streamed)."""
+    if not enabled() or not content_length or not content_length.isdigit():
+        return False
+    return int(content_length) >= PARSE_OFFLOAD_MIN_BYTES
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver: workers don't inherit the API's threads / sockets
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context("forkserver")
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard(pool: ProcessPoolExecutor):
+    """Drop a broken pool (a worker died); the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _parse(body: bytes, engine: str) -> pd.DataFrame:
+    return typed_frame(pd.read_csv(io.BytesIO(body), engine=engine))
+
+
+def _parse_to_ipc(body: bytes, engine: str) -> bytes:
+    """Worker side: parse + type, then serialize the columns as an Arrow IPC stream."""
+    table = pa.Table.from_pandas(_parse(body, engine), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def parse_csv(body: bytes, engine: str) -> pd.DataFrame:
+    """Typed frame of a complete CSV body; large bodies are parsed in the process pool."""
+    if not enabled() or len(body) < PARSE_OFFLOAD_MIN_BYTES:
+        return _parse(body, engine)
+    pool = _get_pool()
+    try:
+        buf = pool.submit(_parse_to_ipc, body, engine).result()
+    except BrokenProcessPool:
+        _discard(pool)
+        return _parse(body, engine)
+    return pa.ipc.open_stream(buf).read_all().to_pandas()
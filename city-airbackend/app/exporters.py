@@ -0,0 +1,138 @@
+"""
+Export writers. Every export produces the same logical tables:
+
+  INFO                       - request parameters, station counts, station names
+  <POLLUTANT>                - wide city-average series (Timestamp + one column per city)
+  <POLLUTANT>_UPTIME         - per-station uptime
+  ERRORS                     - failed fetches
+
+"xlsx" writes them as sheets of one workbook. "parquet", "csv.gz" and "arrow"
+write one file per table into a zip bundle, with INFO as INFO.json (and, for
+parquet/arrow, also embedded in every table's schema metadata).
+"""
+
+import gzip
+import io
+import json
+import zipfile
+from typing import Dict
+
+import pandas as pd
+
+from .formats import ExportFormat
+from .xlsx_writer import StreamingWorkbook
+
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def open_writer(out_path: str, fmt: ExportFormat = "xlsx"):
+    if fmt == "xlsx":
+        return XlsxExport(out_path)
+    if fmt in ("parquet", "csv.gz", "arrow"):
+        return BundleExport(out_path, fmt)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+class XlsxExport:
+    def __init__(self, out_path: str):
+        self.workbook = StreamingWorkbook(out_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_info(self, info: Dict[str, str], city_counts: pd.DataFrame, stations: pd.DataFrame):
+        info_top = pd.DataFrame(list(info.items()), columns=["Parameter", "Value"])
+        current_row = self.workbook.write_frame("INFO", info_top) + 1
+        current_row = self.workbook.write_frame("INFO", city_counts, startrow=current_row) + 2
+        if not stations.empty:
+            self.workbook.write_frame("INFO", stations, startrow=current_row)
+
+    def write_table(self, name: str, df: pd.DataFrame):
+        if len(df) + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(
+                f"Sheet '{name}' has {len(df)} rows, more than Excel allows ({EXCEL_MAX_ROWS - 1}). "
+                f"Use format parquet, csv.gz or arrow for this range."
+            )
+        self.workbook.write_frame(name, df)
+
+    def close(self):
+        self.workbook.close()
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sheet tables mix "" placeholders with numbers (uptime rows); columnar formats
+    need one type per column. "" becomes null and all-numeric columns become numeric.
+    """
+    out = df.copy()
+    for col in out.columns:
+        s = out[col]
+        if s.dtype != object:
+            continue
+        s = s.where(s != "", None)
+        numeric = pd.to_numeric(s, errors="coerce")
+        if numeric.notna().sum() == s.notna().sum():
+            out[col] = numeric
+        else:
+            out[col] = s.map(lambda v: v if v is None else str(v))
+    out.columns = [str(c) for c in out.columns]
+    return out
+
+
+class BundleExport:
+    def __init__(self, out_path: str, fmt: ExportFormat):
+        self.fmt = fmt
+        self.info = {}
+        self.zip = zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_info(self, info: Dict[str, str], city_counts: pd.DataFrame, stations: pd.DataFrame):
+        self.info = {
+            **info,
+            "Station Count": dict(zip(city_counts.get("City", []), city_counts.get("Station Count", []))),
+            "Stations": {
+                col.replace(" Stations", ""): [s for s in stations[col] if s]
+                for col in stations.columns
+            },
+        }
+        self.zip.writestr("INFO.json", json.dumps(self.info, indent=2, default=str))
+
+    def _member(self, filename: str, compressed: bool):
+        """Writable zip member; payloads that are compressed already are stored as-is."""
+        info = zipfile.ZipInfo(filename)
+        info.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+        return self.zip.open(info, "w", force_zip64=True)
+
+    def write_table(self, name: str, df: pd.DataFrame):
+        if self.fmt == "csv.gz":
+            with self._member(f"{name}.csv.gz", compressed=True) as member:
+                with gzip.GzipFile(fileobj=member, mode="wb") as gz:
+                    with io.TextIOWrapper(gz, encoding="utf-8", newline="") as text:
+                        df.to_csv(text, index=False)
+            return
+
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), b"airq_info": json.dumps(self.info, default=str).encode()}
+        table = table.replace_schema_metadata(metadata)
+
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+            with self._member(f"{name}.parquet", compressed=True) as member:
+                pq.write_table(table, member, compression="zstd")
+        else:
+            with self._member(f"{name}.arrow", compressed=False) as member:
+                with pa.ipc.new_file(member, table.schema) as ipc:
+                    ipc.write_table(table)
+
+    def close(self):
+        self.zip.close()
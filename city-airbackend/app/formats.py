@@ -0,0 +1,23 @@
+"""
+Export format table. Kept free of heavy imports so the API layer can use it
+without loading pandas / xlsxwriter / pyarrow.
+"""
+
+from typing import Literal
+
+ExportFormat = Literal["xlsx", "parquet", "csv.gz", "arrow"]
+
+# format -> (file suffix, media type of the downloaded file)
+EXPORT_FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": (".parquet.zip", "application/zip"),
+    "csv.gz": (".csv.gz.zip", "application/zip"),
+    "arrow": (".arrow.zip", "application/zip"),
+}
+
+
+def media_type_for(path: str) -> str:
+    for suffix, media_type in sorted(EXPORT_FORMATS.values(), key=lambda v: -len(v[0])):
+        if path.endswith(suffix):
+            return media_type
+    return "application/octet-stream"
@@ -0,0 +1,403 @@
+"""
+Durable export job queue (SQLite).
+
+Jobs are rows in JOBS_DB_PATH, so their state survives restarts and is shared
+by every uvicorn worker process pointing at the same file. Each process runs
+JOB_WORKERS threads that claim queued jobs (highest priority first, then FIFO)
+with an atomic UPDATE, so a job is only ever run by one worker.
+
+A process heartbeats the jobs it is running; a "running" job whose heartbeat
+is older than JOB_LEASE seconds (its process died) is put back in the queue.
+Finished jobs and their temp dirs are removed JOB_TTL seconds after they end.
+
+Jobs carry a request fingerprint. Submitting a request whose fingerprint
+matches a queued/running job, or a job that finished successfully less than
+RESULT_TTL seconds ago, returns that job instead of creating a new one.
+Finished results also count against RESULT_CACHE_MAX_BYTES; the least
+recently used ones are deleted first when it is exceeded.
+
+Big exports are split into work units (app.shards) in the units table of
+the same database, so any process sharing it can fetch part of a job.
+
+Pipeline events (app.progress) are appended to the events table, which the
+/progress/{job_id}/stream endpoint tails; any process can serve the stream.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from . import metrics
+from .progress import add_listener, progress_store, stats_store
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("jobs", "jobs.sqlite"))
+# per-job parquet shards of sharded exports (app.shards); must be shared like the database
+SHARDS_PATH = os.getenv("SHARDS_PATH", os.path.join(os.path.dirname(JOBS_DB_PATH), "shards"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE = int(os.getenv("JOB_LEASE", "300"))
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 3600)))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+RESULT_TTL = int(os.getenv("RESULT_TTL", "3600"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT    NOT NULL,           -- queued | running | done | failed
+    priority    INTEGER NOT NULL DEFAULT 0, -- higher runs first
+    request     TEXT    NOT NULL,           -- ExportRequest as JSON
+    out_path    TEXT    NOT NULL,
+    tmpdir      TEXT,
+    progress    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    stats       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    created_at  REAL    NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    heartbeat   REAL,
+    fingerprint TEXT,                       -- sha256 of the normalized request
+    size        INTEGER,                    -- result file size once done
+    last_access REAL                        -- last submit or finish, for result LRU
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at);
+CREATE TABLE IF NOT EXISTS events (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id      TEXT    NOT NULL,
+    ts          REAL    NOT NULL,
+    event       TEXT    NOT NULL,           -- queued | started | progress | phase | site | done | failed
+    data        TEXT    NOT NULL            -- JSON payload
+);
+CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq);
+CREATE TABLE IF NOT EXISTS units (
+    job_id      TEXT    NOT NULL,
+    unit        INTEGER NOT NULL,           -- index of the unit within the job
+    status      TEXT    NOT NULL,           -- queued | running | done | failed
+    payload     TEXT    NOT NULL,           -- stations + fetch arguments as JSON
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    heartbeat   REAL,
+    shard_path  TEXT,                       -- parquet shard once done
+    result      TEXT,                       -- JSON: pollutants present, error rows, stats
+    error       TEXT,
+    created_at  REAL    NOT NULL,
+    PRIMARY KEY (job_id, unit)
+);
+CREATE INDEX IF NOT EXISTS units_queue ON units (status, created_at);
+"""
+
+# columns added after the first release; ALTERed into existing databases
+ADDED_COLUMNS = {"fingerprint": "TEXT", "size": "INTEGER", "last_access": "REAL"}
+
+_local = threading.local()
+_wakeup = threading.Event()
+_running: Dict[str, str] = {}   # job_id -> worker name (jobs running in this process)
+_running_lock = threading.Lock()
+_started = False
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(os.path.abspath(JOBS_DB_PATH)), exist_ok=True)
+        conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, decl in ADDED_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint, status)")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _event(conn: sqlite3.Connection, job_id: str, event: str, data: Optional[dict] = None):
+    conn.execute(
+        "INSERT INTO events (job_id, ts, event, data) VALUES (?, ?, ?, ?)",
+        (job_id, time.time(), event, json.dumps(data or {}, default=str)),
+    )
+
+
+# ----------------------------- API side -----------------------------
+
+def fingerprint(normalized: dict) -> str:
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def _reusable(conn: sqlite3.Connection, fp: str, now: float) -> Optional[sqlite3.Row]:
+    """In-flight job, or recent successful one whose file still exists, with this fingerprint."""
+    candidates = conn.execute(
+        "SELECT id, status, out_path FROM jobs WHERE fingerprint = ? AND "
+        "(status IN ('queued', 'running') OR (status = 'done' AND finished_at >= ?)) "
+        "ORDER BY status = 'done', created_at DESC",
+        (fp, now - RESULT_TTL),
+    ).fetchall()
+    for job in candidates:
+        if job["status"] != "done" or os.path.exists(job["out_path"]):
+            return job
+    return None
+
+
+def submit(request: dict, out_path: str, tmpdir: str, priority: int = 0, fp: Optional[str] = None) -> str:
+    """
+    Queue an export and return its job id. With a fingerprint, an identical
+    in-flight or recently finished job is returned instead (check its out_path).
+    """
+    conn = _conn()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        job = _reusable(conn, fp, now) if fp else None
+        if job is not None:
+            job_id = job["id"]
+            conn.execute("UPDATE jobs SET last_access = ? WHERE id = ?", (now, job_id))
+        else:
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO jobs (id, status, priority, request, out_path, tmpdir, created_at, fingerprint, last_access) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, priority, json.dumps(request), out_path, tmpdir, now, fp, now),
+            )
+            _event(conn, job_id, "queued")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    _wakeup.set()
+    return job_id
+
+
+def queue_position(job: sqlite3.Row) -> Optional[int]:
+    """1-based position among queued jobs (None once the job left the queue)."""
+    if job["status"] != "queued":
+        return None
+    ahead = _conn().execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+        "AND (priority > ? OR (priority = ? AND created_at < ?))",
+        (job["priority"], job["priority"], job["created_at"]),
+    ).fetchone()[0]
+    return ahead + 1
+
+
+def get(job_id: str) -> Optional[dict]:
+    job = _conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        return None
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "stats": json.loads(job["stats"]) if job["stats"] else None,
+        "queue_position": queue_position(job),
+        "out_path": job["out_path"],
+        "request": json.loads(job["request"]),
+    }
+
+
+def parts(job_id: str) -> List[dict]:
+    """Per-city files of an incremental export that are ready so far ("part_ready" events)."""
+    rows = _conn().execute(
+        "SELECT data FROM events WHERE job_id = ? AND event = 'part_ready' ORDER BY seq", (job_id,)
+    ).fetchall()
+    return [json.loads(data) for (data,) in rows]
+
+
+def status_counts() -> Dict[str, int]:
+    rows = _conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    return {status: n for status, n in rows}
+
+
+def events_since(job_id: str, after: int = 0, limit: int = 500) -> List[sqlite3.Row]:
+    return _conn().execute(
+        "SELECT seq, ts, event, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+        (job_id, after, limit),
+    ).fetchall()
+
+
+# ----------------------------- worker side -----------------------------
+
+def _persist_event(job_id: str, event: str, data: dict):
+    """progress listener: append the event, mirror progress + stats into the job row."""
+    conn = _conn()
+    if event == "progress":
+        stats = stats_store.get(job_id)
+        conn.execute(
+            "UPDATE jobs SET progress = ?, stats = ?, heartbeat = ? WHERE id = ?",
+            (data["progress"], json.dumps(stats) if stats else None, time.time(), job_id),
+        )
+    _event(conn, job_id, event, data)
+
+
+def _claim(worker: str) -> Optional[sqlite3.Row]:
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+        ).fetchone()
+        if job is not None:
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat = ?, "
+                "attempts = attempts + 1, progress = 0, error = NULL WHERE id = ?",
+                (worker, now, now, job["id"]),
+            )
+            _event(conn, job["id"], "started", {"worker": worker, "attempt": job["attempts"] + 1})
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return job
+
+
+def _finish(job_id: str, error: Optional[str]):
+    progress_store.pop(job_id, None)
+    stats = stats_store.pop(job_id, None)
+    conn = _conn()
+    out_path, started_at = conn.execute("SELECT out_path, started_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    size = os.path.getsize(out_path) if not error and os.path.exists(out_path) else None
+    now = time.time()
+    status = "failed" if error else "done"
+    metrics.count(f"jobs_{status}")
+    metrics.observe("atmos_export_job_seconds", status, now - (started_at or now))
+    conn.execute(
+        "UPDATE jobs SET status = ?, progress = ?, error = ?, stats = COALESCE(?, stats), finished_at = ?, "
+        "size = ?, last_access = ? WHERE id = ?",
+        (status, -1 if error else 100, error,
+         json.dumps(stats) if stats else None, now, size, now, job_id),
+    )
+    if error:
+        _event(conn, job_id, "failed", {"progress": -1, "error": error, "stats": stats})
+    else:
+        _event(conn, job_id, "done", {"progress": 100, "size": size, "stats": stats})
+
+
+def _finish_retrying(job_id: str, error: Optional[str]):
+    """_finish, retried while the database is busy (the job keeps its heartbeat meanwhile)."""
+    for attempt in range(5):
+        try:
+            _finish(job_id, error)
+            return
+        except Exception as e:
+            print(f"[jobs] recording the end of {job_id} failed: {e}")
+            time.sleep(min(30, 2 ** attempt))
+
+
+def _worker_loop(worker: str, run_fn: Callable[[str, dict, str], None]):
+    while True:
+        try:
+            job = _claim(worker)
+        except Exception as e:
+            print(f"[jobs] claim failed: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        job_id = job["id"]
+        with _running_lock:
+            _running[job_id] = worker
+        try:
+            if job["tmpdir"]:
+                os.makedirs(job["tmpdir"], exist_ok=True)
+            run_fn(job_id, json.loads(job["request"]), job["out_path"])
+            error = None
+        except Exception as e:
+            error = str(e)
+        try:
+            _finish_retrying(job_id, error)
+        finally:
+            with _running_lock:
+                _running.pop(job_id, None)
+
+
+def _delete(conn: sqlite3.Connection, job: sqlite3.Row):
+    if job["tmpdir"]:
+        shutil.rmtree(job["tmpdir"], ignore_errors=True)
+    shutil.rmtree(os.path.join(SHARDS_PATH, job["id"]), ignore_errors=True)
+    conn.execute("DELETE FROM units WHERE job_id = ?", (job["id"],))
+    conn.execute("DELETE FROM events WHERE job_id = ?", (job["id"],))
+    conn.execute("DELETE FROM jobs WHERE id = ?", (job["id"],))
+
+
+def _heartbeat(conn: sqlite3.Connection, now: float):
+    with _running_lock:
+        running = list(_running)
+    if running:
+        marks = ",".join("?" * len(running))
+        conn.execute(f"UPDATE jobs SET heartbeat = ? WHERE id IN ({marks})", (now, *running))
+
+
+def _sweep(conn: sqlite3.Connection, now: float):
+    orphaned = conn.execute(
+        "UPDATE jobs SET status = 'queued', worker = NULL "
+        "WHERE status = 'running' AND heartbeat < ? RETURNING id",
+        (now - JOB_LEASE,),
+    ).fetchall()
+    for job in orphaned:
+        _event(conn, job["id"], "queued", {"requeued": True})
+    if orphaned:
+        _wakeup.set()
+
+    expired = conn.execute(
+        "SELECT id, tmpdir FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+        (now - JOB_TTL,),
+    ).fetchall()
+    for job in expired:
+        _delete(conn, job)
+
+    # result cache over its disk budget -> drop least recently used results
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM jobs WHERE status = 'done'").fetchone()[0]
+    if total > RESULT_CACHE_MAX_BYTES:
+        for job in conn.execute(
+            "SELECT id, tmpdir, size FROM jobs WHERE status = 'done' AND size IS NOT NULL "
+            "ORDER BY last_access"
+        ).fetchall():
+            if total <= RESULT_CACHE_MAX_BYTES:
+                break
+            _delete(conn, job)
+            total -= job["size"]
+
+
+def _maintenance_loop():
+    """Heartbeat own jobs, requeue orphaned ones, clean up expired and over-budget ones."""
+    while True:
+        # a busy database only skips this round; the heartbeat is retried sooner
+        # than the lease runs out, so other processes never requeue a live job
+        for step in (_heartbeat, _sweep):
+            try:
+                step(_conn(), time.time())
+            except Exception as e:
+                print(f"[jobs] {step.__name__.strip('_')} failed: {e}")
+
+        time.sleep(min(60, max(1, JOB_LEASE // 5)))
+
+
+def start_workers(run_fn: Callable[[str, dict, str], None]):
+    """
+    Start this process' worker pool (JOB_WORKERS threads) and maintenance thread.
+    run_fn(job_id, request, out_path) does the export and raises on failure.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    add_listener(_persist_event)
+    for i in range(max(1, JOB_WORKERS)):
+        name = f"{os.getpid()}-{i}"
+        threading.Thread(target=_worker_loop, args=(name, run_fn), name=f"export-worker-{i}", daemon=True).start()
+    threading.Thread(target=_maintenance_loop, name="export-jobs-maintenance", daemon=True).start()
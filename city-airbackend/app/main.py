@@ -1,16 +1,28 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Literal, Dict, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
+import asyncio
+import json
 import os
+import shutil
+import sys
 import tempfile
+import time
 import uuid
-from threading import Thread
+from dotenv import load_dotenv
 
+# .env (REQUEST_TIMEOUT, BATCH_SIZE, ...) must be loaded before the client modules read it
+load_dotenv()
+
+# only light modules here: pandas/httpx/xlsxwriter come in with the pipeline,
+# which is imported by the first export (see run_export), not at boot
 from .site_catalog import SiteCatalog
-from .pipeline import build_excel_for_request, progress_store
+from . import jobs, metrics
+from .formats import EXPORT_FORMATS, ExportFormat, media_type_for
+from .pollutants import POLLUTANT_MAP
 
 app = FastAPI(title="City Air Quality Export API")
 
@@ -25,27 +37,6 @@ app.add_middleware(
 SITE_XLSX_PATH = os.getenv("SITE_XLSX_PATH", "site_ids_to_fetch_daily_data.xlsx")
 catalog = SiteCatalog(SITE_XLSX_PATH)
 
-POLLUTANT_MAP = {
-    "PM10": "pm10cnc",
-    "PM2.5": "pm2.5cnc",
-    "NO2": "no2ppb",
-    "CO": "co",
-    "Ozone": "o3ppb",
-    "SO2": "so2",
-    "NH3": "nh3",
-    "Benzene": "benzene",
-    "Eth-Benzene": "ethbenzene",
-    "Toluene": "toluene",
-    "Xylene": "xylene",
-    "RH": "rh",
-    "Temp": "tempc",
-    "WS": "ws",
-    "WD": "wd",
-    "CH4": "ch4",
-    "CO2": "co2",
-    "AT": "at"
-}
-
 SUPPORTED_POLLUTANTS = list(POLLUTANT_MAP.values())
 Aggregation = Literal["15min", "hourly", "daily", "monthly", "yearly"]
 
@@ -57,71 +48,275 @@ class ExportRequest(BaseModel):
     pollutants: List[str]
     gaps: int = 1
     gap_value: str = "NULL"
+    format: ExportFormat = "xlsx"
+    data_mode: Literal["live", "local"] = "live"  # local = mirrored store (app.mirror), no ATMOS calls
+    priority: int = 0
+    profile: Optional[Literal["cprofile", "pyinstrument"]] = None  # report at /progress/{id}/profile
+    incremental: bool = False  # also one file per city as soon as it is fetched (listed in /progress "parts")
+
+# operator opt-in: a profiled export costs CPU and writes a report on this server
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+
+def profile_path(out_path: str) -> str:
+    return f"{out_path}.profile.txt"
+
+def run_export(job_id: str, request: dict, out_path: str):
+    """Job worker entry point (see jobs.start_workers); raises on failure."""
+    from .pipeline import build_excel_for_request
+
+    req = ExportRequest(**request)
+    with metrics.profiled(req.profile, profile_path(out_path)):
+        build_excel_for_request(
+            catalog=catalog,
+            start=req.start,
+            end=req.end,
+            aggregation=req.aggregation,
+            cities=req.cities,
+            pollutants=req.pollutants,
+            gaps=req.gaps,
+            gap_value=req.gap_value,
+            out_path=out_path,
+            job_id=job_id,
+            fmt=req.format,
+            data_mode=req.data_mode,
+            incremental=req.incremental
+        )
+
+def request_fingerprint(req: ExportRequest, start_dt: datetime, end_dt: datetime) -> str:
+    """
+    Identity of an export's output. City and pollutant order is kept (it is
+    the column/sheet order of the file); priority does not change the result.
+    """
+    return jobs.fingerprint({
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "aggregation": req.aggregation,
+        "cities": [c.split("(")[0].strip().lower() for c in req.cities],
+        "pollutants": list(req.pollutants),
+        "gaps": req.gaps,
+        "gap_value": req.gap_value,
+        "format": req.format,
+        "data_mode": req.data_mode,
+        "profile": req.profile,
+        "incremental": req.incremental,
+    })
+
+@app.on_event("startup")
+def startup():
+    jobs.start_workers(run_export)
+    if int(os.getenv("SHARD_SITES", "0")) > 0:
+        from .shards import start_workers
+        start_workers()
+    if int(os.getenv("MIRROR_INTERVAL", "0")) > 0:
+        from .mirror import start_background
+        start_background()
+
+@app.on_event("shutdown")
+def shutdown():
+    atmos_client = sys.modules.get(f"{__package__}.atmos_client")
+    if atmos_client is not None:
+        atmos_client.close_client()
 
-error_store: Dict[str, Optional[str]] = {}
+# metadata responses never change while the process runs -> rendered once
+POLLUTANTS_JSON = json.dumps({"pollutants": POLLUTANT_MAP}).encode()
 
 @app.get("/meta/cities")
 def get_cities():
-    return {"cities": catalog.list_cities()}
+    return Response(content=catalog.cities_json(), media_type="application/json")
 
 @app.get("/meta/pollutants")
 def get_pollutants():
-    return {"pollutants": POLLUTANT_MAP}
+    return Response(content=POLLUTANTS_JSON, media_type="application/json")
 
-@app.post("/export")
-def export(req: ExportRequest):
-    start_dt = datetime.strptime(req.start, "%Y-%m-%dT%H:%M")
-    end_dt = datetime.strptime(req.end, "%Y-%m-%dT%H:%M")
+def check_request(start: str, end: str, pollutants: List[str]):
+    """(start, end) datetimes of a valid window; HTTP 400 otherwise."""
+    try:
+        start_dt = datetime.strptime(start, "%Y-%m-%dT%H:%M")
+        end_dt = datetime.strptime(end, "%Y-%m-%dT%H:%M")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be YYYY-MM-DDTHH:mm")
 
     if start_dt >= end_dt:
         raise HTTPException(status_code=400, detail="Start datetime must be before End datetime")
-    bad = [p for p in req.pollutants if p not in SUPPORTED_POLLUTANTS]
+    bad = [p for p in pollutants if p not in SUPPORTED_POLLUTANTS]
     if bad:
         raise HTTPException(status_code=400, detail=f"Unsupported pollutants: {bad}")
+    return start_dt, end_dt
 
-    try:
-        datetime.strptime(req.start, "%Y-%m-%dT%H:%M")
-        datetime.strptime(req.end, "%Y-%m-%dT%H:%M")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="start/end must be YYYY-MM-DDTHH:mm")
+@app.post("/export")
+def export(req: ExportRequest):
+    start_dt, end_dt = check_request(req.start, req.end, req.pollutants)
+    if req.profile and not PROFILE_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is not enabled on this server (PROFILE_ENABLED=1)")
+    if req.profile and not metrics.profiler_available(req.profile):
+        raise HTTPException(status_code=400, detail=f"Profiler not installed: {req.profile}")
+    if req.format == "xlsx":
+        # a pollutant sheet has one row per bucket: refuse now rather than after the whole fetch
+        from .exporters import EXCEL_MAX_ROWS
+        from .pipeline import _expected_total_points
 
-    job_id = str(uuid.uuid4())
-    progress_store[job_id] = 0
-    error_store[job_id] = None
+        rows = _expected_total_points(req.start, req.end, req.aggregation)
+        if rows + 1 > EXCEL_MAX_ROWS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{rows} {req.aggregation} rows per sheet, more than Excel allows ({EXCEL_MAX_ROWS - 1}). "
+                       "Use format parquet, csv.gz or arrow for this range.",
+            )
 
     tmpdir = tempfile.mkdtemp(prefix="airq_export_")
-    out_path = os.path.join(tmpdir, f"city_air_quality_{req.aggregation}_{uuid.uuid4().hex[:8]}.xlsx")
-
-    def run_export():
-        try:
-            build_excel_for_request(
-                catalog=catalog,
-                start=req.start,
-                end=req.end,
-                aggregation=req.aggregation,
-                cities=req.cities,
-                pollutants=req.pollutants,
-                gaps=req.gaps,
-                gap_value=req.gap_value,
-                out_path=out_path,
-                job_id=job_id
-            )
-            progress_store[job_id] = 100
-        except Exception as e:
-            progress_store[job_id] = -1
-            error_store[job_id] = str(e)
+    suffix, _ = EXPORT_FORMATS[req.format]
+    out_path = os.path.join(tmpdir, f"city_air_quality_{req.aggregation}_{uuid.uuid4().hex[:8]}{suffix}")
+
+    fp = request_fingerprint(req, start_dt, end_dt)
+    job_id = jobs.submit(req.model_dump(), out_path, tmpdir, priority=req.priority, fp=fp)
+    job = jobs.get(job_id)
+    shared = job["out_path"] != out_path
+    if shared:
+        # identical export already queued/running/finished -> share it
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        out_path = job["out_path"]
+    return {
+        "job_id": job_id,
+        "file_path": out_path,
+        "queue_position": job["queue_position"],
+        "shared": shared,
+    }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+@app.get("/series")
+def get_series(
+    request: Request,
+    start: str,
+    end: str,
+    aggregation: Aggregation,
+    cities: List[str] = Query(...),
+    pollutants: List[str] = Query(...),
+    level: Literal["city", "station"] = "city",
+    format: Literal["ndjson", "arrow"] = "ndjson",
+    gaps: int = 1,
+    gap_value: str = "NULL",
+    data_mode: Literal["live", "local"] = "live",
+):
+    """
+    Time series straight from the pipeline, no job or file: city means
+    (level=city, the export's pollutant sheets) or every station's own series
+    (level=station), valid buckets only, streamed as NDJSON lines or an Arrow
+    IPC stream. ETag / If-None-Match revalidate without a body; errors of the
+    underlying fetch are counted in X-Series-Errors. Meant for small windows
+    (SERIES_MAX_POINTS); bigger ones get a 413 and should use /export.
+    """
+    from . import query  # pulls in the pipeline, like run_export
+
+    started = time.perf_counter()
+    check_request(start, end, pollutants)
+    try:
+        query.check_size(catalog, start, end, aggregation, cities, pollutants, data_mode)
+    except query.TooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    result, source = query.run(
+        catalog, start, end, aggregation, cities, pollutants,
+        level=level, gaps=gaps, gap_value=gap_value, data_mode=data_mode,
+    )
+    etag = f'"{result.etag}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Series-Errors": str(len(result.errors))}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.observe("atmos_series_query_seconds", "not_modified", time.perf_counter() - started)
+        return Response(status_code=304, headers=headers)
 
-    Thread(target=run_export).start()
-    return {"job_id": job_id, "file_path": out_path}
+    metrics.observe("atmos_series_query_seconds", source, time.perf_counter() - started)
+    return StreamingResponse(
+        query.ENCODERS[format](result), media_type=query.SERIES_FORMATS[format], headers=headers
+    )
 
 @app.get("/progress/{job_id}")
 def get_progress(job_id: str):
-    return {"progress": progress_store.get(job_id, 0), "error": error_store.get(job_id)}
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return {
+        "progress": job["progress"],
+        "error": job["error"],
+        "stats": job["stats"],
+        "phases": metrics.phases(job["stats"]),
+        "status": job["status"],
+        "queue_position": job["queue_position"],
+        "parts": [
+            {"city": p["city"], "file_path": p["file_path"], "size": p["size"]}
+            for p in jobs.parts(job_id)
+        ],
+    }
+
+@app.get("/progress/{job_id}/profile")
+def get_profile(job_id: str):
+    """Text report of an export submitted with "profile" (once it has finished)."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    path = profile_path(job["out_path"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No profile for this job (not requested or not finished)")
+    return FileResponse(path, media_type="text/plain")
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition: ATMOS/export counters, phase and job histograms, queue gauges."""
+    body = metrics.render({
+        "atmos_export_jobs": ("export jobs in the store by status", jobs.status_counts()),
+    })
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", "0.25"))
+SSE_KEEPALIVE = 15
+
+@app.get("/progress/{job_id}/stream")
+async def stream_progress(job_id: str, request: Request):
+    """
+    Server-Sent Events: queued / started / phase / sites_started / site_finished /
+    part_ready (incremental exports) / progress (with stats + ETA) / done / failed.
+    Resumes after Last-Event-ID.
+    """
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    last_seq = int(request.headers.get("last-event-id") or 0)
+
+    async def events():
+        nonlocal last_seq
+        idle = 0.0
+        yield "retry: 2000\n\n"
+        while not await request.is_disconnected():
+            rows = jobs.events_since(job_id, last_seq)
+            for row in rows:
+                last_seq = row["seq"]
+                yield f"id: {row['seq']}\nevent: {row['event']}\ndata: {row['data']}\n\n"
+                if row["event"] in ("done", "failed"):
+                    return
+            if rows:
+                idle = 0.0
+                continue
+            if jobs.get(job_id) is None:
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+            if idle >= SSE_KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/download")
 def download(file_path: str):
     return FileResponse(
         file_path,
         filename=os.path.basename(file_path),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        media_type=media_type_for(file_path)
     )
\ No newline at end of file
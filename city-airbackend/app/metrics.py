@@ -0,0 +1,172 @@
+"""
+Timing spans and process-wide Prometheus metrics (text exposition, no extra
+dependency; light module like app.progress).
+
+  - span(stats, phase)  : times a block; adds "<phase>_ms" to the job's stats
+                          (so /progress shows a per-job breakdown) and observes
+                          the atmos_export_phase_seconds histogram
+  - counters            : progress.totals, i.e. every progress.bump() of any job
+                          (plus count() for events outside a job)
+  - render()            : /metrics body
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from .progress import bump, snapshot_totals
+
+# seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# job counter -> (metric name, help)
+COUNTERS = {
+    "requests": ("atmos_http_requests_total", "ATMOS HTTP calls made"),
+    "retries": ("atmos_retries_total", "ATMOS calls retried (whole calls and chunks)"),
+    "fallback_calls": ("atmos_fallback_calls_total", "single-param fallback calls"),
+    "bytes_fetched": ("atmos_bytes_fetched_total", "bytes downloaded from ATMOS"),
+    "circuit_open": ("atmos_circuit_open_total", "calls refused by an open circuit breaker"),
+    "cache_hits": ("atmos_cache_hits_total", "station fetches fully served by the cache"),
+    "cache_partial": ("atmos_cache_partial_total", "station fetches partly served by the cache"),
+    "cache_misses": ("atmos_cache_misses_total", "station fetches not in the cache"),
+    "batch_splits": ("atmos_batch_splits_total", "multi-site calls split in half after a failure"),
+    "retry_budget_exhausted": ("atmos_retry_budget_exhausted_total", "retries refused by a job's retry budget"),
+    "availability_skipped": ("atmos_availability_skipped_total", "station params not fetched: no data expected"),
+    "availability_narrowed": ("atmos_availability_narrowed_total", "station fetches narrowed to the window with possible data"),
+    "availability_rechecks": ("atmos_availability_rechecks_total", "station fetches sent past the cache to confirm the index"),
+    "rows_written": ("atmos_export_rows_written_total", "rows written to export files"),
+    "jobs_done": ("atmos_export_jobs_done_total", "export jobs finished"),
+    "jobs_failed": ("atmos_export_jobs_failed_total", "export jobs failed"),
+}
+
+_lock = threading.Lock()
+# (metric, label value) -> [bucket counts..., sum, count]
+_histograms: Dict[Tuple[str, str], list] = {}
+
+HISTOGRAMS = {
+    "atmos_export_phase_seconds": ("phase", "time spent per export phase (fetch threads summed for http/parse)"),
+    "atmos_export_job_seconds": ("status", "export job run time"),
+    "atmos_series_query_seconds": ("source", "/series response time up to the first byte (computed, memo, not_modified)"),
+}
+
+
+def count(name: str, n: int = 1):
+    bump(None, name, n)
+
+
+def observe(metric: str, label: str, seconds: float):
+    with _lock:
+        h = _histograms.get((metric, label))
+        if h is None:
+            h = _histograms[(metric, label)] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+
+def record_phase(stats: Optional[Dict[str, int]], phase: str, seconds: float):
+    bump(stats, f"{phase}_ms", int(seconds * 1000))
+    observe("atmos_export_phase_seconds", phase, seconds)
+
+
+@contextmanager
+def span(stats: Optional[Dict[str, int]], phase: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(stats, phase, time.perf_counter() - t0)
+
+
+def phases(stats: Optional[Dict[str, int]]) -> Dict[str, int]:
+    """Per-job breakdown: {phase: ms} from a job's stats."""
+    return {k[:-3]: v for k, v in (stats or {}).items() if k.endswith("_ms")}
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(gauges: Optional[Dict[str, Tuple[str, Dict[str, float]]]] = None) -> str:
+    """
+    Prometheus text format. gauges: {metric: (help, {label value or "": value})}
+    for values read at scrape time (e.g. queue length); labels are "status".
+    """
+    lines = []
+    counters = snapshot_totals()
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+
+    for name, (metric, help_text) in COUNTERS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {_fmt(counters.get(name, 0))}"]
+
+    for metric, (label, help_text) in HISTOGRAMS.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for (m, value), h in sorted(histograms.items()):
+            if m != metric:
+                continue
+            for bound, n in zip(BUCKETS, h):
+                lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {n}')
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {h[-1]}')
+            lines.append(f'{metric}_sum{{{label}="{value}"}} {_fmt(round(h[-2], 6))}')
+            lines.append(f'{metric}_count{{{label}="{value}"}} {h[-1]}')
+
+    for metric, (help_text, values) in (gauges or {}).items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for value_label, value in values.items():
+            labels = f'{{status="{value_label}"}}' if value_label else ""
+            lines.append(f"{metric}{labels} {_fmt(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------- profiling -----------------------------
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def profiler_available(kind: str) -> bool:
+    if kind == "pyinstrument":
+        import importlib.util
+        return importlib.util.find_spec("pyinstrument") is not None
+    return kind in PROFILERS
+
+
+@contextmanager
+def profiled(kind: Optional[str], report_path: str):
+    """
+    Profile the block (the job's own thread: setup, aggregate, write and the
+    waits on fetch threads) and write a text report to report_path.
+    kind: None (off), "cprofile" or "pyinstrument".
+    """
+    if not kind:
+        yield
+        return
+
+    if kind == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_text(unicode=True, show_all=False))
+        return
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with open(report_path, "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(80)
@@ -0,0 +1,275 @@
+"""
+Local mirror of ATMOS 15-min data for every catalog station.
+
+Layout (one parquet file per station and month, columns dt_time + parameter codes):
+
+    MIRROR_PATH/site=<site_id>/<YYYY-MM>.parquet
+    MIRROR_PATH/watermarks.json     {site_id: {"until": "<YYYY-MM-DDTHH:MM>", "params": [...]}}
+
+Each run fetches, per station, everything after its watermark (starting
+MIRROR_OVERLAP_DAYS earlier, since ATMOS still revises recent data) and merges
+it into the month files. A station's first run, or one with new parameters,
+backfills from MIRROR_START. Exports with data_mode="local" read from here
+(read_frame) and never call ATMOS.
+
+    cd city-airbackend
+    python -m app.mirror                       # all catalog stations, all pollutants
+    python -m app.mirror --since 2023-01-01T00:00 --sites 1234 5678
+
+Set MIRROR_INTERVAL (seconds) to also run it in the background of the API.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from .atmos_client import AtmosError, download_chunked
+from .columns import no_rows, resolve_columns
+from .pollutants import POLLUTANT_MAP
+from .resample import resample_frame
+
+MIRROR_PATH = os.getenv("MIRROR_PATH", "mirror")
+MIRROR_START = os.getenv("MIRROR_START", "2024-01-01T00:00")
+MIRROR_OVERLAP_DAYS = int(os.getenv("MIRROR_OVERLAP_DAYS", "2"))
+MIRROR_CONCURRENCY = int(os.getenv("MIRROR_CONCURRENCY", "8"))
+MIRROR_INTERVAL = int(os.getenv("MIRROR_INTERVAL", "0"))  # background run period (s); 0 = off
+
+TIME_FMT = "%Y-%m-%dT%H:%M"
+
+_watermarks_lock = threading.Lock()
+
+
+# ----------------------------- storage -----------------------------
+
+def _site_dir(site_id: str) -> str:
+    return os.path.join(MIRROR_PATH, f"site={site_id}")
+
+
+def _month_path(site_id: str, month: pd.Period) -> str:
+    return os.path.join(_site_dir(site_id), f"{month.strftime('%Y-%m')}.parquet")
+
+
+def _write_atomic(df: pd.DataFrame, path: str):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    df.to_parquet(tmp_path, index=False, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def _merge_months(site_id: str, df: pd.DataFrame):
+    """Merge new rows (dt_time + params) into the station's month files; newer rows win."""
+    os.makedirs(_site_dir(site_id), exist_ok=True)
+    for month, part in df.groupby(df["dt_time"].dt.to_period("M"), sort=True):
+        path = _month_path(site_id, month)
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+        part = (
+            part.drop_duplicates("dt_time", keep="last")
+            .sort_values("dt_time")
+            .reset_index(drop=True)
+        )
+        _write_atomic(part, path)
+
+
+def load_watermarks() -> Dict[str, dict]:
+    try:
+        with open(os.path.join(MIRROR_PATH, "watermarks.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_watermark(site_id: str, until: str, params: List[str]):
+    with _watermarks_lock:
+        watermarks = load_watermarks()
+        watermarks[site_id] = {"until": until, "params": sorted(params)}
+        path = os.path.join(MIRROR_PATH, "watermarks.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(watermarks, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+# ----------------------------- mirroring -----------------------------
+
+def mirror_site(site_id: str, params: List[str], since: str, until: str, stats=None) -> dict:
+    """
+    Pull [since, until] for one station into the store and advance its watermark
+    (only up to the first failed chunk, so gaps are fetched again next run).
+    """
+    try:
+        df = download_chunked(
+            [site_id], params, since, until, gaps=1, gap_value="NULL",
+            aggregation="15min", data_mode="raw15", stats=stats,
+        )
+    except AtmosError as e:
+        return {"site_id": site_id, "rows": 0, "error": str(e)}
+
+    failed = df.attrs.get("failed_chunks") or []
+    watermark = until
+    if failed:
+        first_failed = min(pd.Timestamp(c["start"]) for c in failed)
+        watermark = (first_failed - pd.Timedelta(minutes=1)).strftime(TIME_FMT)
+
+    rows = 0
+    if not df.empty and "dt_time" in df.columns:
+        out = pd.DataFrame({"dt_time": df["dt_time"]})
+        for param, col in resolve_columns(df, params).items():
+            out[param] = df[col].astype("float32")
+        out = out.dropna(subset=["dt_time"])
+        if not out.empty:
+            _merge_months(site_id, out)
+            rows = len(out)
+
+    if watermark > since:
+        _save_watermark(site_id, watermark, params)
+    return {
+        "site_id": site_id,
+        "rows": rows,
+        "error": f"{len(failed)} chunk(s) failed: {failed[0]['error']}" if failed else None,
+    }
+
+
+def _catalog_site_ids() -> List[str]:
+    from .site_catalog import load_rows
+
+    rows = load_rows(os.getenv("SITE_XLSX_PATH", "site_ids_to_fetch_daily_data.xlsx"))
+    return list(dict.fromkeys(site_id for site_id, _, _, _ in rows))
+
+
+def run(
+    site_ids: Optional[List[str]] = None,
+    params: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    log=print,
+) -> Optional[List[dict]]:
+    """
+    One incremental mirror pass. Returns the per-station results, or None when
+    another process is already mirroring (MIRROR_PATH/.lock is held).
+    """
+    os.makedirs(MIRROR_PATH, exist_ok=True)
+    lock = open(os.path.join(MIRROR_PATH, ".lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+
+    try:
+        site_ids = site_ids or _catalog_site_ids()
+        params = params or list(POLLUTANT_MAP.values())
+        until = until or (pd.Timestamp.now().floor("15min") - pd.Timedelta(minutes=1)).strftime(TIME_FMT)
+        watermarks = load_watermarks()
+        overlap = pd.Timedelta(days=MIRROR_OVERLAP_DAYS)
+
+        def start_for(site_id: str) -> str:
+            mark = watermarks.get(site_id)
+            if since or not mark or not set(params) <= set(mark.get("params", [])):
+                return since or MIRROR_START
+            return max(pd.Timestamp(MIRROR_START), pd.Timestamp(mark["until"]) - overlap).strftime(TIME_FMT)
+
+        stats: Dict[str, int] = {}
+        results = []
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, MIRROR_CONCURRENCY)) as pool:
+            futures = [
+                pool.submit(mirror_site, site_id, params, start_for(site_id), until, stats)
+                for site_id in site_ids
+            ]
+            for n, future in enumerate(futures, 1):
+                result = future.result()
+                results.append(result)
+                if result["error"]:
+                    log(f"[{n}/{len(site_ids)}] {result['site_id']}: {result['error']}")
+
+        failed = sum(1 for r in results if r["error"])
+        log(
+            f"mirrored {len(results) - failed}/{len(results)} stations up to {until} "
+            f"in {time.monotonic() - t0:.1f}s ({stats.get('requests', 0)} requests, "
+            f"{stats.get('bytes_fetched', 0) / 1e6:.1f} MB)"
+        )
+        return results
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+
+def start_background():
+    """Run the mirror every MIRROR_INTERVAL seconds in a daemon thread (one process at a time)."""
+    if MIRROR_INTERVAL <= 0:
+        return
+
+    def loop():
+        while True:
+            try:
+                run(log=lambda msg: print(f"[mirror] {msg}"))
+            except Exception as e:
+                print(f"[mirror] run failed: {e}")
+            time.sleep(MIRROR_INTERVAL)
+
+    threading.Thread(target=loop, name="atmos-mirror", daemon=True).start()
+
+
+# ----------------------------- reading -----------------------------
+
+def read_site(site_id: str, params: List[str], start: str, end: str) -> pd.DataFrame:
+    """Mirrored 15-min rows of one station in [start, end] (dt_time + the params it has)."""
+    s, e = pd.Timestamp(start), pd.Timestamp(end)
+    frames = []
+    for month in pd.period_range(s.to_period("M"), e.to_period("M"), freq="M"):
+        path = _month_path(site_id, month)
+        if not os.path.exists(path):
+            continue
+        available = set(pq.read_schema(path).names)
+        frames.append(pd.read_parquet(path, columns=["dt_time"] + [p for p in params if p in available]))
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return df[(df["dt_time"] >= s) & (df["dt_time"] <= e)].reset_index(drop=True)
+
+
+def read_frame(site_ids: List[str], params: List[str], start: str, end: str, aggregation: str) -> pd.DataFrame:
+    """
+    ATMOS-shaped frame (dt_time, [site_id], <params>) built from the mirror,
+    resampled from 15-min to the requested aggregation (app.resample coverage rules).
+    """
+    frames = []
+    for site_id in site_ids:
+        df = read_site(site_id, params, start, end)
+        if df.empty:
+            continue
+        df = resample_frame(df, params, "15min", aggregation, start, end)
+        if len(site_ids) > 1:
+            df.insert(0, "site_id", site_id)
+        frames.append(df)
+    if not frames:
+        return no_rows()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Incrementally mirror ATMOS 15-min data for catalog stations.")
+    ap.add_argument("--sites", nargs="+", help="site ids (default: every catalog station)")
+    ap.add_argument("--params", nargs="+", help="ATMOS parameter codes (default: all pollutants)")
+    ap.add_argument("--since", help="re-fetch from this time (YYYY-MM-DDTHH:MM) instead of the watermarks")
+    ap.add_argument("--until", help="fetch up to this time (default: now)")
+    args = ap.parse_args()
+
+    results = run(args.sites, args.params, args.since, args.until)
+    if results is None:
+        print("another mirror run holds the lock; nothing done")
+    elif any(r["error"] for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
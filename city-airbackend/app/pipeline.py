@@ -1,11 +1,33 @@
+import os
+import numpy as np
 import pandas as pd
 import time
-from typing import Dict, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional
 from datetime import datetime
-from .atmos_client import fetch_csv
+from . import availability, cache, shards
+from .atmos_client import (
+    fetch_csv, AtmosTimeout, AtmosHTTPError, AtmosBadResponse, AtmosCircuitOpen
+)
+from .columns import find_pollutant_col, find_site_col, resolve_columns
+from .exporters import open_writer
+from .formats import EXPORT_FORMATS
+from .metrics import record_phase, span
+from .progress import bump, emit, set_progress, stats_store
+from .resample import base_for, describe, grid_stages
+from .retry import RetryBudget, sleep_before_retry, take_retry
+from .series import EMPTY, compact, grid, resample
 
-progress_store: Dict[str, int] = {}
-MAX_RETRIES = 4
+MAX_RETRIES = 4         # attempts for the multi-param call of a station
+SINGLE_MAX_RETRIES = 2  # attempts for each single-param fallback call
+
+# max number of stations fetched from ATMOS at the same time (per export job)
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))
+
+# max number of stations sent in one multi-site ATMOS call (1 = one call per station)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "40"))
+
+EMPTY_RESPONSE = "Empty response (no rows)"
 
 
 def _clean_pollutant_name(p):
@@ -20,13 +42,11 @@ def _clean_pollutant_name(p):
     )
 
 
-def _find_pollutant_col(df: pd.DataFrame, pollutant_code: str):
-    target = pollutant_code.lower().replace(" ", "")
-    for col in df.columns:
-        col_clean = str(col).lower().replace(" ", "")
-        if target in col_clean:
-            return col
-    return None
+def _data_mode(aggregation: str, source: str = "live") -> str:
+    """atmos_client data mode for an export: the local mirror, or ATMOS raw 15-min / aggregated."""
+    if source == "local":
+        return "local"
+    return "raw15" if aggregation == "15min" else "api"
 
 
 def _expected_total_points(start: str, end: str, aggregation: str) -> int:
@@ -70,35 +90,449 @@ def _expected_total_points(start: str, end: str, aggregation: str) -> int:
     return len(pd.date_range(s, e, freq="h"))
 
 
-def _retry_fetch(**kwargs) -> Tuple[pd.DataFrame, Optional[str]]:
+class FetchOutcome(NamedTuple):
+    df: pd.DataFrame
+    error: Optional[str]
+    retries: int
+    fan_out: bool  # whether per-pollutant calls could succeed where this one failed
+
+
+def _retry_fetch(max_attempts: int = MAX_RETRIES, **kwargs) -> FetchOutcome:
     """
-    Returns (df, err). Retries on:
-      - exception
-      - empty df
-      - dt_time missing (bad/non-csv response)
+    fetch_csv with retries on timeouts, 429/5xx, non-CSV bodies and other
+    transport errors, sleeping with exponential backoff + jitter (and at least
+    Retry-After) in between. Every retry is taken from the job's retry budget
+    (kwargs["retry_budget"]); an empty budget ends the loop.
+
+    Not retried:
+      - non-retryable HTTP errors (4xx) and an open circuit breaker
+      - an empty response (no rows): ATMOS answers the same again
+    Long windows are chunked and retried per chunk inside fetch_csv, so this only
+    repeats a call when none of its chunks came back.
+
+    A frame without dt_time (header-only garbage included) is a bad response
+    and retried like one.
+
+    fan_out is False when the failure was about reaching ATMOS at all
+    (timeouts, rate limiting, 5xx, open circuit) or the station had no rows:
+    single-param calls would hit the same wall, so the caller should not
+    multiply them.
     """
+    stats = kwargs.get("cache_stats")
     last_err = None
-    for _ in range(MAX_RETRIES):
+    retry_after = None
+    fan_out = False
+    retries = 0
+
+    for attempt in range(max_attempts):
+        if attempt:
+            if not take_retry(kwargs.get("retry_budget")):
+                bump(stats, "retry_budget_exhausted")
+                last_err = f"{last_err} (retry budget exhausted)"
+                break
+            bump(stats, "retries")
+            retries += 1
+            sleep_before_retry(attempt - 1, retry_after)
+            retry_after = None
+
         try:
             df = fetch_csv(**kwargs)
+        except AtmosCircuitOpen as e:
+            last_err, fan_out = f"Circuit open: {e}", False
+            break
+        except AtmosTimeout as e:
+            last_err, fan_out = f"Timeout: {e}", False
+            continue
+        except AtmosHTTPError as e:
+            last_err, fan_out = f"HTTP error: {e}", not e.retryable
+            if not e.retryable:
+                break
+            retry_after = e.retry_after
+            continue
+        except AtmosBadResponse as e:
+            last_err, fan_out = f"Bad response: {e}", True
+            continue
         except Exception as e:
-            last_err = f"Exception: {e}"
-            time.sleep(1)
+            last_err, fan_out = f"Exception: {e}", False
             continue
 
-        if df is None or df.empty:
-            last_err = "Empty response (timeout/rate-limit/non-CSV)"
-            time.sleep(1)
+        # header-only garbage parses to an empty frame too: check the columns first
+        if df is None or "dt_time" not in df.columns:
+            cols = [] if df is None else list(df.columns)[:12]
+            last_err, fan_out = f"Bad response: dt_time missing. cols={cols}", True
             continue
 
-        if "dt_time" not in df.columns:
-            last_err = f"Bad response: dt_time missing. cols={list(df.columns)[:12]}"
-            time.sleep(1)
+        if df.empty:
+            # the station has no rows at all: single-param calls would come back empty too
+            return FetchOutcome(pd.DataFrame(), EMPTY_RESPONSE, retries, False)
+
+        return FetchOutcome(df, None, retries, False)
+
+    return FetchOutcome(pd.DataFrame(), last_err, retries, fan_out)
+
+
+def _fetch_batch(site_ids: List[str], **kwargs) -> Dict[str, pd.DataFrame]:
+    """
+    One multi-site call for a batch of stations, split back into per-site frames.
+
+    The call goes through _retry_fetch (backoff, Retry-After, retry budget,
+    breaker). When it still fails for a reason that smaller calls could get
+    past (bad response, non-retryable HTTP error) the batch is binary-split and
+    each half fetched again, so only the failing sites end up in ever smaller
+    batches. Sites that are not in the returned dict (single-site batches, no
+    rows, upstream unreachable, response without a site column) go through the
+    regular per-site path in _fetch_site.
+    """
+    if len(site_ids) < 2:
+        return {}
+
+    df, error, _, fan_out = _retry_fetch(site_ids=site_ids, **kwargs)
+    if error and error != EMPTY_RESPONSE and fan_out:
+        bump(kwargs.get("cache_stats"), "batch_splits")
+        mid = len(site_ids) // 2
+        return {**_fetch_batch(site_ids[:mid], **kwargs), **_fetch_batch(site_ids[mid:], **kwargs)}
+
+    if error or df.empty:
+        return {}
+
+    site_col = find_site_col(df)
+    if site_col is None:
+        return {}
+
+    # one reorder + contiguous slices (cheaper than a groupby with a copy per site)
+    codes, found = pd.factorize(df[site_col].astype(str).str.strip())
+    order = np.argsort(codes, kind="stable")
+    rows = df.drop(columns=[site_col]).take(order)
+    bounds = np.searchsorted(codes[order], np.arange(len(found) + 1))
+
+    wanted = set(site_ids)
+    out = {}
+    for n, site_id in enumerate(found):
+        if site_id in wanted:
+            out[site_id] = rows.iloc[bounds[n]:bounds[n + 1]].reset_index(drop=True)
+            out[site_id].attrs = dict(df.attrs)  # failed_chunks apply to every site of the call
+    return out
+
+
+def _fetch_batch_sites(
+    batch,
+    pollutants,
+    start,
+    end,
+    gaps,
+    gap_value,
+    aggregation,
+    cache_stats=None,
+    job_id=None,
+    retry_budget=None,
+    data_mode=None
+):
+    """
+    Fetch a batch of (clean_city, record) pairs. Returns one _fetch_site result per pair, in order.
+    """
+    data_mode = data_mode or _data_mode(aggregation)
+    site_ids = list(dict.fromkeys(record.site_id for _, record in batch))
+    if job_id:
+        emit(job_id, "sites_started", {"site_ids": site_ids})
+
+    # stations / params known to have no data in the window are skipped or
+    # fetched over a narrower window; one multi-site call per distinct plan
+    plans = {
+        site_id: None if data_mode == "local"
+        else availability.plan(site_id, pollutants, start, end, aggregation, cache_stats)
+        for site_id in site_ids
+    }
+    groups = {}
+    for site_id, plan in plans.items():
+        if plan is None:
+            groups.setdefault((start, end, tuple(pollutants), False), []).append(site_id)
+        elif plan.params:
+            groups.setdefault((plan.start, plan.end, tuple(plan.params), plan.upstream), []).append(site_id)
+
+    batch_frames = {}
+    for (group_start, group_end, params, upstream), group in groups.items():
+        batch_frames.update(_fetch_batch(
+            group,
+            params=list(params),
+            start=group_start,
+            end=group_end,
+            gaps=gaps,
+            gap_value=gap_value,
+            aggregation=aggregation,
+            data_mode=data_mode,
+            cache_stats=cache_stats,
+            retry_budget=retry_budget,
+            use_cache=not upstream
+        ))
+
+    return [
+        _fetch_site(
+            record, clean_city, pollutants, start, end,
+            gaps, gap_value, aggregation,
+            df_all=batch_frames.get(record.site_id),
+            cache_stats=cache_stats,
+            retry_budget=retry_budget,
+            data_mode=data_mode,
+            plan=plans[record.site_id]
+        )
+        for clean_city, record in batch
+    ]
+
+
+def _fetch_sites(site_jobs, cache_stats=None, job_id=None, retry_budget=None, **fetch_args):
+    """
+    Fetch (clean_city, record) pairs in BATCH_SIZE multi-site calls, FETCH_CONCURRENCY
+    at a time. Yields (offset, batch results) as batches complete (any order).
+    fetch_args: pollutants, start, end, gaps, gap_value, aggregation, data_mode.
+    """
+    batch_size = max(1, BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=max(1, FETCH_CONCURRENCY)) as pool:
+        futures = {
+            pool.submit(
+                _fetch_batch_sites, site_jobs[i:i + batch_size], **fetch_args,
+                cache_stats=cache_stats, job_id=job_id, retry_budget=retry_budget,
+            ): i
+            for i in range(0, len(site_jobs), batch_size)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _fetch_site(
+    record,
+    clean_city,
+    pollutants,
+    start,
+    end,
+    gaps,
+    gap_value,
+    aggregation,
+    df_all: Optional[pd.DataFrame] = None,
+    cache_stats=None,
+    retry_budget: Optional[RetryBudget] = None,
+    data_mode=None,
+    plan: Optional[availability.Plan] = None
+):
+    """
+    Fetch + extract all requested pollutants for ONE station.
+    df_all: this station's rows from a batched call (skips the multi-param call).
+    cache_stats: job-level dict collecting cache hit/miss counts.
+    retry_budget: job-level RetryBudget shared by all stations.
+    data_mode: atmos_client data mode (default from aggregation; "local" = mirror).
+    plan: availability.plan() of the station (params to fetch, fetch window,
+          params skipped as "no data expected"); None = everything, no index update.
+
+    Returns (frames, error_rows):
+      - frames     : {pollutant: app.series.GridSeries on the export's `aggregation`
+                     grid} (pollutants the station returned, plus empty series
+                     for those skipped as "no data expected")
+      - error_rows : list of ERRORS sheet rows
+    """
+    frames = {}
+    error_rows = []
+    absent = set()     # params the station does not return (clean answer)
+    uncertain = set()  # params with failed time chunks (not recorded as availability)
+    data_mode = data_mode or _data_mode(aggregation)
+    fetch_plan = plan or availability.Plan(list(pollutants), start, end, {})
+
+    fetch_kwargs = dict(
+        site_ids=[record.site_id],
+        start=fetch_plan.start,
+        end=fetch_plan.end,
+        gaps=gaps,
+        gap_value=gap_value,
+        aggregation=aggregation,
+        data_mode=data_mode,
+        cache_stats=cache_stats,
+        retry_budget=retry_budget,
+        use_cache=not fetch_plan.upstream
+    )
+
+    def _fail(pollutant, msg, retries=0):
+        error_rows.append({
+            "City": clean_city, "Station": record.location, "SiteID": record.site_id,
+            "Pollutant": pollutant, "Error": msg, "Retries": retries
+        })
+
+    def _fail_chunks(df, pollutant):
+        """Rows for time chunks that stayed missing after their retries (partial data)."""
+        for chunk in df.attrs.get("failed_chunks") or []:
+            uncertain.add(pollutant)
+            _fail(
+                pollutant,
+                f"Partial data: {chunk['start']} to {chunk['end']} missing ({chunk['error']})",
+                chunk.get("retries", 0)
+            )
+
+    def _single(pollutant, err_prefix):
+        """Single-param fallback. Returns the pollutant's Series or None (error recorded)."""
+        bump(cache_stats, "fallback_calls")
+        df_one, err_one, retries_one, _ = _retry_fetch(SINGLE_MAX_RETRIES, params=[pollutant], **fetch_kwargs)
+        if err_one:
+            if err_one == EMPTY_RESPONSE:
+                absent.add(pollutant)
+            _fail(pollutant, f"{err_prefix} ({err_one})", retries_one)
+            return None
+        _fail_chunks(df_one, pollutant)
+
+        pollutant_col = find_pollutant_col(df_one, pollutant)
+        if pollutant_col is None:
+            absent.add(pollutant)
+            _fail(pollutant, f"Column not found for '{pollutant}' (single-param). cols={list(df_one.columns)[:12]}")
+            return None
+
+        return df_one.set_index("dt_time")[pollutant_col]
+
+    # known to hold no data: reported as 0 valid records, not as a failed station
+    skipped = dict.fromkeys(fetch_plan.skipped, EMPTY)
+    for pollutant, reason in fetch_plan.skipped.items():
+        _fail(pollutant, reason)
+    pollutants = fetch_plan.params
+    if not pollutants:
+        return skipped, error_rows
+
+    # 1) Fast call: all pollutants at once (unless the batch call already returned them)
+    if df_all is None:
+        df_all, err_all, retries_all, fan_out = _retry_fetch(params=pollutants, **fetch_kwargs)
+    else:
+        err_all, retries_all, fan_out = None, 0, False
+
+    columns = {}
+    if not err_all:
+        _fail_chunks(df_all, "ALL")
+        columns = resolve_columns(df_all, pollutants)
+        by_time = df_all.set_index("dt_time")
+
+    for pollutant in pollutants:
+        if err_all == EMPTY_RESPONSE:
+            # 1a) no rows for the whole station (dead / decommissioned) -> no single-param calls
+            absent.add(pollutant)
+            _fail(pollutant, f"ALL-PARAM failed ({err_all}); single-param skipped", retries_all)
+            sub = None
+        elif err_all and not fan_out:
+            # 2a) ATMOS unreachable / overloaded for this station -> don't multiply calls
+            _fail(pollutant, f"ALL-PARAM failed ({err_all}); single-param skipped", retries_all)
+            sub = None
+        elif err_all:
+            # 2b) fast call rejected -> fallback per pollutant
+            sub = _single(pollutant, f"ALL-PARAM failed ({err_all}); single-param failed")
+        elif pollutant not in columns:
+            # 3a) missing in the multi-param response -> fallback for this pollutant only
+            sub = _single(pollutant, "Missing in ALL-PARAM + single-param failed")
+        else:
+            # 3b) fast call succeeded -> column view of df_all (typed at parse time, not copied)
+            sub = by_time[columns[pollutant]]
+            if "ALL" in uncertain:
+                uncertain.add(pollutant)
+
+        if sub is not None:
+            frames[pollutant] = sub
+
+    # compact arrays on the export grid; the parsed response is released here
+    export_grid = grid(start, end, aggregation)
+    frames = compact(
+        frames, export_grid, cache_stats,
+        lambda pollutant, rows: _fail(pollutant, f"{rows} rows outside the export window dropped")
+    )
+
+    if plan is not None:
+        observed = {p: None for p in absent}
+        for p, s in frames.items():
+            if p not in uncertain:
+                observed[p] = export_grid.times[s.offsets[s.mask()]]
+        availability.record(
+            record.site_id, fetch_plan.start, fetch_plan.end, aggregation, observed,
+            upstream=fetch_plan.upstream or not cache.CACHE_ENABLED
+        )
+
+    return {**frames, **skipped}, error_rows
+
+
+def _aggregate(
+    results, site_jobs, city_slices, pollutants, expected_total, labels,
+    base=None, aggregation=None, window=(None, None)
+):
+    """
+    City means + uptime for all pollutants, straight from the stations'
+    compact grid series (app.series).
+
+    Per pollutant, every station series is first resampled to the export
+    aggregation when it was fetched at a finer base (coverage rules of
+    app.resample, window = export start/end), then added into per-city sum /
+    count arrays over the export grid; the city mean is sum / count and a
+    station's uptime is its number of valid buckets.
+
+    Returns (concentration, uptime_dict):
+      - concentration : {pollutant: wide DataFrame[Timestamp, <city>...]}
+      - uptime_dict   : {pollutant: {city: [uptime rows in site order]}}
+    """
+    uptime_label, valid_label, expected_label = labels
+    start, end = window
+    aggregation = aggregation or base
+    out_grid = grid(start, end, aggregation)
+    stages = grid_stages(base, aggregation, start, end) if base else []
+
+    city_names = list(dict.fromkeys(clean_city for clean_city, _, _ in city_slices))
+    site_city = np.empty(len(site_jobs), dtype=np.int32)
+    for clean_city, first, last in city_slices:
+        site_city[first:last] = city_names.index(clean_city)
+
+    concentration = {}
+    valid_counts = {}
+    for pollutant in pollutants:
+        stations = [i for i, (frames, _) in enumerate(results) if pollutant in frames]
+        if not stations:
             continue
+        # cities that had at least one station series, in request order
+        with_data = list(dict.fromkeys(int(site_city[i]) for i in stations))
+        column = {c: n for n, c in enumerate(with_data)}
+
+        sums = np.zeros((len(with_data), out_grid.size))
+        counts = np.zeros((len(with_data), out_grid.size), dtype=np.int32)
+        seen = np.zeros(out_grid.size, dtype=bool)
+        for i in stations:
+            s = resample(results[i][0][pollutant], stages)
+            valid = s.mask()
+            row = column[int(site_city[i])]
+            np.add.at(sums[row], s.offsets[valid], s.values[valid])
+            np.add.at(counts[row], s.offsets[valid], 1)
+            seen[s.offsets] = True
+            valid_counts[(i, pollutant)] = int(valid.sum())
+
+        rows = np.flatnonzero(seen)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts[:, rows] > 0, sums[:, rows] / np.maximum(counts[:, rows], 1), np.nan).round(3)
+        wide = pd.DataFrame(means.T, columns=[city_names[c] for c in with_data])
+        wide.insert(0, "Timestamp", out_grid.times[rows])
+        concentration[pollutant] = wide
 
-        return df, None
+    uptime_dict = {p: {} for p in pollutants}
+    for clean_city, first, last in city_slices:
+        if first == last:
+            continue
+        for pollutant in pollutants:
+            rows = []
+            for i in range(first, last):
+                station = site_jobs[i][1].location
+                if pollutant in results[i][0]:
+                    valid = valid_counts[(i, pollutant)]
+                    uptime = round((valid / expected_total) * 100, 2) if expected_total else 0
+                    rows.append({
+                        "Station": station,
+                        uptime_label: uptime,
+                        valid_label: valid,
+                        expected_label: expected_total
+                    })
+                else:
+                    rows.append({
+                        "Station": station,
+                        uptime_label: "",
+                        valid_label: "",
+                        expected_label: expected_total
+                    })
+            uptime_dict[pollutant][clean_city] = rows
 
-    return pd.DataFrame(), last_err
+    return concentration, uptime_dict
 
 
 def build_excel_for_request(
@@ -111,13 +545,36 @@ def build_excel_for_request(
     gaps,
     gap_value,
     out_path,
-    job_id
+    job_id,
+    fmt="xlsx",
+    data_mode="live",
+    incremental=False
 ):
-    total_calls = sum(len(catalog.get_sites_for_city(city)) for city in cities) or 1
+    """
+    Fetch every station of the requested cities and write the export to out_path.
+    fmt: "xlsx" (workbook) or "parquet" / "csv.gz" / "arrow" (zip bundle, see app.exporters).
+    data_mode: "live" (ATMOS) or "local" (the app.mirror store, no upstream calls).
+    incremental: also write each city to parts/<n>_<city><suffix> next to out_path
+    as soon as its last station is fetched ("part_ready" event), so the first
+    city can be downloaded long before the whole export is done.
+    """
+    # coarser aggregations are derived from one base fetch (see app.resample)
+    base = base_for(aggregation, data_mode)
+
+    # one catalog lookup per city for the whole export
+    city_sites = [(city.split("(")[0].strip(), catalog.get_sites_for_city(city)) for city in cities]
+
+    total_calls = sum(len(site_records) for _, site_records in city_sites) or 1
     completed_calls = 0
 
-    concentration_dict = {p: {} for p in pollutants}
-    uptime_dict = {p: {} for p in pollutants}
+    cache_stats = {
+        "cache_hits": 0, "cache_partial": 0, "cache_misses": 0,
+        "requests": 0, "bytes_fetched": 0, "retries": 0,
+    }
+    stats_store[job_id] = cache_stats
+    retry_budget = RetryBudget.for_job(total_calls)
+    started_at = time.monotonic()
+
     error_rows = []
 
     # ✅ Expected total count from start–end (same for all stations in this export)
@@ -137,251 +594,192 @@ def build_excel_for_request(
 
     valid_label = f"Valid {unit}"
     expected_label = f"Expected {unit}"
+    labels = (uptime_label, valid_label, expected_label)
+
+    info = {"Start Date": start, "End Date": end, "Aggregation": aggregation}
+    if data_mode == "local":
+        info["Data Source"] = "Local mirror"
+    if base != aggregation:
+        info["Aggregation Method"] = describe(base, aggregation)
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+    with open_writer(out_path, fmt) as writer:
 
         # INFO
-        info_top = pd.DataFrame(
-            [["Start Date", start], ["End Date", end], ["Aggregation", aggregation]],
-            columns=["Parameter", "Value"]
+        writer.write_info(info, *_info_tables(city_sites))
+
+        # =================== FETCH STAGE (batched + concurrent) =====================
+        # stations of all cities are flattened in city/site order, grouped into
+        # BATCH_SIZE multi-site calls and fetched concurrently; results are merged
+        # below in the original order so the workbook is deterministic.
+        site_jobs = []
+        city_slices = []
+        for clean_city, site_records in city_sites:
+            city_slices.append((clean_city, len(site_jobs), len(site_jobs) + len(site_records)))
+            site_jobs.extend((clean_city, record) for record in site_records)
+
+        # incremental mode: stations still pending per city (city_slices index)
+        site_slice = np.repeat(np.arange(len(city_slices)), [last - first for _, first, last in city_slices])
+        pending = [last - first for _, first, last in city_slices]
+        parts_total = sum(1 for n in pending if n)
+        parts_dir = os.path.join(os.path.dirname(out_path) or ".", "parts")
+
+        results = [None] * len(site_jobs)
+        fetch_args = dict(
+            pollutants=pollutants, start=start, end=end, gaps=gaps, gap_value=gap_value,
+            aggregation=base, data_mode=_data_mode(base, data_mode),
         )
-        info_top.to_excel(writer, sheet_name="INFO", index=False)
-
-        current_row = len(info_top) + 2
-        city_counts = []
-        station_columns = {}
-
-        for city in cities:
-            clean_city = city.split("(")[0].strip()
-            site_records = catalog.get_sites_for_city(city)
-            stations = [r["Location"] for r in site_records]
-            city_counts.append({"City": clean_city, "Station Count": len(stations)})
-            station_columns[f"{clean_city} Stations"] = stations
-
-        city_count_df = pd.DataFrame(city_counts)
-        city_count_df.to_excel(writer, sheet_name="INFO", index=False, startrow=current_row)
-        current_row += len(city_count_df) + 3
-
-        if station_columns:
-            max_len = max(len(v) for v in station_columns.values())
-            for key in station_columns:
-                station_columns[key] += [""] * (max_len - len(station_columns[key]))
-            pd.DataFrame(station_columns).to_excel(writer, sheet_name="INFO", index=False, startrow=current_row)
-
-        # =================== FETCH LOOP =====================
-        for city in cities:
-            clean_city = city.split("(")[0].strip()
-            site_records = catalog.get_sites_for_city(city)
-            if not site_records:
-                continue
-
-            city_frames = {p: [] for p in pollutants}
-            city_uptime = {p: [] for p in pollutants}
-
-            for record in site_records:
-                completed_calls += 1
-                progress_store[job_id] = min(99, int((completed_calls / total_calls) * 99))
-
-                # 1) Fast call: all pollutants at once
-                df_all, err_all = _retry_fetch(
-                    site_ids=[record["site_id"]],
-                    params=pollutants,
-                    start=start,
-                    end=end,
-                    gaps=gaps,
-                    gap_value=gap_value,
-                    aggregation=aggregation,
-                    data_mode="raw15" if aggregation == "15min" else "api"
+        sharded = shards.enabled_for(len(site_jobs))
+        emit(job_id, "phase", {"phase": "fetch", "sites": len(site_jobs), "sharded": sharded})
+        if sharded:
+            # big export: SHARD_SITES work units, pulled by every process sharing the job store
+            completed = shards.fetch_sharded(job_id, site_jobs, fetch_args, cache_stats)
+        else:
+            completed = _fetch_sites(site_jobs, cache_stats, job_id, retry_budget, **fetch_args)
+
+        with span(cache_stats, "fetch"):
+            for offset, batch_results in completed:
+                results[offset:offset + len(batch_results)] = batch_results
+
+                for (clean_city, record), (frames, site_errors) in zip(site_jobs[offset:], batch_results):
+                    emit(job_id, "site_finished", {
+                        "city": clean_city, "station": record.location, "site_id": record.site_id,
+                        "pollutants": len(frames), "errors": len(site_errors),
+                    })
+
+                completed_calls += len(batch_results)
+                elapsed = time.monotonic() - started_at
+                set_progress(
+                    job_id, min(90, int((completed_calls / total_calls) * 90)),
+                    sites_done=completed_calls, sites_total=len(site_jobs),
+                    eta_s=round(elapsed / completed_calls * (total_calls - completed_calls), 1),
                 )
 
-                # 2) If fast call failed -> fallback per pollutant
-                if err_all:
-                    for pollutant in pollutants:
-                        df_one, err_one = _retry_fetch(
-                            site_ids=[record["site_id"]],
-                            params=[pollutant],
-                            start=start,
-                            end=end,
-                            gaps=gaps,
-                            gap_value=gap_value,
-                            aggregation=aggregation,
-                            data_mode="raw15" if aggregation == "15min" else "api"
+                if not incremental:
+                    continue
+                for c in site_slice[offset:offset + len(batch_results)]:
+                    pending[c] -= 1
+                    if pending[c]:
+                        continue
+                    # last station of this city is in -> its own file, downloadable now
+                    clean_city, first, last = city_slices[c]
+                    part_path = os.path.join(parts_dir, f"{c + 1:03d}_{_slug(clean_city)}{EXPORT_FORMATS[fmt][0]}")
+                    with span(cache_stats, "part"):
+                        _write_part(
+                            part_path, fmt, info, city_sites[c], results[first:last], site_jobs[first:last],
+                            pollutants, expected_total, labels, base, aggregation, (start, end),
                         )
+                    emit(job_id, "part_ready", {
+                        "city": clean_city, "file_path": part_path, "size": os.path.getsize(part_path),
+                        "parts_done": parts_total - sum(1 for n in pending if n), "parts_total": parts_total,
+                    })
 
-                        if err_one:
-                            msg = f"ALL-PARAM failed ({err_all}); single-param failed ({err_one})"
-                            # no notes column now → only keep error in ERRORS sheet
-                            error_rows.append({
-                                "City": clean_city, "Station": record["Location"], "SiteID": record["site_id"],
-                                "Pollutant": pollutant, "Error": msg
-                            })
-                            city_uptime[pollutant].append({
-                                "Station": record["Location"],
-                                uptime_label: "",
-                                valid_label: "",
-                                expected_label: expected_total
-                            })
-                            continue
-
-                        df_one["dt_time"] = pd.to_datetime(df_one["dt_time"], errors="coerce")
-                        pollutant_col = _find_pollutant_col(df_one, pollutant)
-                        if pollutant_col is None:
-                            msg = f"Column not found for '{pollutant}' (single-param). cols={list(df_one.columns)[:12]}"
-                            error_rows.append({
-                                "City": clean_city, "Station": record["Location"], "SiteID": record["site_id"],
-                                "Pollutant": pollutant, "Error": msg
-                            })
-                            city_uptime[pollutant].append({
-                                "Station": record["Location"],
-                                uptime_label: "",
-                                valid_label: "",
-                                expected_label: expected_total
-                            })
-                            continue
-
-                        sub = df_one[["dt_time", pollutant_col]].copy()
-                        sub[pollutant_col] = pd.to_numeric(sub[pollutant_col], errors="coerce")
-
-                        valid = sub[pollutant_col].notna().sum()
-                        total = expected_total
-                        uptime = round((valid / total) * 100, 2) if total else 0
-
-                        city_uptime[pollutant].append({
-                            "Station": record["Location"],
-                            uptime_label: uptime,
-                            valid_label: valid,
-                            expected_label: total
-                        })
-                        city_frames[pollutant].append(sub)
+        # =================== AGGREGATE =====================
+        emit(job_id, "phase", {"phase": "aggregate"})
+        for _, site_errors in results:
+            error_rows.extend(site_errors)
 
-                    continue
+        with span(cache_stats, "aggregate"):
+            concentration, uptime_dict = _aggregate(
+                results, site_jobs, city_slices, pollutants, expected_total, labels,
+                base=base, aggregation=aggregation, window=(start, end)
+            )
 
-                # 3) Fast call succeeded -> process from df_all
-                df_all["dt_time"] = pd.to_datetime(df_all["dt_time"], errors="coerce")
-
-                for pollutant in pollutants:
-                    pollutant_col = _find_pollutant_col(df_all, pollutant)
-
-                    # If pollutant missing in multi-param -> fallback only for this pollutant
-                    if pollutant_col is None:
-                        df_one, err_one = _retry_fetch(
-                            site_ids=[record["site_id"]],
-                            params=[pollutant],
-                            start=start,
-                            end=end,
-                            gaps=gaps,
-                            gap_value=gap_value,
-                            aggregation=aggregation,
-                            data_mode="raw15" if aggregation == "15min" else "api"
-                        )
-                        if err_one:
-                            msg = f"Missing in ALL-PARAM + single-param failed ({err_one})"
-                            error_rows.append({
-                                "City": clean_city, "Station": record["Location"], "SiteID": record["site_id"],
-                                "Pollutant": pollutant, "Error": msg
-                            })
-                            city_uptime[pollutant].append({
-                                "Station": record["Location"],
-                                uptime_label: "",
-                                valid_label: "",
-                                expected_label: expected_total
-                            })
-                            continue
-
-                        df_one["dt_time"] = pd.to_datetime(df_one["dt_time"], errors="coerce")
-                        pollutant_col = _find_pollutant_col(df_one, pollutant)
-                        if pollutant_col is None:
-                            msg = f"Column not found for '{pollutant}' (single-param). cols={list(df_one.columns)[:12]}"
-                            error_rows.append({
-                                "City": clean_city, "Station": record["Location"], "SiteID": record["site_id"],
-                                "Pollutant": pollutant, "Error": msg
-                            })
-                            city_uptime[pollutant].append({
-                                "Station": record["Location"],
-                                uptime_label: "",
-                                valid_label: "",
-                                expected_label: expected_total
-                            })
-                            continue
-
-                        sub = df_one[["dt_time", pollutant_col]].copy()
-                    else:
-                        sub = df_all[["dt_time", pollutant_col]].copy()
-
-                    sub[pollutant_col] = pd.to_numeric(sub[pollutant_col], errors="coerce")
-
-                    valid = sub[pollutant_col].notna().sum()
-                    total = expected_total
-                    uptime = round((valid / total) * 100, 2) if total else 0
-
-                    city_uptime[pollutant].append({
-                        "Station": record["Location"],
-                        uptime_label: uptime,
-                        valid_label: valid,
-                        expected_label: total
-                    })
-                    city_frames[pollutant].append(sub)
+        # ===================== WRITE SHEETS ======================
+        emit(job_id, "phase", {"phase": "write", "format": fmt})
+        write_started = time.perf_counter()
 
-            # build city average per pollutant
-            for pollutant in pollutants:
-                if not city_frames[pollutant]:
-                    uptime_dict[pollutant][clean_city] = city_uptime[pollutant]
-                    continue
+        def write_table(name, df):
+            writer.write_table(name, df)
+            bump(cache_stats, "rows_written", len(df))
 
-                combined = pd.concat(city_frames[pollutant], ignore_index=True)
-                pollutant_col = _find_pollutant_col(combined, pollutant)
-                if pollutant_col is None:
-                    uptime_dict[pollutant][clean_city] = city_uptime[pollutant]
-                    continue
+        def on_table(n, pollutant):
+            set_progress(job_id, 91 + int(n / len(pollutants) * 8), table=pollutant)
 
-                city_df = combined.groupby("dt_time", as_index=False)[pollutant_col].mean()
-                city_df[pollutant_col] = city_df[pollutant_col].round(3)
+        _write_tables(write_table, pollutants, concentration, uptime_dict, labels, error_rows, on_table)
 
-                concentration_dict[pollutant][clean_city] = city_df.set_index("dt_time")
-                uptime_dict[pollutant][clean_city] = city_uptime[pollutant]
+    # includes closing the writer (xlsx zip / bundle finalization)
+    record_phase(cache_stats, "write", time.perf_counter() - write_started)
 
-        # ===================== WRITE SHEETS ======================
-        for pollutant in pollutants:
-            pollutant_clean = _clean_pollutant_name(pollutant)
-
-            # pollutant data sheet
-            if concentration_dict.get(pollutant):
-                wide = None
-                for city_name, df_city in concentration_dict[pollutant].items():
-                    df_city = df_city.rename(columns={df_city.columns[0]: city_name})
-                    wide = df_city if wide is None else wide.join(df_city, how="outer")
-
-                wide = wide.sort_index().reset_index().rename(columns={"dt_time": "Timestamp"})
-                wide.to_excel(writer, sheet_name=pollutant_clean[:31], index=False)
-
-            # uptime sheet
-            if uptime_dict.get(pollutant):
-                max_len = max((len(v) for v in uptime_dict[pollutant].values()), default=0)
-                if max_len:
-                    formatted = {}
-                    for city_name, rows in uptime_dict[pollutant].items():
-                        stations = [r.get("Station", "") for r in rows]
-                        uptimes = [r.get(uptime_label, "") for r in rows]
-                        valids = [r.get(valid_label, "") for r in rows]
-                        expecteds = [r.get(expected_label, "") for r in rows]
-
-                        while len(stations) < max_len:
-                            stations.append("")
-                            uptimes.append("")
-                            valids.append("")
-                            expecteds.append("")
-
-                        formatted[f"{city_name} Stations"] = stations
-                        formatted[f"{city_name} {uptime_label}"] = uptimes
-                        formatted[f"{city_name} {valid_label}"] = valids
-                        formatted[f"{city_name} {expected_label}"] = expecteds
-
-                    pd.DataFrame(formatted).to_excel(
-                        writer,
-                        sheet_name=f"{pollutant_clean}_UPTIME"[:31],
-                        index=False
-                    )
-
-        # keep ERRORS sheet (so you still see failures)
-        if error_rows:
-            pd.DataFrame(error_rows).to_excel(writer, sheet_name="ERRORS", index=False)
\ No newline at end of file
+
+def _slug(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in name).strip("_") or "city"
+
+
+def _info_tables(city_sites):
+    """INFO sheet tables: station count per city and the station names, one column per city."""
+    city_counts = []
+    station_columns = {}
+
+    for clean_city, site_records in city_sites:
+        stations = [r.location for r in site_records]
+        city_counts.append({"City": clean_city, "Station Count": len(stations)})
+        station_columns[f"{clean_city} Stations"] = stations
+
+    if station_columns:
+        max_len = max(len(v) for v in station_columns.values())
+        for key in station_columns:
+            station_columns[key] += [""] * (max_len - len(station_columns[key]))
+
+    return pd.DataFrame(city_counts), pd.DataFrame(station_columns)
+
+
+def _write_tables(write_table, pollutants, concentration, uptime_dict, labels, error_rows, on_table=None):
+    """Pollutant sheets, their _UPTIME sheets and ERRORS, through write_table(name, df)."""
+    uptime_label, valid_label, expected_label = labels
+
+    for n, pollutant in enumerate(pollutants):
+        if on_table:
+            on_table(n, pollutant)
+        pollutant_clean = _clean_pollutant_name(pollutant)
+
+        # pollutant data sheet
+        if pollutant in concentration:
+            write_table(pollutant_clean[:31], concentration[pollutant])
+
+        # uptime sheet
+        if uptime_dict.get(pollutant):
+            max_len = max((len(v) for v in uptime_dict[pollutant].values()), default=0)
+            if max_len:
+                formatted = {}
+                for city_name, rows in uptime_dict[pollutant].items():
+                    stations = [r.get("Station", "") for r in rows]
+                    uptimes = [r.get(uptime_label, "") for r in rows]
+                    valids = [r.get(valid_label, "") for r in rows]
+                    expecteds = [r.get(expected_label, "") for r in rows]
+
+                    while len(stations) < max_len:
+                        stations.append("")
+                        uptimes.append("")
+                        valids.append("")
+                        expecteds.append("")
+
+                    formatted[f"{city_name} Stations"] = stations
+                    formatted[f"{city_name} {uptime_label}"] = uptimes
+                    formatted[f"{city_name} {valid_label}"] = valids
+                    formatted[f"{city_name} {expected_label}"] = expecteds
+
+                write_table(f"{pollutant_clean}_UPTIME"[:31], pd.DataFrame(formatted))
+
+    # keep ERRORS sheet (so you still see failures)
+    if error_rows:
+        write_table("ERRORS", pd.DataFrame(error_rows))
+
+
+def _write_part(
+    part_path, fmt, info, city_site, results, site_jobs, pollutants, expected_total, labels,
+    base, aggregation, window
+):
+    """One city's complete export (same sheets as the full file), written atomically."""
+    clean_city, site_records = city_site
+    concentration, uptime_dict = _aggregate(
+        results, site_jobs, [(clean_city, 0, len(site_jobs))], pollutants, expected_total, labels,
+        base=base, aggregation=aggregation, window=window
+    )
+    error_rows = [row for _, site_errors in results for row in site_errors]
+
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    tmp_path = f"{part_path}.tmp"
+    with open_writer(tmp_path, fmt) as writer:
+        writer.write_info(info, *_info_tables([city_site]))
+        _write_tables(writer.write_table, pollutants, concentration, uptime_dict, labels, error_rows)
+    os.replace(tmp_path, part_path)
@@ -0,0 +1,24 @@
+"""
+Pollutant display name -> ATMOS parameter code (light module: used by the API and the mirror).
+"""
+
+POLLUTANT_MAP = {
+    "PM10": "pm10cnc",
+    "PM2.5": "pm2.5cnc",
+    "NO2": "no2ppb",
+    "CO": "co",
+    "Ozone": "o3ppb",
+    "SO2": "so2",
+    "NH3": "nh3",
+    "Benzene": "benzene",
+    "Eth-Benzene": "ethbenzene",
+    "Toluene": "toluene",
+    "Xylene": "xylene",
+    "RH": "rh",
+    "Temp": "tempc",
+    "WS": "ws",
+    "WD": "wd",
+    "CH4": "ch4",
+    "CO2": "co2",
+    "AT": "at"
+}
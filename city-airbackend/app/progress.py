@@ -0,0 +1,56 @@
+"""
+In-process job state shared by the API and the export pipeline
+(no heavy imports, so the API can read it without loading the pipeline).
+
+The pipeline reports through set_progress() / emit(); listeners registered
+with add_listener() (e.g. the job store) get every event as
+fn(job_id, event, data).
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+progress_store: Dict[str, int] = {}
+stats_store: Dict[str, Dict[str, int]] = {}  # per-job counters (cache hits/misses, retries, bytes, ...)
+totals: Dict[str, int] = {}  # the same counters summed over the process (exported by app.metrics)
+
+_listeners: List[Callable[[str, str, Dict[str, Any]], None]] = []
+_stats_lock = threading.Lock()
+
+
+def add_listener(fn: Callable[[str, str, Dict[str, Any]], None]):
+    _listeners.append(fn)
+
+
+def remove_listener(fn: Callable[[str, str, Dict[str, Any]], None]):
+    _listeners.remove(fn)
+
+
+def emit(job_id: str, event: str, data: Optional[Dict[str, Any]] = None):
+    for fn in _listeners:
+        fn(job_id, event, data or {})
+
+
+def set_progress(job_id: str, progress: int, **data):
+    progress_store[job_id] = progress
+    emit(job_id, "progress", {"progress": progress, **data, "stats": dict(stats_store.get(job_id) or {})})
+
+
+def snapshot_totals() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(totals)
+
+
+def bump(stats: Optional[Dict[str, int]], name: str, n: int = 1):
+    """Thread-safe counter increment on a job's stats dict (if any) and the process totals."""
+    with _stats_lock:
+        totals[name] = totals.get(name, 0) + n
+        if stats is not None:
+            stats[name] = stats.get(name, 0) + n
+
+
+def merge(stats: Dict[str, int], counts: Dict[str, int]):
+    """Add counters collected elsewhere (another process or job-local dict) to a job's stats; totals untouched."""
+    with _stats_lock:
+        for name, n in counts.items():
+            stats[name] = stats.get(name, 0) + n
@@ -0,0 +1,278 @@
+"""
+Synchronous time-series queries (GET /series): the export's fetch and
+aggregation stages without the job queue or an export file.
+
+A query fetches its stations like an export (batched multi-site calls, the
+ATMOS cache, the availability index), derives the aggregation the same way
+(app.resample coverage rules) and returns either city means (the export's
+pollutant sheets) or each station's own series. The result is a list of
+blocks, one per (city or station, pollutant), holding only valid buckets,
+encoded on the fly as NDJSON lines or Arrow IPC stream batches.
+
+Results are kept in memory per request fingerprint: SERIES_RESULT_TTL seconds
+while the window reaches into the range ATMOS may still revise
+(CACHE_MUTABLE_WINDOW), SERIES_SETTLED_TTL once it is settled; concurrent
+identical queries wait for the one being computed instead of fetching again.
+The ETag is a hash of the result, so If-None-Match revalidations of a
+memoized result cost no fetch and no encoding.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import jobs
+from .cache import CACHE_MUTABLE_WINDOW
+from .pipeline import _aggregate, _data_mode, _expected_total_points, _fetch_sites
+from .resample import base_for, grid_stages
+from .retry import RetryBudget
+from .series import grid, resample
+
+# stations x pollutants x buckets a synchronous query may cover (bigger ones go through /export)
+SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS", "2000000"))
+SERIES_RESULT_TTL = int(os.getenv("SERIES_RESULT_TTL", "60"))
+SERIES_SETTLED_TTL = int(os.getenv("SERIES_SETTLED_TTL", "3600"))
+SERIES_CACHE_MAX_BYTES = int(os.getenv("SERIES_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+# retries one query may spend in total (an export gets RetryBudget.for_job)
+SERIES_RETRY_BUDGET = int(os.getenv("SERIES_RETRY_BUDGET", "4"))
+SERIES_CHUNK_ROWS = int(os.getenv("SERIES_CHUNK_ROWS", "5000"))
+
+# format -> media type
+SERIES_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# block key columns per level, in output order
+KEY_COLUMNS = {
+    "city": ("city", "pollutant"),
+    "station": ("city", "site_id", "station", "pollutant"),
+}
+
+ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+class TooLarge(ValueError):
+    """Query over SERIES_MAX_POINTS."""
+
+
+class Block(NamedTuple):
+    keys: Tuple[str, ...]  # KEY_COLUMNS values
+    times: np.ndarray      # datetime64[s] bucket starts with a valid value
+    values: np.ndarray     # float64, rounded to 3 decimals like the export
+
+
+class Result(NamedTuple):
+    level: str
+    blocks: List[Block]
+    errors: List[dict]     # ERRORS sheet rows
+    etag: str
+    nbytes: int
+    expires: float         # time.monotonic()
+
+
+_memo: "OrderedDict[str, Result]" = OrderedDict()
+_memo_bytes = 0
+_memo_lock = threading.Lock()
+_inflight: Dict[str, threading.Lock] = {}
+
+
+def _cached(fp: str) -> Optional[Result]:
+    global _memo_bytes
+    with _memo_lock:
+        result = _memo.get(fp)
+        if result is None:
+            return None
+        if result.expires < time.monotonic():
+            del _memo[fp]
+            _memo_bytes -= result.nbytes
+            return None
+        _memo.move_to_end(fp)
+        return result
+
+
+def _remember(fp: str, result: Result):
+    global _memo_bytes
+    if result.nbytes > SERIES_CACHE_MAX_BYTES:
+        return
+    with _memo_lock:
+        old = _memo.pop(fp, None)
+        if old is not None:
+            _memo_bytes -= old.nbytes
+        _memo[fp] = result
+        _memo_bytes += result.nbytes
+        while _memo_bytes > SERIES_CACHE_MAX_BYTES:
+            _, evicted = _memo.popitem(last=False)
+            _memo_bytes -= evicted.nbytes
+
+
+def _ttl(end: str, errors: List[dict]) -> int:
+    """Short while ATMOS may still revise the window (or a fetch failed), long once settled."""
+    settled_before = pd.Timestamp.now() - pd.Timedelta(seconds=CACHE_MUTABLE_WINDOW)
+    failed = any(not str(row.get("Error", "")).startswith("No data expected") for row in errors)
+    if failed or pd.Timestamp(end) >= settled_before:
+        return SERIES_RESULT_TTL
+    return SERIES_SETTLED_TTL
+
+
+def _digest(level: str, blocks: List[Block]) -> str:
+    h = hashlib.blake2b(level.encode(), digest_size=16)
+    for block in blocks:
+        h.update(json.dumps(block.keys).encode())
+        h.update(block.times.tobytes())
+        h.update(block.values.tobytes())
+    return h.hexdigest()
+
+
+def check_size(catalog, start: str, end: str, aggregation: str, cities: List[str], pollutants: List[str], data_mode="live"):
+    """Raise TooLarge when the query needs more than SERIES_MAX_POINTS base buckets."""
+    n_sites = sum(len(catalog.get_sites_for_city(city)) for city in cities)
+    points = n_sites * len(pollutants) * _expected_total_points(start, end, base_for(aggregation, data_mode))
+    if points > SERIES_MAX_POINTS:
+        raise TooLarge(
+            f"Query covers {points} station data points (limit {SERIES_MAX_POINTS}); "
+            "use /export for windows this large"
+        )
+
+
+def _compute(catalog, start, end, aggregation, cities, pollutants, level, gaps, gap_value, data_mode, stats) -> Result:
+    base = base_for(aggregation, data_mode)
+    site_jobs = []
+    city_slices = []
+    for city in cities:
+        clean_city = city.split("(")[0].strip()
+        site_records = catalog.get_sites_for_city(city)
+        city_slices.append((clean_city, len(site_jobs), len(site_jobs) + len(site_records)))
+        site_jobs.extend((clean_city, record) for record in site_records)
+
+    results = [None] * len(site_jobs)
+    for offset, batch_results in _fetch_sites(
+        site_jobs, stats, None, RetryBudget(SERIES_RETRY_BUDGET),
+        pollutants=pollutants, start=start, end=end, gaps=gaps, gap_value=gap_value,
+        aggregation=base, data_mode=_data_mode(base, data_mode),
+    ):
+        results[offset:offset + len(batch_results)] = batch_results
+
+    blocks = []
+    if level == "city":
+        labels = ("Uptime(%)", "Valid", "Expected")
+        concentration, _ = _aggregate(
+            results, site_jobs, city_slices, pollutants, 0, labels,
+            base=base, aggregation=aggregation, window=(start, end)
+        )
+        for pollutant in pollutants:
+            wide = concentration.get(pollutant)
+            if wide is None:
+                continue
+            times = wide["Timestamp"].to_numpy(dtype="datetime64[s]")
+            for city in wide.columns[1:]:
+                values = wide[city].to_numpy(dtype=np.float64)
+                valid = ~np.isnan(values)
+                if valid.any():
+                    blocks.append(Block((city, pollutant), times[valid], values[valid]))
+    else:
+        out_grid = grid(start, end, aggregation)
+        stages = grid_stages(base, aggregation, start, end) if base != aggregation else []
+        for pollutant in pollutants:
+            for (clean_city, record), (frames, _) in zip(site_jobs, results):
+                if pollutant not in frames:
+                    continue
+                s = resample(frames[pollutant], stages)
+                valid = s.mask()
+                if valid.any():
+                    times = out_grid.times[s.offsets[valid]].astype("datetime64[s]")
+                    values = s.values[valid].astype(np.float64).round(3)
+                    blocks.append(Block((clean_city, record.site_id, record.location, pollutant), times, values))
+
+    errors = [row for _, site_errors in results for row in site_errors]
+    return Result(
+        level=level,
+        blocks=blocks,
+        errors=errors,
+        etag=_digest(level, blocks),
+        nbytes=sum(b.times.nbytes + b.values.nbytes for b in blocks),
+        expires=time.monotonic() + _ttl(end, errors),
+    )
+
+
+def run(
+    catalog, start, end, aggregation, cities, pollutants,
+    level="city", gaps=1, gap_value="NULL", data_mode="live", stats=None
+) -> Tuple[Result, str]:
+    """Result of a query and where it came from ("memo" or "computed")."""
+    fp = jobs.fingerprint({
+        "start": start, "end": end, "aggregation": aggregation,
+        "cities": [c.split("(")[0].strip().lower() for c in cities],
+        "pollutants": list(pollutants), "level": level,
+        "gaps": gaps, "gap_value": gap_value, "data_mode": data_mode,
+    })
+    result = _cached(fp)
+    if result is not None:
+        return result, "memo"
+
+    with _memo_lock:
+        lock = _inflight.setdefault(fp, threading.Lock())
+    with lock:
+        # an identical query may have finished while this one waited
+        result = _cached(fp)
+        if result is not None:
+            return result, "memo"
+        try:
+            result = _compute(
+                catalog, start, end, aggregation, cities, pollutants, level, gaps, gap_value, data_mode, stats
+            )
+            _remember(fp, result)
+        finally:
+            with _memo_lock:
+                _inflight.pop(fp, None)
+    return result, "computed"
+
+
+def _chunks(blocks: List[Block]) -> Iterator[Tuple[Tuple[str, ...], np.ndarray, np.ndarray]]:
+    for block in blocks:
+        for i in range(0, len(block.times), SERIES_CHUNK_ROWS):
+            yield block.keys, block.times[i:i + SERIES_CHUNK_ROWS], block.values[i:i + SERIES_CHUNK_ROWS]
+
+
+def ndjson(result: Result) -> Iterator[bytes]:
+    """One {<keys>, "timestamp", "value"} object per line, SERIES_CHUNK_ROWS lines per chunk."""
+    columns = KEY_COLUMNS[result.level]
+    for keys, times, values in _chunks(result.blocks):
+        prefix = json.dumps(dict(zip(columns, keys)))[:-1] + ', "timestamp": "'
+        stamps = np.datetime_as_string(times, unit="m")
+        yield "".join(
+            f'{prefix}{ts}", "value": {value!r}}}\n' for ts, value in zip(stamps.tolist(), values.tolist())
+        ).encode()
+
+
+def arrow_schema(level: str):
+    import pyarrow as pa
+
+    return pa.schema(
+        [(column, pa.string()) for column in KEY_COLUMNS[level]]
+        + [("timestamp", pa.timestamp("s")), ("value", pa.float64())]
+    )
+
+
+def arrow_stream(result: Result) -> Iterator[bytes]:
+    """Arrow IPC stream: the schema, one record batch per chunk, end-of-stream marker."""
+    import pyarrow as pa
+
+    schema = arrow_schema(result.level)
+    yield schema.serialize().to_pybytes()
+    for keys, times, values in _chunks(result.blocks):
+        n = len(times)
+        columns = [pa.array([key] * n, pa.string()) for key in keys]
+        columns += [pa.array(times, pa.timestamp("s")), pa.array(values, pa.float64())]
+        yield pa.record_batch(columns, schema=schema).serialize().to_pybytes()
+    yield ARROW_EOS
+
+
+ENCODERS = {"ndjson": ndjson, "arrow": arrow_stream}
@@ -0,0 +1,201 @@
+"""
+Coarser aggregations derived locally from 15-min (or hourly) base data.
+
+Buckets are built in stages, each from the one below, CPCB style:
+
+    15-min -> hourly  (4 quarter-hours)
+    hourly -> daily   (24 hours)
+    daily  -> monthly (days in the month)
+    daily  -> yearly  (days in the year)
+
+A bucket gets the mean of its valid sub-buckets when at least MIN_COVERAGE
+(default 75%) of the sub-buckets it should contain are valid, and is invalid
+(NaN) otherwise. Uptime then counts exactly the buckets that met the rule.
+Buckets cut by the export window (e.g. a month the export starts halfway
+through) only expect the sub-buckets inside the window.
+
+The pipeline resamples its compact station series (app.series) with
+grid_stages(); resample_long() does the same on a long (site, pollutant,
+dt_time, value) table, one vectorized pass per stage for all stations and
+pollutants together (local mirror reads).
+"""
+
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# "local": fetch base data once and derive the export aggregation here
+# "api"  : ask ATMOS for the aggregation directly (previous behaviour)
+RESAMPLE_MODE = os.getenv("RESAMPLE_MODE", "local")
+RESAMPLE_BASE = os.getenv("RESAMPLE_BASE", "15min")  # "15min" or "hourly"
+MIN_COVERAGE = float(os.getenv("RESAMPLE_MIN_COVERAGE", "0.75"))
+
+# target aggregation -> stages applied on top of 15-min data
+STAGES = {
+    "hourly": ["hourly"],
+    "daily": ["hourly", "daily"],
+    "monthly": ["hourly", "daily", "monthly"],
+    "yearly": ["hourly", "daily", "yearly"],
+}
+
+# stage -> length of one of its sub-buckets
+SUB_BUCKET = {
+    "hourly": pd.Timedelta(minutes=15),
+    "daily": pd.Timedelta(hours=1),
+    "monthly": pd.Timedelta(days=1),
+    "yearly": pd.Timedelta(days=1),
+}
+
+
+def base_for(aggregation: str, data_mode: str = "live") -> str:
+    """Aggregation to fetch for an export: the base when resampling locally, else the export's own."""
+    if aggregation not in STAGES:
+        return aggregation
+    if data_mode == "local":
+        return "15min"  # all the mirror holds
+    if RESAMPLE_MODE == "local":
+        return RESAMPLE_BASE
+    return aggregation
+
+
+def describe(base: str, aggregation: str) -> str:
+    """INFO sheet note for a derived aggregation."""
+    steps = " -> ".join([base] + [s for s in STAGES[aggregation] if s != base])
+    return f"Derived locally ({steps}); a bucket is valid when >= {MIN_COVERAGE:.0%} of its sub-buckets are valid"
+
+
+# stage -> numpy unit its buckets are truncated to
+BUCKET_UNIT = {
+    "hourly": "datetime64[h]",
+    "daily": "datetime64[D]",
+    "monthly": "datetime64[M]",
+    "yearly": "datetime64[Y]",
+}
+
+
+def _sub_buckets(buckets: pd.DatetimeIndex, stage: str, window: Optional[Tuple[pd.Timestamp, pd.Timestamp]]) -> np.ndarray:
+    """Number of sub-buckets each bucket should contain (inside the window, if given)."""
+    if stage == "hourly":
+        ends = buckets + pd.Timedelta(hours=1)
+    elif stage == "daily":
+        ends = buckets + pd.Timedelta(days=1)
+    elif stage == "monthly":
+        ends = buckets + pd.to_timedelta(buckets.days_in_month, unit="D")
+    else:
+        ends = buckets + pd.to_timedelta(np.where(buckets.is_leap_year, 366, 365), unit="D")
+
+    starts = buckets
+    if window is not None:
+        starts = starts.where(starts >= window[0], window[0])
+        ends = ends.where(ends <= window[1], window[1])
+    return np.maximum(1, np.ceil((ends - starts) / SUB_BUCKET[stage]))
+
+
+def _stage(long: pd.DataFrame, stage: str, window=None) -> pd.DataFrame:
+    """
+    One resampling stage. Rows are grouped by (site, pollutant, bucket) with
+    np.add.reduceat over contiguous runs, so no hash groupby is needed: the
+    long table is already ordered by station/pollutant and then time (it is
+    sorted first when it is not).
+    """
+    site = long["site"].to_numpy()
+    pollutant = long["pollutant"].to_numpy()
+    values = long["value"].to_numpy(dtype=float)
+    buckets = long["dt_time"].to_numpy(dtype="datetime64[ns]").astype(BUCKET_UNIT[stage]).astype("datetime64[ns]")
+
+    series = site.astype(np.int64) * (int(pollutant.max()) + 1 if len(pollutant) else 1) + pollutant
+    ticks = buckets.view(np.int64)
+    d_series, d_ticks = np.diff(series), np.diff(ticks)
+    if not np.all((d_series > 0) | ((d_series == 0) & (d_ticks >= 0))):
+        order = np.lexsort((ticks, series))
+        site, pollutant, values, buckets, series, ticks = (
+            a[order] for a in (site, pollutant, values, buckets, series, ticks)
+        )
+        d_series, d_ticks = np.diff(series), np.diff(ticks)
+
+    starts = np.flatnonzero(np.concatenate(([True], (d_series != 0) | (d_ticks != 0)))) if len(series) else np.empty(0, int)
+    valid = ~np.isnan(values)
+    if len(starts):
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        counts = np.add.reduceat(valid.astype(np.int64), starts)
+    else:
+        sums = counts = np.empty(0)
+
+    bucket_starts = pd.DatetimeIndex(buckets[starts])
+    needed = np.ceil(MIN_COVERAGE * _sub_buckets(bucket_starts, stage, window))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where((counts >= needed) & (counts > 0), sums / np.maximum(counts, 1), np.nan)
+
+    return pd.DataFrame({
+        "site": site[starts],
+        "pollutant": pollutant[starts],
+        "dt_time": buckets[starts],
+        "value": mean,
+    })
+
+
+def _window(start: Optional[str], end: Optional[str]):
+    """Export [start, end] (end inclusive, minute resolution) as a half-open interval."""
+    if start is None or end is None:
+        return None
+    return pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(minutes=1)
+
+
+def resample_long(
+    long: pd.DataFrame, base: str, aggregation: str,
+    start: Optional[str] = None, end: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    long: (site, pollutant, dt_time, value) rows at `base` resolution.
+    Returns the same columns at `aggregation` resolution (invalid buckets = NaN).
+    start/end: the export window, for the coverage of buckets it cuts.
+    """
+    if aggregation not in STAGES or aggregation == base:
+        return long
+    long = long.dropna(subset=["dt_time"])
+    window = _window(start, end)
+    for stage in STAGES[aggregation]:
+        if stage == base:
+            continue
+        long = _stage(long, stage, window)
+    return long
+
+
+def grid_stages(base: str, aggregation: str, start: str, end: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stages from the `base` grid of an export window to its `aggregation` grid,
+    for app.series.resample: [(bucket_of, needed)] where bucket_of maps each
+    bucket of the previous grid to its bucket on the stage's grid and needed
+    is the MIN_COVERAGE count of valid sub-buckets per stage bucket.
+    """
+    from .series import grid
+
+    if aggregation not in STAGES or aggregation == base:
+        return []
+    window = _window(start, end)
+    prev = grid(start, end, base)
+    stages = []
+    for stage in STAGES[aggregation]:
+        if stage == base:
+            continue
+        nxt = grid(start, end, stage)
+        bucket_of, _ = nxt.positions(prev.times.astype(BUCKET_UNIT[stage]).astype("datetime64[ns]"))
+        needed = np.ceil(MIN_COVERAGE * _sub_buckets(pd.DatetimeIndex(nxt.times), stage, window))
+        stages.append((bucket_of, np.asarray(needed)))
+        prev = nxt
+    return stages
+
+
+def resample_frame(
+    df: pd.DataFrame, params: List[str], base: str, aggregation: str,
+    start: Optional[str] = None, end: Optional[str] = None,
+) -> pd.DataFrame:
+    """resample_long for one station's wide frame (dt_time + param columns)."""
+    if df.empty or aggregation not in STAGES or aggregation == base:
+        return df
+    long = df.melt(id_vars="dt_time", value_vars=[p for p in params if p in df.columns], var_name="pollutant")
+    long.insert(0, "site", 0)
+    out = resample_long(long, base, aggregation, start, end)
+    return out.pivot(index="dt_time", columns="pollutant", values="value").reset_index().rename_axis(columns=None)
@@ -0,0 +1,127 @@
+"""
+Retry policy for ATMOS calls.
+
+  - backoff()        : exponential backoff with full jitter, honouring Retry-After
+  - RetryBudget      : per-job cap on the number of retries, shared by all threads
+  - CircuitBreaker   : per-host breaker; opens when the recent upstream error rate
+                       crosses BREAKER_THRESHOLD so calls fast-fail instead of
+                       piling onto an overloaded ATMOS, then lets one probe
+                       through after BREAKER_COOLDOWN seconds.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+
+# per job: max(RETRY_BUDGET_MIN, RETRY_BUDGET_RATIO * stations) retries in total
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "20"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.5"))
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "50"))          # last N calls per host
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "20"))    # before the rate is trusted
+BREAKER_THRESHOLD = float(os.getenv("BREAKER_THRESHOLD", "0.5"))  # failure rate that opens it
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))    # seconds open before a probe
+
+
+def backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Delay before retry number `attempt` (0-based): uniform in
+    [0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)], but never shorter
+    than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+
+def sleep_before_retry(attempt: int, retry_after: Optional[float] = None):
+    time.sleep(backoff(attempt, retry_after))
+
+
+class RetryBudget:
+    """Thread-safe retry allowance for one export job."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_job(cls, n_stations: int) -> "RetryBudget":
+        return cls(max(RETRY_BUDGET_MIN, int(RETRY_BUDGET_RATIO * n_stations)))
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+def take_retry(budget: Optional[RetryBudget]) -> bool:
+    """True when a retry may be made (always, without a budget)."""
+    return budget is None or budget.take()
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)  # True = failure
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < BREAKER_COOLDOWN:
+                return "open"
+            return "half-open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (one probe at a time once the cooldown is over)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < BREAKER_COOLDOWN or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, failed: bool):
+        with self._lock:
+            if self._opened_at is not None:
+                # result of the half-open probe decides
+                self._probing = False
+                if failed:
+                    self._opened_at = time.monotonic()
+                else:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= BREAKER_MIN_CALLS:
+                rate = sum(self._outcomes) / len(self._outcomes)
+                if rate >= BREAKER_THRESHOLD:
+                    self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+        return breaker
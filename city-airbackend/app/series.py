@@ -0,0 +1,163 @@
+"""
+Compact in-memory station series for the export pipeline.
+
+A station's pollutant travels as a GridSeries instead of a datetime-indexed
+float64 Series viewing the whole parsed response:
+
+  - offsets : int32 positions on the export's grid (one step per bucket of the
+              fetched aggregation, from the export start; the same buckets
+              pipeline._expected_total_points counts). Shared by every
+              pollutant that came from the same response.
+  - values  : float32, NaN where invalid
+  - valid   : validity bitmask (np.packbits), for counts without a NaN scan
+
+Rows are snapped to the bucket they fall in (timestamp floored to the grid
+unit); several rows in one bucket become the mean of their valid values.
+Rows outside the export window are dropped (counted as "off_grid_rows" in the
+job stats and reported to the caller). Resampling, city means and uptime work
+on these arrays directly (app.resample.grid_stages, pipeline._aggregate).
+"""
+
+from functools import lru_cache
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .progress import bump
+
+# aggregation -> (numpy datetime unit, buckets per step)
+GRID_UNITS = {
+    "15min": ("m", 15),
+    "hourly": ("h", 1),
+    "daily": ("D", 1),
+    "monthly": ("M", 1),
+    "yearly": ("Y", 1),
+}
+
+
+class Grid(NamedTuple):
+    aggregation: str
+    times: np.ndarray   # datetime64[ns] start of every bucket, export start to end inclusive
+
+    @property
+    def size(self) -> int:
+        return len(self.times)
+
+    def positions(self, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (bucket position, inside mask) of datetime64 times: the bucket each time
+        falls in; positions are only meaningful where the mask is set.
+        """
+        unit, step = GRID_UNITS.get(self.aggregation, ("h", 1))
+        times = np.asarray(times, dtype="datetime64[ns]")
+        if not self.size:
+            return np.zeros(len(times), dtype=np.int64), np.zeros(len(times), dtype=bool)
+        origin = self.times[0].astype(f"datetime64[{unit}]")
+        with np.errstate(invalid="ignore"):
+            pos = (times.astype(f"datetime64[{unit}]") - origin).astype(np.int64) // step
+        inside = (pos >= 0) & (pos < self.size) & ~np.isnat(times)
+        return pos, inside
+
+
+@lru_cache(maxsize=64)
+def grid(start: str, end: str, aggregation: str) -> Grid:
+    """Buckets of an export window (start/end: "YYYY-MM-DDTHH:MM", end inclusive)."""
+    unit, step = GRID_UNITS.get(aggregation, ("h", 1))
+    first, last = pd.Timestamp(start), pd.Timestamp(end)
+    if aggregation == "15min":
+        first, last = first.floor("15min"), last.floor("15min")
+    first, last = np.datetime64(first, unit), np.datetime64(last, unit)
+    if first > last:
+        return Grid(aggregation, np.empty(0, dtype="datetime64[ns]"))
+    times = np.arange(first, last + np.timedelta64(step, unit), np.timedelta64(step, unit))
+    times = times.astype("datetime64[ns]")
+    times.flags.writeable = False  # shared through the cache
+    return Grid(aggregation, times)
+
+
+class GridSeries(NamedTuple):
+    offsets: np.ndarray  # int32 grid positions
+    values: np.ndarray   # float32
+    valid: np.ndarray    # packed validity bits
+
+    def mask(self) -> np.ndarray:
+        return np.unpackbits(self.valid, count=len(self.offsets)).view(bool)
+
+    @property
+    def n_valid(self) -> int:
+        return int(np.unpackbits(self.valid, count=len(self.offsets)).sum())
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.values.nbytes + self.valid.nbytes
+
+
+def from_arrays(offsets: np.ndarray, values: np.ndarray) -> GridSeries:
+    values = np.asarray(values, dtype=np.float32)
+    return GridSeries(np.asarray(offsets, dtype=np.int32), values, np.packbits(~np.isnan(values)))
+
+
+EMPTY = from_arrays(np.empty(0, np.int32), np.empty(0, np.float32))
+
+
+def compact(
+    frames: Dict[str, pd.Series], g: Grid, stats: Optional[Dict[str, int]] = None,
+    dropped: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, GridSeries]:
+    """
+    {pollutant: Series indexed by dt_time} -> {pollutant: GridSeries}. Offsets
+    are computed once per response (Series over the same timestamps share them), and
+    the returned arrays own their data, so the parsed response can be freed.
+    dropped(pollutant, rows) is called for a pollutant with rows outside the window.
+    """
+    placed = {}
+    out = {}
+    for pollutant, sub in frames.items():
+        times = sub.index.to_numpy()
+        # column views of one response: distinct Index objects over the same buffer
+        key = (times.__array_interface__["data"][0], len(times), times.dtype)
+        if key not in placed:
+            pos, keep = g.positions(times)
+            outside = len(keep) - int(keep.sum())
+            if outside:
+                bump(stats, "off_grid_rows", outside)
+            pos = pos[keep]
+            # rows sharing a bucket (off-grid stamps, repeats) -> one offset, mean of the valid values
+            shared = len(pos) > 1 and not (np.diff(pos) > 0).all()
+            offsets, inverse = np.unique(pos, return_inverse=True) if shared else (pos, None)
+            placed[key] = (offsets.astype(np.int32), None if not outside else keep, inverse, outside)
+        offsets, keep, inverse, outside = placed[key]
+        if outside and dropped is not None:
+            dropped(pollutant, outside)
+        values = sub.to_numpy(dtype=np.float32, na_value=np.nan)
+        if keep is not None:
+            values = values[keep]
+        if inverse is not None:
+            valid = ~np.isnan(values)
+            counts = np.bincount(inverse, weights=valid, minlength=len(offsets))
+            sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(offsets))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        out[pollutant] = from_arrays(offsets, values)
+    return out
+
+
+def resample(s: GridSeries, stages) -> GridSeries:
+    """
+    Apply resample stages [(bucket_of, needed)] (see app.resample.grid_stages):
+    each bucket that has rows gets the mean of its valid rows when at least
+    needed[bucket] of them are valid, NaN otherwise.
+    """
+    for bucket_of, needed in stages:
+        buckets = bucket_of[s.offsets]
+        valid = s.mask()
+        n = len(needed)
+        counts = np.bincount(buckets, weights=valid, minlength=n)
+        sums = np.bincount(buckets, weights=np.where(valid, s.values, 0.0), minlength=n)
+        offsets = np.flatnonzero(np.bincount(buckets, minlength=n))
+        counts, sums = counts[offsets], sums[offsets]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where((counts >= needed[offsets]) & (counts > 0), sums / np.maximum(counts, 1), np.nan)
+        s = from_arrays(offsets, mean)
+    return s
@@ -0,0 +1,292 @@
+"""
+Sharded fetch stage: a big export's stations split across processes / hosts.
+
+An export with more than SHARD_SITES stations is planned as work units of
+SHARD_SITES consecutive stations (units table of the job database, see
+app.jobs). Unit workers - SHARD_WORKERS threads in every API process, and any
+`python -m app.shards` worker process pointing at the same JOBS_DB_PATH and
+SHARDS_PATH - claim units with an atomic UPDATE, fetch them with the normal
+batched pipeline and write one parquet shard per unit (long table: site,
+pollutant, grid offset, value).
+
+The job's own thread (the coordinator) runs units of its job too and merges
+the finished shards back into the per-station results the aggregate / write
+stages use, in whatever order they complete. A unit whose worker stops
+heartbeating for SHARD_LEASE seconds is claimed again; finished units survive
+a restart of the job, so a requeued job only fetches what is left.
+"""
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import jobs
+from .progress import merge
+from .retry import RetryBudget
+from .series import EMPTY, from_arrays
+from .site_catalog import SiteRecord
+
+SHARD_SITES = int(os.getenv("SHARD_SITES", "0"))        # stations per work unit (0 = no sharding)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))    # unit worker threads per API process
+SHARD_LEASE = int(os.getenv("SHARD_LEASE", "300"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", "0.5"))
+
+_running: Set[Tuple[str, int]] = set()  # units being fetched in this process
+_running_lock = threading.Lock()
+_started = False
+_heartbeat_started = False
+
+
+def enabled_for(n_sites: int) -> bool:
+    return SHARD_SITES > 0 and n_sites > SHARD_SITES
+
+
+def _worker_id(suffix) -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{suffix}"
+
+
+def plan(job_id: str, site_jobs, fetch_args: dict) -> int:
+    """
+    Insert the job's work units; returns their number. Units of an earlier run
+    of the same job are kept (and finished ones not fetched again) unless they
+    were planned with another SHARD_SITES. The job's retry budget is split
+    across the units by their number of stations.
+    """
+    conn = jobs._conn()
+    now = time.time()
+    total = len(site_jobs)
+    retries = RetryBudget.for_job(total).limit
+    rows = []
+    for unit, first in enumerate(range(0, total, SHARD_SITES)):
+        last = min(first + SHARD_SITES, total)
+        sites = [
+            [i, clean_city, record.site_id, record.location]
+            for i, (clean_city, record) in enumerate(site_jobs[first:last], first)
+        ]
+        share = retries * last // total - retries * first // total
+        rows.append((job_id, unit, json.dumps({"sites": sites, "args": fetch_args, "retries": share}), now))
+
+    existing = conn.execute("SELECT COUNT(*) FROM units WHERE job_id = ?", (job_id,)).fetchone()[0]
+    if existing and existing != len(rows):
+        cleanup(job_id)
+    conn.executemany(
+        "INSERT OR IGNORE INTO units (job_id, unit, status, payload, created_at) VALUES (?, ?, 'queued', ?, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+def cleanup(job_id: str):
+    jobs._conn().execute("DELETE FROM units WHERE job_id = ?", (job_id,))
+    shutil.rmtree(os.path.join(jobs.SHARDS_PATH, job_id), ignore_errors=True)
+
+
+def claim(worker: str, job_id: Optional[str] = None):
+    """Atomically take the oldest queued (or abandoned) unit, of job_id if given."""
+    now = time.time()
+    where = "(status = 'queued' OR (status = 'running' AND heartbeat < ?))"
+    args: list = [now - SHARD_LEASE]
+    if job_id:
+        where += " AND job_id = ?"
+        args.append(job_id)
+    return jobs._conn().execute(
+        "UPDATE units SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1 "
+        f"WHERE rowid = (SELECT rowid FROM units WHERE {where} ORDER BY created_at, unit LIMIT 1) "
+        "RETURNING job_id, unit, payload, attempts",
+        (worker, now, *args),
+    ).fetchone()
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(max(1, SHARD_LEASE // 5))
+        with _running_lock:
+            running = list(_running)
+        # a busy database only skips this round; the next one comes well before the lease runs out
+        try:
+            conn = jobs._conn()
+            now = time.time()
+            for job_id, unit in running:
+                conn.execute("UPDATE units SET heartbeat = ? WHERE job_id = ? AND unit = ?", (now, job_id, unit))
+        except Exception as e:
+            print(f"[shards] heartbeat failed: {e}")
+
+
+def _ensure_heartbeat():
+    global _heartbeat_started
+    with _running_lock:
+        if _heartbeat_started:
+            return
+        _heartbeat_started = True
+    threading.Thread(target=_heartbeat_loop, name="shard-heartbeat", daemon=True).start()
+
+
+def _write_shard(path: str, sites: List[list], results) -> dict:
+    """Parquet long table of a unit's grid series; returns the JSON part (present pollutants, errors)."""
+    site_idx, pollutant, offsets, values = [], [], [], []
+    present: Dict[str, List[str]] = {}
+    errors: Dict[str, list] = {}
+    for (i, *_), (frames, site_errors) in zip(sites, results):
+        present[str(i)] = list(frames)
+        errors[str(i)] = site_errors
+        for p, s in frames.items():
+            site_idx.append(np.full(len(s.offsets), i, dtype=np.int32))
+            pollutant.append(np.full(len(s.offsets), p, dtype=object))
+            offsets.append(s.offsets)
+            values.append(s.values)
+
+    table = pd.DataFrame({
+        "site": np.concatenate(site_idx) if site_idx else np.empty(0, np.int32),
+        "pollutant": np.concatenate(pollutant) if pollutant else np.empty(0, object),
+        "offset": np.concatenate(offsets) if offsets else np.empty(0, np.int32),
+        "value": np.concatenate(values) if values else np.empty(0, np.float32),
+    })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    table.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return {"present": present, "errors": errors}
+
+
+def _read_shard(path: str, sites: List[list], result: dict):
+    """Inverse of _write_shard: one (frames, error_rows) per station of the unit."""
+    table = pd.read_parquet(path)
+    frames: Dict[int, dict] = {i: {} for i, *_ in sites}
+    for (i, p), rows in table.groupby(["site", "pollutant"], sort=False):
+        frames[int(i)][p] = from_arrays(rows["offset"].to_numpy(), rows["value"].to_numpy())
+
+    out = []
+    for i, *_ in sites:
+        # a pollutant the station returned without rows leaves no trace in the long table
+        site_frames = {p: frames[i].get(p, EMPTY) for p in result["present"][str(i)]}
+        out.append((site_frames, result["errors"][str(i)]))
+    return out
+
+
+def run_unit(row, worker: str):
+    """Fetch one claimed unit and store its shard; failures requeue it (up to SHARD_MAX_ATTEMPTS)."""
+    from .pipeline import _fetch_sites  # heavy import, only where units actually run
+
+    job_id, unit = row["job_id"], row["unit"]
+    payload = json.loads(row["payload"])
+    sites = payload["sites"]
+    site_jobs = [(clean_city, SiteRecord(site_id, location)) for _, clean_city, site_id, location in sites]
+    conn = jobs._conn()
+
+    _ensure_heartbeat()
+    with _running_lock:
+        _running.add((job_id, unit))
+    try:
+        stats: Dict[str, int] = {}
+        results = [None] * len(site_jobs)
+        for offset, batch_results in _fetch_sites(
+            site_jobs, stats, job_id, RetryBudget(payload["retries"]), **payload["args"]
+        ):
+            results[offset:offset + len(batch_results)] = batch_results
+
+        path = os.path.join(jobs.SHARDS_PATH, job_id, f"unit-{unit:05d}.parquet")
+        result = _write_shard(path, sites, results)
+        result["stats"] = stats
+        conn.execute(
+            "UPDATE units SET status = 'done', shard_path = ?, result = ?, error = NULL "
+            "WHERE job_id = ? AND unit = ? AND worker = ?",
+            (path, json.dumps(result, default=str), job_id, unit, worker),
+        )
+    except Exception as e:
+        status = "failed" if row["attempts"] >= SHARD_MAX_ATTEMPTS else "queued"
+        try:
+            conn.execute(
+                "UPDATE units SET status = ?, error = ?, worker = NULL WHERE job_id = ? AND unit = ? AND worker = ?",
+                (status, str(e), job_id, unit, worker),
+            )
+        except Exception as db_error:
+            # left 'running' without a heartbeat: claimed again once its lease runs out
+            print(f"[shards] recording the failure of {job_id} unit {unit} failed: {db_error}")
+    finally:
+        with _running_lock:
+            _running.discard((job_id, unit))
+
+
+def fetch_sharded(job_id: str, site_jobs, fetch_args: dict, stats: Dict[str, int]) -> Iterator[tuple]:
+    """
+    Coordinator side of a sharded fetch: plans the units, helps run them and
+    yields (offset, batch results) per finished unit, like pipeline._fetch_sites.
+    Unit counters are merged into stats. Raises when a unit failed for good.
+    """
+    n_units = plan(job_id, site_jobs, fetch_args)
+    worker = _worker_id("coordinator")
+    conn = jobs._conn()
+    merged: Set[int] = set()
+    try:
+        while len(merged) < n_units:
+            finished = conn.execute(
+                "SELECT unit, status, payload, shard_path, result, error FROM units "
+                "WHERE job_id = ? AND status IN ('done', 'failed') ORDER BY unit",
+                (job_id,),
+            ).fetchall()
+            finished = [row for row in finished if row["unit"] not in merged]
+            for row in finished:
+                if row["status"] == "failed":
+                    raise RuntimeError(f"Work unit {row['unit']} failed: {row['error']}")
+                sites = json.loads(row["payload"])["sites"]
+                result = json.loads(row["result"])
+                batch_results = _read_shard(row["shard_path"], sites, result)
+                merge(stats, result["stats"])
+                merged.add(row["unit"])
+                yield sites[0][0], batch_results
+            if finished:
+                continue
+
+            row = claim(worker, job_id)
+            if row is not None:
+                run_unit(row, worker)
+            else:
+                time.sleep(SHARD_POLL_INTERVAL)  # remaining units are running elsewhere
+    finally:
+        cleanup(job_id)
+
+
+def _worker_loop(worker: str):
+    while True:
+        try:
+            row = claim(worker)
+        except Exception:
+            row = None  # database busy; try again next round
+        if row is None:
+            time.sleep(SHARD_POLL_INTERVAL)
+            continue
+        try:
+            run_unit(row, worker)
+        except Exception as e:
+            print(f"[shards] unit {row['job_id']}/{row['unit']} failed: {e}")
+
+
+def start_workers(n: int = SHARD_WORKERS):
+    """Start n unit worker threads in this process (no-op when sharding is off)."""
+    global _started
+    if _started or SHARD_SITES <= 0 or n <= 0:
+        return
+    _started = True
+    for i in range(n):
+        threading.Thread(target=_worker_loop, args=(_worker_id(i),), name=f"shard-worker-{i}", daemon=True).start()
+
+
+if __name__ == "__main__":
+    # worker-only process: python -m app.shards [threads]
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    SHARD_SITES = SHARD_SITES or 1  # workers only fetch units planned by the API processes
+    start_workers(int(sys.argv[1]) if len(sys.argv) > 1 else max(1, SHARD_WORKERS))
+    while True:
+        time.sleep(3600)
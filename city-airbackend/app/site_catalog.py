@@ -1,68 +1,138 @@
-import pandas as pd
+import hashlib
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-class SiteCatalog:
+# bump when the compiled layout changes so stale artifacts are rebuilt
+CATALOG_FORMAT = 1
+
+
+class SiteRecord(NamedTuple):
+    site_id: str
+    location: str
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compile_catalog(xlsx_path: str) -> List[List[str]]:
     """
-    Expected Excel columns:
-    site_id, Location, City, State
+    Parse the site Excel into normalized [site_id, Location, City, State] rows.
+    The only place pandas/openpyxl are needed.
     """
+    import pandas as pd
 
-    def __init__(self, xlsx_path: str):
-        df = pd.read_excel(xlsx_path)
+    df = pd.read_excel(xlsx_path)
 
-        required = {"site_id", "City", "Location"}
-        missing = required - set(df.columns)
-        if missing:
-            raise ValueError(f"Excel missing required columns: {sorted(list(missing))}")
-        df["site_id"] = df["site_id"].str.replace(r"\.0$", "", regex=True)
-        
-        # df["site_id"] = df["site_id"].astype(str).str.strip()
-        df["City"] = df["City"].astype(str).str.strip()
-        df["Location"] = df["Location"].astype(str).str.strip()
+    required = {"site_id", "City", "Location"}
+    missing = required - set(df.columns)
+    if missing:
+        raise ValueError(f"Excel missing required columns: {sorted(list(missing))}")
+    df["site_id"] = df["site_id"].str.replace(r"\.0$", "", regex=True)
 
-        if "State" not in df.columns:
-            df["State"] = ""
+    # df["site_id"] = df["site_id"].astype(str).str.strip()
+    df["City"] = df["City"].astype(str).str.strip()
+    df["Location"] = df["Location"].astype(str).str.strip()
 
-        df["State"] = df["State"].astype(str).str.strip()
+    if "State" not in df.columns:
+        df["State"] = ""
 
-        df["_city_norm"] = df["City"].str.lower()
+    df["State"] = df["State"].astype(str).str.strip()
 
-        self.df = df
+    return [
+        [str(site_id), location, city, state]
+        for site_id, location, city, state in zip(df["site_id"], df["Location"], df["City"], df["State"])
+    ]
 
-    # 🔹 Used by frontend (City (State))
-    def list_cities(self):
-        cities = (
-            self.df[["City", "State"]]
-            .drop_duplicates()
-            .sort_values("City")
-        )
 
-        return [
-            {
-                "city": row["City"],
-                "state": row["State"]
-            }
-            for _, row in cities.iterrows()
-        ]
+def load_rows(xlsx_path: str, compiled_path: Optional[str] = None) -> List[List[str]]:
+    """
+    Catalog rows from the compiled JSON artifact next to the Excel file,
+    re-compiling only when the Excel changed (size/mtime, then sha256).
+    """
+    compiled_path = compiled_path or os.getenv("CATALOG_COMPILED_PATH") or f"{xlsx_path}.compiled.json"
+    st = os.stat(xlsx_path)
 
-    # 🔹 Used by pipeline
-    def get_sites_for_city(self, city: str):
-        # City may come as "Delhi (Delhi)"
-        clean_city = city.split("(")[0].strip().lower()
+    try:
+        with open(compiled_path, "r", encoding="utf-8") as f:
+            compiled = json.load(f)
+        source = compiled["source"]
+        if compiled.get("format") == CATALOG_FORMAT:
+            if source["size"] == st.st_size and source["mtime_ns"] == st.st_mtime_ns:
+                return compiled["rows"]
+            if source["size"] == st.st_size and source["sha256"] == _file_sha256(xlsx_path):
+                return compiled["rows"]  # touched but identical content
+    except (OSError, ValueError, KeyError):
+        pass
 
-        sub = self.df[self.df["_city_norm"] == clean_city]
+    rows = compile_catalog(xlsx_path)
+    compiled = {
+        "format": CATALOG_FORMAT,
+        "source": {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _file_sha256(xlsx_path)},
+        "rows": rows,
+    }
+    try:
+        tmp_path = f"{compiled_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(compiled, f)
+        os.replace(tmp_path, compiled_path)
+    except OSError:
+        pass  # read-only location: still works, just re-parses next boot
+    return rows
 
-        records = []
 
-        for _, row in sub.iterrows():
-            records.append({
-                "site_id": row["site_id"],
-                "Location": row["Location"]
-            })
+class SiteCatalog:
+    """
+    Expected Excel columns:
+    site_id, Location, City, State
+
+    The Excel is parsed once into a compiled JSON artifact (see load_rows), so
+    a normal boot needs neither pandas nor openpyxl. Everything the API and the
+    pipeline ask for is indexed at load time: city -> immutable tuple of
+    SiteRecord, plus the sorted city list and its pre-rendered JSON.
+    """
+
+    def __init__(self, xlsx_path: str, compiled_path: Optional[str] = None):
+        self.rows = load_rows(xlsx_path, compiled_path)
+        self._build_index()
+
+    def _build_index(self):
+        sites: Dict[str, List[SiteRecord]] = {}
+        for site_id, location, city, _ in self.rows:
+            sites.setdefault(city.lower(), []).append(SiteRecord(site_id, location))
+        self._sites_by_city: Dict[str, Tuple[SiteRecord, ...]] = {
+            city_norm: tuple(records) for city_norm, records in sites.items()
+        }
+
+        pairs = dict.fromkeys((city, state) for _, _, city, state in self.rows)
+        self._cities = tuple(
+            {"city": city, "state": state}
+            for city, state in sorted(pairs, key=lambda pair: pair[0])
+        )
+        self._cities_json = json.dumps({"cities": list(self._cities)}).encode()
+
+    @staticmethod
+    def _norm(city: str) -> str:
+        # City may come as "Delhi (Delhi)"
+        return city.split("(")[0].strip().lower()
+
+    # 🔹 Used by frontend (City (State))
+    def list_cities(self):
+        return list(self._cities)
 
-        return records
+    # 🔹 /meta/cities response body, rendered once
+    def cities_json(self) -> bytes:
+        return self._cities_json
+
+    # 🔹 Used by pipeline
+    def get_sites_for_city(self, city: str) -> Tuple[SiteRecord, ...]:
+        return self._sites_by_city.get(self._norm(city), ())
 
     # 🔹 Used for INFO sheet station list
     def get_station_names_for_city(self, city: str):
-        clean_city = city.split("(")[0].strip().lower()
-        sub = self.df[self.df["_city_norm"] == clean_city]
-        return sub["Location"].dropna().unique().tolist()
+        return list(dict.fromkeys(r.location for r in self.get_sites_for_city(city)))
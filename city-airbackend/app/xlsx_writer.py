@@ -0,0 +1,116 @@
+"""
+Constant-memory xlsx writer (xlsxwriter with constant_memory=True).
+
+Unlike pd.ExcelWriter(engine="openpyxl") nothing is kept as a workbook DOM:
+each row is flushed to the sheet's temp file as soon as the next row starts,
+so memory stays flat no matter how many rows are written.
+
+The one rule of constant_memory mode: rows of a sheet must be written
+top-to-bottom. StreamingWorkbook keeps a cursor per sheet and only ever
+appends, so callers just pass DataFrames / row iterables in sheet order.
+"""
+
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+MAX_SHEET_NAME = 31
+
+
+def _column_values(s: pd.Series) -> np.ndarray:
+    """Object array of Excel-writable values for one column (NaN/NaT -> None = empty cell)."""
+    missing = s.isna().to_numpy()
+
+    if pd.api.types.is_datetime64_any_dtype(s):
+        values = np.array(s.dt.to_pydatetime(), dtype=object)
+    elif pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        values = s.to_numpy(dtype=object, na_value=None)
+    else:
+        values = s.to_numpy(dtype=object, na_value=None)
+        values = np.array(
+            [v.item() if isinstance(v, np.generic) else v for v in values],
+            dtype=object
+        )
+
+    if missing.any():
+        values[missing] = None
+    return values
+
+
+def frame_rows(df: pd.DataFrame) -> Iterable[tuple]:
+    """Row tuples of a DataFrame, ready for StreamingWorkbook.write_rows."""
+    if df.empty:
+        return iter(())
+    columns = [_column_values(df[c]) for c in df.columns]
+    return zip(*columns)
+
+
+class StreamingWorkbook:
+    def __init__(self, path: str):
+        self.workbook = xlsxwriter.Workbook(path, {
+            "constant_memory": True,
+            "default_date_format": DATETIME_FORMAT,
+            "strings_to_numbers": False,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        })
+        # same look as pandas' header cells
+        self.header_format = self.workbook.add_format(
+            {"bold": True, "border": 1, "align": "center", "valign": "top"}
+        )
+        self._sheets = {}
+        self._next_row = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def sheet(self, name: str):
+        name = name[:MAX_SHEET_NAME]
+        if name not in self._sheets:
+            self._sheets[name] = self.workbook.add_worksheet(name)
+            self._next_row[name] = 0
+        return self._sheets[name]
+
+    def write_rows(
+        self,
+        sheet_name: str,
+        rows: Iterable[Sequence],
+        header: Optional[Sequence[str]] = None,
+        startrow: Optional[int] = None
+    ) -> int:
+        """
+        Append rows to a sheet (optionally after a header row). startrow may skip
+        ahead but never go back. Returns the row after the last one written.
+        """
+        ws = self.sheet(sheet_name)
+        name = ws.get_name()
+        row = self._next_row[name]
+        if startrow is not None:
+            if startrow < row:
+                raise ValueError(f"{name}: row {startrow} already flushed (next free row is {row})")
+            row = startrow
+
+        if header is not None:
+            ws.write_row(row, 0, [str(h) for h in header], self.header_format)
+            row += 1
+
+        for values in rows:
+            ws.write_row(row, 0, values)
+            row += 1
+
+        self._next_row[name] = row
+        return row
+
+    def write_frame(self, sheet_name: str, df: pd.DataFrame, startrow: Optional[int] = None) -> int:
+        """Equivalent of df.to_excel(writer, sheet_name, index=False, startrow=startrow)."""
+        return self.write_rows(sheet_name, frame_rows(df), header=list(df.columns), startrow=startrow)
+
+    def close(self):
+        self.workbook.close()
@@ -0,0 +1,195 @@
+"""
+Local stand-in for the ATMOS getDeviceDataParamClone endpoint.
+
+Serves synthetic CSVs for URLs shaped like the real API:
+  /adp/v4/getDeviceDataParamClone/imei/<ids>/params/<params>/startdate/<s>/enddate/<e>/ts/<ts>/avg/<n>/api/<key>
+
+Only used by the benchmarks - never imported by the app.
+"""
+
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+TS_FREQ = {
+    "mm": "15min",
+    "hh": "h",
+    "dd": "D",
+    "MM": "MS",
+    "YY": "YS",
+}
+
+
+def _parse_path(path: str) -> dict:
+    parts = path.split("?")[0].strip("/").split("/")
+    out = {}
+    for key in ("imei", "params", "startdate", "enddate", "ts", "avg"):
+        if key in parts:
+            out[key] = parts[parts.index(key) + 1]
+    return out
+
+
+def _is_missing(site_id, param, missing_columns: float) -> bool:
+    """Deterministic per (station, parameter), so fallback calls see the same gap."""
+    if not missing_columns:
+        return False
+    return random.Random(f"{site_id}|{param}").random() < missing_columns
+
+
+def _is_dead(site_id, dead_sites: float) -> bool:
+    """Deterministic per station: a decommissioned station returns no rows at all."""
+    if not dead_sites:
+        return False
+    return random.Random(f"{site_id}|dead").random() < dead_sites
+
+
+def make_csv(site_ids, params, start, end, ts, missing_columns: float = 0.0, dead_sites: float = 0.0) -> bytes:
+    start_dt = datetime.strptime(start, "%Y-%m-%dT%H:%M")
+    end_dt = datetime.strptime(end, "%Y-%m-%dT%H:%M")
+    freq = TS_FREQ.get(ts, "h")
+    first = pd.Timestamp(start_dt)
+    first = first.to_period(freq[0]).start_time if freq in ("MS", "YS") else first.floor(freq)
+    times = pd.date_range(first, end_dt, freq=freq)
+
+    frames = []
+    for site_id in site_ids:
+        if _is_dead(site_id, dead_sites):
+            continue
+        df = pd.DataFrame({"dt_time": times.strftime("%Y-%m-%d %H:%M:%S")})
+        if len(site_ids) > 1:
+            df.insert(0, "site_id", site_id)
+        for p in params:
+            # per station/parameter: the same data whichever other params or stations are asked for
+            rng = np.random.default_rng(zlib.crc32(f"{site_id}|{p}|{start}|{end}".encode()))
+            values = rng.gamma(2.0, 30.0, len(times)).round(2)
+            values[rng.random(len(times)) < 0.05] = np.nan
+            if _is_missing(site_id, p, missing_columns):
+                if len(site_ids) == 1:
+                    continue  # station doesn't report it: no column at all
+                values[:] = np.nan
+            df[p] = values
+        frames.append(df)
+
+    if not frames:
+        return b""
+    return pd.concat(frames, ignore_index=True).to_csv(index=False).encode()
+
+
+class AtmosStub:
+    """
+    Threaded HTTP server emulating ATMOS.
+
+    latency         : seconds slept before every response
+    error_rate      : fraction of requests answered with a 503
+    missing_columns : fraction of (station, parameter) pairs the station never reports
+    dead_sites      : fraction of stations that return no rows (decommissioned)
+    """
+
+    def __init__(
+        self, latency: float = 0.05, error_rate: float = 0.0, missing_columns: float = 0.0, dead_sites: float = 0.0
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.missing_columns = missing_columns
+        self.dead_sites = dead_sites
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency * random.uniform(0.8, 1.2))
+
+                if stub.error_rate and random.random() < stub.error_rate:
+                    with stub._lock:
+                        stub.errors += 1
+                    body = b"Service Unavailable"
+                    self.send_response(503)
+                    self.send_header("Content-Type", "text/plain")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                q = _parse_path(self.path)
+                body = make_csv(
+                    q.get("imei", "").split(","),
+                    q.get("params", "").split(","),
+                    q.get("startdate"),
+                    q.get("enddate"),
+                    q.get("ts", "hh"),
+                    stub.missing_columns,
+                    stub.dead_sites,
+                )
+                with stub._lock:
+                    stub.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _serve(queue, latency, error_rate, missing_columns, dead_sites):
+    with AtmosStub(latency, error_rate, missing_columns, dead_sites) as stub:
+        queue.put(stub.base_url)
+        stub.thread.join()
+
+
+class AtmosStubProcess:
+    """
+    AtmosStub in a child process, so generating responses neither competes for
+    the benchmarked process's GIL nor shows up in its memory measurements.
+    Request counts have to come from the client side (the job's stats).
+    """
+
+    def __init__(
+        self, latency: float = 0.05, error_rate: float = 0.0, missing_columns: float = 0.0, dead_sites: float = 0.0
+    ):
+        self._queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self._queue, latency, error_rate, missing_columns, dead_sites), daemon=True
+        )
+        self.base_url = None
+
+    def __enter__(self):
+        self._process.start()
+        self.base_url = self._queue.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
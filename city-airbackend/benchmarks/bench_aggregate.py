@@ -0,0 +1,122 @@
+"""
+City aggregation micro-benchmark: per-city concat/groupby + repeated outer joins
+(the previous implementation, reproduced below) vs pipeline._aggregate.
+
+No network: station results are synthesized in memory.
+
+    cd city-airbackend
+    python -m benchmarks.bench_aggregate --cities 50 --pollutants 18 --sites 4 --days 31
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.pipeline import _aggregate
+from app.series import compact, grid
+from app.site_catalog import SiteRecord
+
+
+def synthetic_results(n_cities, n_sites, pollutants, days):
+    times = pd.date_range("2024-01-01", periods=days * 24, freq="h")
+    rng = np.random.default_rng(0)
+
+    site_jobs, city_slices, results = [], [], []
+    for c in range(n_cities):
+        city = f"City{c}"
+        city_slices.append((city, len(site_jobs), len(site_jobs) + n_sites))
+        for s in range(n_sites):
+            site_jobs.append((city, SiteRecord(f"site_{c}_{s}", f"Station {s}, {city}")))
+            frames = {}
+            for p in pollutants:
+                values = rng.gamma(2.0, 30.0, len(times))
+                values[rng.random(len(times)) < 0.05] = np.nan
+                frames[p] = pd.Series(values, index=pd.DatetimeIndex(times, name="dt_time"), name=p)
+            results.append((frames, []))
+    return site_jobs, city_slices, results
+
+
+def window(days):
+    end = pd.Timestamp("2024-01-01") + pd.Timedelta(days=days) - pd.Timedelta(minutes=1)
+    return "2024-01-01T00:00", end.strftime("%Y-%m-%dT%H:%M")
+
+
+def grid_results(results, days):
+    """The pipeline's station results: compact grid series (app.series)."""
+    g = grid(*window(days), "hourly")
+    return [(compact(frames, g), errors) for frames, errors in results]
+
+
+def legacy_results(results):
+    """The frames shape the previous implementation took: DataFrame[dt_time, <pollutant>]."""
+    return [({p: sub.reset_index() for p, sub in frames.items()}, errors) for frames, errors in results]
+
+
+def legacy(results, city_slices, pollutants):
+    concentration_dict = {p: {} for p in pollutants}
+    for clean_city, first, last in city_slices:
+        city_frames = {p: [] for p in pollutants}
+        for frames, _ in results[first:last]:
+            for p in pollutants:
+                if p in frames:
+                    city_frames[p].append(frames[p])
+        for p in pollutants:
+            if not city_frames[p]:
+                continue
+            combined = pd.concat(city_frames[p], ignore_index=True)
+            city_df = combined.groupby("dt_time", as_index=False)[p].mean()
+            city_df[p] = city_df[p].round(3)
+            concentration_dict[p][clean_city] = city_df.set_index("dt_time")
+
+    out = {}
+    for p in pollutants:
+        wide = None
+        for city_name, df_city in concentration_dict[p].items():
+            df_city = df_city.rename(columns={df_city.columns[0]: city_name})
+            wide = df_city if wide is None else wide.join(df_city, how="outer")
+        out[p] = wide.sort_index().reset_index().rename(columns={"dt_time": "Timestamp"})
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, default=50)
+    ap.add_argument("--pollutants", type=int, default=18)
+    ap.add_argument("--sites", type=int, default=4, help="stations per city")
+    ap.add_argument("--days", type=int, default=31, help="hourly data")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pollutants = [f"p{i}" for i in range(args.pollutants)]
+    site_jobs, city_slices, results = synthetic_results(args.cities, args.sites, pollutants, args.days)
+    labels = ("Uptime(%)", "Valid Hours", "Expected Hours")
+
+    def best(fn):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - t0)
+        return min(times), out
+
+    old_results = legacy_results(results)
+    t_legacy, old = best(lambda: legacy(old_results, city_slices, pollutants))
+    new_results = grid_results(results, args.days)
+    t_new, (new, _) = best(lambda: _aggregate(
+        new_results, site_jobs, city_slices, pollutants, args.days * 24, labels,
+        base="hourly", aggregation="hourly", window=window(args.days),
+    ))
+
+    for p in pollutants:
+        # float32 station values: city means agree to the written 3 decimals
+        pd.testing.assert_frame_equal(old[p], new[p], check_dtype=False, atol=1.5e-3)
+
+    print(f"{args.cities} cities x {args.pollutants} pollutants x {args.sites} stations, {args.days * 24} hourly points")
+    print(f"legacy concat/groupby/join : {t_legacy:8.3f} s")
+    print(f"grid-series _aggregate    : {t_new:8.3f} s  (includes uptime counts)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Availability planner benchmark: the same export repeated against a stub with
+decommissioned stations and parameters some stations never report - first
+with an empty app.availability index, then while it confirms what it saw
+(an empty answer counts after AVAILABILITY_CONFIRMATIONS fetches), then with
+what those runs taught it.
+
+Reports ATMOS requests, single-param fallbacks, params skipped as "no data
+expected" and fetches sent past the ATMOS cache to confirm the index; the concentration tables of the first and last run must be identical (the
+uptime tables differ only where a skipped parameter now reads 0 valid records
+instead of the blank of a failed fetch).
+
+    cd city-airbackend
+    python -m benchmarks.bench_availability --cities 10 --dead-sites 0.2 --missing-columns 0.2
+    python -m benchmarks.bench_availability --no-cache   # every call answered upstream
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from .atmos_stub import AtmosStubProcess
+from .bench_export import POLLUTANTS
+from .bench_fetch_concurrency import FakeCatalog
+
+
+def run(pipeline, progress, catalog, args, run_id, tmpdir):
+    job_id = f"bench-availability-{run_id}"
+    out_path = os.path.join(tmpdir, f"{run_id}.xlsx")
+    t0 = time.perf_counter()
+    pipeline.build_excel_for_request(
+        catalog=catalog,
+        start=args.start,
+        end=args.end,
+        aggregation=args.aggregation,
+        cities=list(catalog.cities),
+        pollutants=POLLUTANTS,
+        gaps=1,
+        gap_value="NULL",
+        out_path=out_path,
+        job_id=job_id,
+    )
+    wall = time.perf_counter() - t0
+    stats = progress.stats_store.pop(job_id, {})
+    progress.progress_store.pop(job_id, None)
+    return wall, stats, pd.read_excel(out_path, sheet_name=None)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, default=10)
+    ap.add_argument("--sites", type=int, default=4, help="stations per city")
+    ap.add_argument("--aggregation", default="daily")
+    ap.add_argument("--start", default="2024-01-01T00:00")
+    ap.add_argument("--end", default="2024-02-29T23:59")
+    ap.add_argument("--latency", type=float, default=0.05, help="stub latency (s)")
+    ap.add_argument("--dead-sites", type=float, default=0.2, help="fraction of stations returning no rows")
+    ap.add_argument("--missing-columns", type=float, default=0.2, help="fraction of station/parameter pairs never reported")
+    ap.add_argument("--no-cache", action="store_true", help="run without the ATMOS cache")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_availability_")
+    os.environ["AVAILABILITY_PATH"] = os.path.join(tmpdir, "availability.sqlite")
+    os.environ["AVAILABILITY_ENABLED"] = "1"
+    os.environ["CACHE_PATH"] = os.path.join(tmpdir, "cache.sqlite")
+    os.environ["CACHE_ENABLED"] = "0" if args.no_cache else "1"
+    os.environ.setdefault("BATCH_SIZE", "1")     # one call per station, like stations outside a batch
+
+    try:
+        with AtmosStubProcess(args.latency, 0.0, args.missing_columns, args.dead_sites) as stub:
+            os.environ["ATMOS_BASE_URL"] = stub.base_url
+            from app import atmos_client, availability, pipeline, progress
+            atmos_client.BASE_URL = f"{stub.base_url}/adp/v4/getDeviceDataParamClone"
+
+            catalog = FakeCatalog(args.cities, args.sites)
+            names = ["cold"] + ["confirm"] * max(0, availability.AVAILABILITY_CONFIRMATIONS - 1) + ["warm"]
+            runs = [(name, run(pipeline, progress, catalog, args, f"{name}{i}", tmpdir)) for i, name in enumerate(names)]
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    cold, warm = runs[0][1], runs[-1][1]
+    for name, table in cold[2].items():
+        if name not in ("ERRORS", "INFO") and not name.endswith("_UPTIME"):
+            pd.testing.assert_frame_equal(table, warm[2][name])
+
+    print(
+        f"{args.cities * args.sites} stations x {len(POLLUTANTS)} params, {args.start} -> {args.end} ({args.aggregation}), "
+        f"dead_sites={args.dead_sites} missing_columns={args.missing_columns} cache={'off' if args.no_cache else 'on'}"
+    )
+    print(f"{'index':>8} {'wall (s)':>9} {'requests':>9} {'fallbacks':>10} {'skipped':>8} {'narrowed':>9} {'rechecks':>9}")
+    for name, (wall, stats, _) in runs:
+        print(
+            f"{name:>8} {wall:>9.2f} {stats.get('requests', 0):>9} {stats.get('fallback_calls', 0):>10} "
+            f"{stats.get('availability_skipped', 0):>8} {stats.get('availability_narrowed', 0):>9} "
+            f"{stats.get('availability_rechecks', 0):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
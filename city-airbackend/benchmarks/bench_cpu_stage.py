@@ -0,0 +1,85 @@
+"""
+CPU-stage benchmark: parsing station responses in the I/O threads vs in the
+app.cpu_pool worker processes.
+
+Fetch threads (FETCH_CONCURRENCY) parse a set of 15-min, 18-pollutant CSV
+bodies while a heartbeat thread - standing in for the API's event loop - wakes
+every 10 ms; its lateness shows how much the parsing starves the API of the GIL.
+
+    cd city-airbackend
+    python -m benchmarks.bench_cpu_stage --bodies 40 --processes 0 2 4
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app import cpu_pool
+from app.atmos_client import CSV_ENGINE
+
+from .atmos_stub import make_csv
+
+
+def heartbeat(stop: threading.Event, lags: list, period: float = 0.01):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        time.sleep(period)
+        lags.append(time.perf_counter() - t0 - period)
+
+
+def run(bodies, threads: int):
+    lags = []
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(stop, lags), daemon=True)
+    beat.start()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        frames = list(pool.map(lambda body: cpu_pool.parse_csv(body, CSV_ENGINE), bodies))
+    wall = time.perf_counter() - t0
+
+    stop.set()
+    beat.join()
+    lags_ms = np.array(lags or [0.0]) * 1000
+    return wall, frames, np.percentile(lags_ms, 50), np.percentile(lags_ms, 99), lags_ms.max()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bodies", type=int, default=40, help="station responses to parse")
+    ap.add_argument("--pollutants", type=int, default=18)
+    ap.add_argument("--days", type=int, default=31, help="15-min data")
+    ap.add_argument("--threads", type=int, default=8, help="fetch threads")
+    ap.add_argument("--processes", type=int, nargs="+", default=[0, 2, 4], help="PARSE_PROCESSES values")
+    args = ap.parse_args()
+
+    pollutants = [f"p{i}cnc" for i in range(args.pollutants)]
+    end = f"2024-01-{args.days:02d}T23:59" if args.days <= 31 else "2024-03-31T23:59"
+    bodies = [make_csv([f"site_{s}"], pollutants, "2024-01-01T00:00", end, "mm") for s in range(args.bodies)]
+
+    print(f"{args.bodies} bodies of {np.mean([len(b) for b in bodies]) / 1e3:.0f} kB, "
+          f"{args.threads} fetch threads, offload >= {cpu_pool.PARSE_OFFLOAD_MIN_BYTES / 1e3:.0f} kB")
+    print(f"{'processes':>10} {'wall (s)':>9} {'lag p50':>8} {'lag p99':>8} {'lag max':>8}  (heartbeat ms)")
+
+    reference = None
+    for processes in args.processes:
+        cpu_pool.shutdown()
+        cpu_pool.PARSE_PROCESSES = processes
+        if processes:
+            run(bodies[:processes], args.threads)  # start the workers outside the timing
+
+        wall, frames, p50, p99, worst = run(bodies, args.threads)
+        if reference is None:
+            reference = frames
+        for a, b in zip(reference, frames):
+            np.testing.assert_allclose(a.iloc[:, 1:].to_numpy(float), b.iloc[:, 1:].to_numpy(float))
+        print(f"{processes:>10} {wall:>9.3f} {p50:>8.2f} {p99:>8.2f} {worst:>8.2f}")
+
+    cpu_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
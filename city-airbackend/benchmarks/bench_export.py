@@ -0,0 +1,170 @@
+"""
+End-to-end export benchmark against the local ATMOS stub.
+
+Runs build_excel_for_request for every (cities, aggregation) scenario (the stub
+runs in a child process) and reports wall time, ATMOS requests, peak Python memory (tracemalloc) and
+per-phase timings taken from the pipeline's phase events:
+
+    fetch     : first station request -> last station result (includes parse)
+    parse     : CSV decoding of response bodies, summed over fetch threads
+    aggregate : city means + uptime (+ local resampling)
+    write     : sheets / bundle members
+
+    cd city-airbackend
+    python -m benchmarks.bench_export                                   # 1/10/100 cities x all aggregations
+    python -m benchmarks.bench_export --cities 10 --aggregations daily --error-rate 0.05 --missing-columns 0.1
+    python -m benchmarks.bench_export --json before.json
+    python -m benchmarks.bench_export --baseline before.json --tolerance 0.2   # exit 1 on regression
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from .atmos_stub import AtmosStubProcess
+from .bench_fetch_concurrency import FakeCatalog
+
+AGGREGATIONS = ["15min", "hourly", "daily", "monthly", "yearly"]
+POLLUTANTS = ["pm2.5cnc", "pm10cnc", "no2ppb", "so2ppb", "o3ppb", "coppm"]
+
+
+def run_scenario(pipeline, progress, n_cities, n_sites, aggregation, start, end, fmt, memory):
+    catalog = FakeCatalog(n_cities, n_sites)
+    job_id = f"bench-{n_cities}-{aggregation}"
+    phases = {}
+
+    def on_event(event_job_id, event, data):
+        if event_job_id == job_id and event == "phase":
+            phases[data["phase"]] = time.perf_counter()
+
+    progress.add_listener(on_event)
+    tmpdir = tempfile.mkdtemp(prefix="bench_export_")
+    if memory:
+        tracemalloc.reset_peak()
+
+    try:
+        t0 = time.perf_counter()
+        pipeline.build_excel_for_request(
+            catalog=catalog,
+            start=start,
+            end=end,
+            aggregation=aggregation,
+            cities=list(catalog.cities),
+            pollutants=POLLUTANTS,
+            gaps=1,
+            gap_value="NULL",
+            out_path=os.path.join(tmpdir, f"out.{fmt}"),
+            job_id=job_id,
+            fmt=fmt,
+        )
+        t_end = time.perf_counter()
+        size = os.path.getsize(os.path.join(tmpdir, f"out.{fmt}"))
+    finally:
+        progress.remove_listener(on_event)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    stats = progress.stats_store.pop(job_id, {})
+    progress.progress_store.pop(job_id, None)
+    return {
+        "scenario": f"{n_cities}x{n_sites}/{aggregation}",
+        "wall_s": round(t_end - t0, 3),
+        "requests": stats.get("requests", 0),
+        "retries": stats.get("retries", 0),
+        "mb_fetched": round(stats.get("bytes_fetched", 0) / 1e6, 1),
+        "peak_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 1) if memory else None,
+        "fetch_s": round(phases["aggregate"] - phases["fetch"], 3),
+        "parse_s": round(stats.get("parse_ms", 0) / 1000, 3),
+        "aggregate_s": round(phases["write"] - phases["aggregate"], 3),
+        "write_s": round(t_end - phases["write"], 3),
+        "output_mb": round(size / 1e6, 2),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Scenarios whose wall time or peak memory grew by more than tolerance."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)}
+
+    regressions = []
+    for r in results:
+        old = baseline.get(r["scenario"])
+        if not old:
+            continue
+        for key in ("wall_s", "peak_mb"):
+            if r.get(key) and old.get(key) and r[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{r['scenario']}: {key} {old[key]} -> {r[key]}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--sites", type=int, default=4, help="stations per city")
+    ap.add_argument("--aggregations", nargs="+", default=AGGREGATIONS, choices=AGGREGATIONS)
+    ap.add_argument("--start", default="2024-01-01T00:00")
+    ap.add_argument("--end", default="2024-01-31T23:59")
+    ap.add_argument("--format", default="xlsx", choices=["xlsx", "parquet", "csv.gz", "arrow"])
+    ap.add_argument("--latency", type=float, default=0.02, help="stub latency (s)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub responses that are 503s")
+    ap.add_argument("--missing-columns", type=float, default=0.0, help="fraction of station/parameter pairs never reported")
+    ap.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows pandas down)")
+    ap.add_argument("--json", help="write the results here")
+    ap.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed relative growth vs the baseline")
+    args = ap.parse_args()
+
+    with AtmosStubProcess(args.latency, args.error_rate, args.missing_columns) as stub:
+        os.environ["ATMOS_BASE_URL"] = stub.base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")  # measure upstream fetching, not the cache
+        os.environ.setdefault("AVAILABILITY_ENABLED", "0")  # nor what earlier scenarios taught the planner
+
+        # imported after ATMOS_BASE_URL is set so the client targets the stub
+        from app import atmos_client, pipeline, progress
+        atmos_client.BASE_URL = f"{stub.base_url}/adp/v4/getDeviceDataParamClone"
+
+        memory = not args.no_memory
+        if memory:
+            tracemalloc.start()
+
+        print(
+            f"{args.sites} stations/city, {len(POLLUTANTS)} pollutants, {args.start} -> {args.end}, "
+            f"latency={args.latency}s error_rate={args.error_rate} missing_columns={args.missing_columns}"
+        )
+        header = (
+            f"{'scenario':>16} {'wall':>8} {'reqs':>6} {'retry':>6} {'MB in':>7} {'peak MB':>8} "
+            f"{'fetch':>7} {'parse':>7} {'agg':>7} {'write':>7}"
+        )
+        print(header)
+
+        results = []
+        for n_cities in args.cities:
+            for aggregation in args.aggregations:
+                r = run_scenario(
+                    pipeline, progress, n_cities, args.sites, aggregation,
+                    args.start, args.end, args.format, memory,
+                )
+                results.append(r)
+                print(
+                    f"{r['scenario']:>16} {r['wall_s']:>8.2f} {r['requests']:>6} {r['retries']:>6} "
+                    f"{r['mb_fetched']:>7.1f} {r['peak_mb'] if memory else '-':>8} {r['fetch_s']:>7.2f} "
+                    f"{r['parse_s']:>7.2f} {r['aggregate_s']:>7.2f} {r['write_s']:>7.2f}"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
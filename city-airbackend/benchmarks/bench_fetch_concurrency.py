@@ -0,0 +1,85 @@
+"""
+Fetch-stage benchmark: sequential vs concurrent (and batched) station fetching.
+
+Runs build_excel_for_request against the local ATMOS stub (with injected
+latency) at different FETCH_CONCURRENCY / BATCH_SIZE values.
+
+    cd city-airbackend
+    python -m benchmarks.bench_fetch_concurrency --cities 20 --sites 12 --latency 0.2
+    python -m benchmarks.bench_fetch_concurrency --batch-size 1 40
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.site_catalog import SiteRecord
+
+from .atmos_stub import AtmosStub
+
+
+class FakeCatalog:
+    def __init__(self, n_cities: int, n_sites: int):
+        self.cities = {
+            f"City{c}": [
+                SiteRecord(f"site_{c}_{s}", f"Station {s}, City{c}")
+                for s in range(n_sites)
+            ]
+            for c in range(n_cities)
+        }
+
+    def get_sites_for_city(self, city: str):
+        return tuple(self.cities.get(city.split("(")[0].strip(), []))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, default=20)
+    ap.add_argument("--sites", type=int, default=12, help="stations per city")
+    ap.add_argument("--latency", type=float, default=0.2, help="stub latency (s)")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--batch-size", type=int, nargs="+", default=[1])
+    ap.add_argument("--aggregation", default="daily")
+    args = ap.parse_args()
+
+    with AtmosStub(latency=args.latency) as stub:
+        os.environ["ATMOS_BASE_URL"] = stub.base_url
+        os.environ.setdefault("CACHE_ENABLED", "0")  # measure upstream fetching, not the cache
+
+        # imported after ATMOS_BASE_URL is set so the client targets the stub
+        from app import atmos_client, pipeline
+        atmos_client.BASE_URL = f"{stub.base_url}/adp/v4/getDeviceDataParamClone"
+
+        catalog = FakeCatalog(args.cities, args.sites)
+        cities = list(catalog.cities)
+        pollutants = ["pm2.5cnc", "pm10cnc", "no2ppb"]
+
+        print(f"{args.cities} cities x {args.sites} stations, latency={args.latency}s")
+        print(f"{'concurrency':>12} {'batch':>6} {'requests':>9} {'wall (s)':>9}")
+
+        for n, batch_size in [(n, b) for b in args.batch_size for n in args.concurrency]:
+            pipeline.FETCH_CONCURRENCY = n
+            pipeline.BATCH_SIZE = batch_size
+            before = stub.requests
+            out_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "out.xlsx")
+
+            t0 = time.perf_counter()
+            pipeline.build_excel_for_request(
+                catalog=catalog,
+                start="2024-01-01T00:00",
+                end="2024-01-31T23:59",
+                aggregation=args.aggregation,
+                cities=cities,
+                pollutants=pollutants,
+                gaps=1,
+                gap_value="NULL",
+                out_path=out_path,
+                job_id=f"bench-{n}-{batch_size}",
+            )
+            wall = time.perf_counter() - t0
+            print(f"{n:>12} {batch_size:>6} {stub.requests - before:>9} {wall:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Memory benchmark of the station results held between the fetch and write
+stages, and of the aggregation over them.
+
+  series : the previous representation - per pollutant a float64 Series view on
+           the station's parsed response (so every response stays alive), then
+           the long (site, pollutant, dt_time, value) table aggregation
+           (reproduced below)
+  grid   : app.series GridSeries (int32 grid offsets, float32 values, validity
+           bits); the parsed response is dropped right after compact(), then
+           pipeline._aggregate
+
+Each variant runs in a fresh process (peak RSS includes pyarrow buffers, which
+tracemalloc does not see); station responses come from the stub's CSV
+generator one at a time, as they would from ATMOS.
+
+    cd city-airbackend
+    python -m benchmarks.bench_memory --stations 200 --pollutants 18 --days 31 --aggregation hourly
+"""
+
+import argparse
+import io
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.atmos_client import CSV_ENGINE
+from app.columns import resolve_columns, typed_frame
+from app.pipeline import _aggregate, _expected_total_points
+from app.resample import resample_long
+from app.series import compact, grid
+from app.site_catalog import SiteRecord
+
+from .atmos_stub import make_csv
+
+LABELS = ("Uptime(%)", "Valid Records", "Expected Records")
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+
+
+def long_table_aggregate(results, site_jobs, city_slices, pollutants, expected_total, base, aggregation, window):
+    """pipeline._aggregate before the grid series (concentration + valid counts only)."""
+    codes = {p: code for code, p in enumerate(pollutants)}
+    site_idx, pollutant_codes, times, values = [], [], [], []
+    for i, (frames, _) in enumerate(results):
+        for pollutant, sub in frames.items():
+            site_idx.append(np.full(len(sub), i, dtype=np.int32))
+            pollutant_codes.append(np.full(len(sub), codes[pollutant], dtype=np.int16))
+            times.append(sub.index.to_numpy(dtype="datetime64[ns]"))
+            values.append(sub.to_numpy(dtype=float, na_value=np.nan))
+
+    city_names = list(dict.fromkeys(c for c, _, _ in city_slices))
+    site_city = np.empty(len(site_jobs), dtype=np.int32)
+    for clean_city, first, last in city_slices:
+        site_city[first:last] = city_names.index(clean_city)
+
+    long = pd.DataFrame({
+        "site": np.concatenate(site_idx),
+        "pollutant": np.concatenate(pollutant_codes),
+        "dt_time": np.concatenate(times),
+        "value": np.concatenate(values),
+    })
+    if base != aggregation:
+        long = resample_long(long, base, aggregation, *window)
+    long["city"] = site_city[long["site"].to_numpy()]
+
+    valid_counts = long.groupby(["site", "pollutant"])["value"].count().to_dict()
+    means = long.dropna(subset=["dt_time"]).groupby(["pollutant", "dt_time", "city"])["value"].mean().round(3)
+    concentration = {}
+    for pollutant, code in codes.items():
+        wide = means.xs(code, level="pollutant").unstack("city")
+        wide.columns = [city_names[c] for c in wide.columns]
+        concentration[pollutant] = wide.reset_index().rename(columns={"dt_time": "Timestamp"})
+    return concentration, valid_counts
+
+
+def run(variant, args, queue):
+    pollutants = [f"p{i}cnc" for i in range(args.pollutants)]
+    start = "2024-01-01T00:00"
+    end = (pd.Timestamp(start) + pd.Timedelta(days=args.days) - pd.Timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M")
+    window = (start, end)
+    base_grid = grid(start, end, "15min")
+    expected_total = _expected_total_points(start, end, args.aggregation)
+
+    site_jobs, city_slices = [], []
+    for c in range(args.stations // args.per_city):
+        city = f"City{c}"
+        city_slices.append((city, len(site_jobs), len(site_jobs) + args.per_city))
+        site_jobs += [(city, SiteRecord(f"site_{c}_{s}", f"Station {s}")) for s in range(args.per_city)]
+
+    # warm-up outside the measurement (imports, engine init)
+    typed_frame(pd.read_csv(io.BytesIO(make_csv(["w"], pollutants, start, end, "mm")), engine=CSV_ENGINE))
+    rss0 = _rss_mb()
+
+    t0 = time.perf_counter()
+    results = []
+    held = 0  # bytes the results keep alive
+    for _, record in site_jobs:
+        body = make_csv([record.site_id], pollutants, start, end, "mm")
+        df = typed_frame(pd.read_csv(io.BytesIO(body), engine=CSV_ENGINE))
+        columns = resolve_columns(df, pollutants)
+        by_time = df.set_index("dt_time")
+        frames = {p: by_time[columns[p]] for p in pollutants}
+        if variant == "grid":
+            frames = compact(frames, base_grid)
+            held += sum(s.values.nbytes + s.valid.nbytes for s in frames.values())
+            held += sum({id(s.offsets): s.offsets.nbytes for s in frames.values()}.values())
+        else:
+            held += int(by_time.memory_usage(index=True).sum())
+        results.append((frames, []))
+        del body, df, by_time, frames
+
+    if variant == "grid":
+        concentration, _ = _aggregate(
+            results, site_jobs, city_slices, pollutants, expected_total, LABELS,
+            base="15min", aggregation=args.aggregation, window=window,
+        )
+    else:
+        concentration, _ = long_table_aggregate(
+            results, site_jobs, city_slices, pollutants, expected_total, "15min", args.aggregation, window
+        )
+    wall = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3 - rss0
+
+    queue.put((variant, wall, held / 1e6, peak, {p: df.iloc[:200] for p, df in concentration.items()}))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stations", type=int, default=200)
+    ap.add_argument("--per-city", type=int, default=4)
+    ap.add_argument("--pollutants", type=int, default=18)
+    ap.add_argument("--days", type=int, default=31, help="15-min base data")
+    ap.add_argument("--aggregation", default="hourly", choices=["15min", "hourly", "daily", "monthly"])
+    args = ap.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    out = {}
+    for variant in ("series", "grid"):
+        proc = ctx.Process(target=run, args=(variant, args, queue))
+        proc.start()
+        variant, wall, held, peak, sample = queue.get()
+        proc.join()
+        out[variant] = (wall, held, peak, sample)
+
+    for p in out["series"][3]:
+        pd.testing.assert_frame_equal(out["series"][3][p], out["grid"][3][p], check_dtype=False, atol=1.5e-3)
+
+    rows = args.stations * args.days * 96
+    print(f"{args.stations} stations x {args.pollutants} pollutants, {rows} 15-min rows -> {args.aggregation}")
+    print(f"{'variant':>8} {'wall (s)':>9} {'held MB':>9} {'peak MB':>9}   (held: station results kept for the aggregation; peak: RSS over baseline)")
+    for variant, (wall, held, peak, _) in out.items():
+        print(f"{variant:>8} {wall:>9.2f} {held:>9.1f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
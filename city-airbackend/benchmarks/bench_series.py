@@ -0,0 +1,109 @@
+"""
+Dashboard latency benchmark: one city's pollutant over the last --hours,
+requested --runs times through the API (in-process TestClient, ATMOS stub
+in a child process), as
+
+  export    : POST /export -> poll /progress/{id} -> GET /download (job queue + xlsx)
+  series    : GET /series, result recomputed every time (memo disabled; station
+              data from the warm ATMOS cache, like a busy dashboard's refreshes)
+  memo      : GET /series answered from the in-memory result
+  304       : GET /series with If-None-Match of the previous response
+
+Reports p50 / p99 / max latency per route.
+
+    cd city-airbackend
+    python -m benchmarks.bench_series --runs 200 --hours 48
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .atmos_stub import AtmosStubProcess
+from .bench_fetch_concurrency import FakeCatalog
+
+
+def timed(fn, runs):
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return np.array(out) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=200)
+    ap.add_argument("--export-runs", type=int, default=10, help="the job route is much slower")
+    ap.add_argument("--hours", type=int, default=48)
+    ap.add_argument("--sites", type=int, default=8, help="stations in the city")
+    ap.add_argument("--latency", type=float, default=0.05, help="stub latency (s)")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_series_")
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(tmpdir, "jobs.sqlite"))
+    os.environ.setdefault("CACHE_PATH", os.path.join(tmpdir, "cache.sqlite"))
+    os.environ.setdefault("AVAILABILITY_PATH", os.path.join(tmpdir, "availability.sqlite"))
+    os.environ.setdefault("JOB_POLL_INTERVAL", "0.05")
+    os.environ.setdefault("CACHE_MUTABLE_WINDOW", "0")  # the stub's data never changes
+
+    end = np.datetime64("2024-03-01T00:00") - np.timedelta64(1, "m")
+    start = end + np.timedelta64(1, "m") - np.timedelta64(args.hours, "h")
+    params = {
+        "start": str(start), "end": str(end), "aggregation": "hourly",
+        "cities": ["City0"], "pollutants": ["pm2.5cnc"],
+    }
+
+    try:
+        with AtmosStubProcess(args.latency) as stub:
+            os.environ["ATMOS_BASE_URL"] = stub.base_url
+            from fastapi.testclient import TestClient
+
+            from app import atmos_client, jobs, main as api, query
+            atmos_client.BASE_URL = f"{stub.base_url}/adp/v4/getDeviceDataParamClone"
+            api.catalog = FakeCatalog(1, args.sites)
+            jobs.RESULT_TTL = 0  # every export runs its job instead of sharing the last one
+
+            with TestClient(api.app) as client:
+                def export():
+                    job = client.post("/export", json=params).json()
+                    while True:
+                        state = client.get(f"/progress/{job['job_id']}").json()
+                        if state["status"] in ("done", "failed"):
+                            break
+                        time.sleep(0.01)
+                    assert state["status"] == "done", state["error"]
+                    assert client.get("/download", params={"file_path": job["file_path"]}).status_code == 200
+
+                def series():
+                    assert client.get("/series", params=params).status_code == 200
+
+                results = {"export": timed(export, args.export_runs)}
+
+                max_bytes = query.SERIES_CACHE_MAX_BYTES
+                query.SERIES_CACHE_MAX_BYTES = 0  # nothing fits -> every call computes
+                series()  # imports + fills the ATMOS cache
+                results["series"] = timed(series, args.runs)
+                query.SERIES_CACHE_MAX_BYTES = max_bytes
+
+                etag = client.get("/series", params=params).headers["etag"]
+                results["memo"] = timed(series, args.runs)
+                results["304"] = timed(
+                    lambda: client.get("/series", params=params, headers={"If-None-Match": etag}), args.runs
+                )
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f"City0 ({args.sites} stations) pm2.5, last {args.hours} h hourly, stub latency {args.latency}s")
+    print(f"{'route':>8} {'runs':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, ms in results.items():
+        print(f"{route:>8} {len(ms):>5} {np.percentile(ms, 50):>8.1f} {np.percentile(ms, 99):>8.1f} {ms.max():>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+API startup benchmark: wall time to `import app.main` (FastAPI app + site
+catalog ready) in a fresh interpreter, and which heavy modules got loaded.
+
+Runs one cold boot (compiled catalog removed -> Excel parsed) and several
+warm boots (compiled catalog reused). Exits non-zero when the median warm
+boot is over the budget, so it can gate CI / image builds.
+
+    cd city-airbackend
+    python -m benchmarks.bench_startup --budget-ms 1000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = ("pandas", "numpy", "openpyxl", "httpx", "xlsxwriter", "pyarrow")
+
+PROBE = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({{"ms": ms, "heavy": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def boot() -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1000")))
+    args = ap.parse_args()
+
+    xlsx_path = os.getenv("SITE_XLSX_PATH", "site_ids_to_fetch_daily_data.xlsx")
+    compiled_path = os.getenv("CATALOG_COMPILED_PATH") or f"{xlsx_path}.compiled.json"
+    if os.path.exists(compiled_path):
+        os.remove(compiled_path)
+
+    cold = boot()
+    warm = [boot() for _ in range(args.runs)]
+    warm_ms = statistics.median(r["ms"] for r in warm)
+
+    print(f"cold boot (parse Excel) : {cold['ms']:7.0f} ms  heavy modules: {cold['heavy'] or '-'}")
+    print(f"warm boot (median of {args.runs}) : {warm_ms:7.0f} ms  heavy modules: {warm[-1]['heavy'] or '-'}")
+    print(f"budget                  : {args.budget_ms:7.0f} ms")
+
+    if warm_ms > args.budget_ms:
+        print("FAIL: warm startup over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
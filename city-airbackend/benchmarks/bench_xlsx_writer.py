@@ -0,0 +1,85 @@
+"""
+Workbook write benchmark: pd.ExcelWriter(openpyxl) vs StreamingWorkbook.
+
+Builds synthetic year-long 15-min wide sheets (one column per city, one sheet
+per pollutant) and writes them with each writer in a fresh subprocess, so the
+reported peak RSS belongs to that writer alone.
+
+    cd city-airbackend
+    python -m benchmarks.bench_xlsx_writer --cities 10 --pollutants 3
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_sheets(n_cities: int, n_pollutants: int, year: int = 2024):
+    index = pd.date_range(f"{year}-01-01", f"{year}-12-31 23:45", freq="15min")
+    rng = np.random.default_rng(0)
+    for p in range(n_pollutants):
+        values = rng.gamma(2.0, 30.0, (len(index), n_cities)).round(3)
+        values[rng.random(values.shape) < 0.05] = np.nan
+        wide = pd.DataFrame(values, columns=[f"City{c}" for c in range(n_cities)])
+        wide.insert(0, "Timestamp", index)
+        yield f"POLLUTANT{p}", wide
+
+
+def run_one(writer: str, n_cities: int, n_pollutants: int) -> dict:
+    out_path = os.path.join(tempfile.mkdtemp(prefix="bench_xlsx_"), "out.xlsx")
+    t0 = time.perf_counter()
+
+    if writer == "openpyxl":
+        with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
+            for name, wide in synthetic_sheets(n_cities, n_pollutants):
+                wide.to_excel(xw, sheet_name=name, index=False)
+    else:
+        from app.xlsx_writer import StreamingWorkbook
+        with StreamingWorkbook(out_path) as wb:
+            for name, wide in synthetic_sheets(n_cities, n_pollutants):
+                wb.write_frame(name, wide)
+
+    return {
+        "writer": writer,
+        "wall_s": time.perf_counter() - t0,
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "file_mb": os.path.getsize(out_path) / 1024 ** 2,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cities", type=int, default=10)
+    ap.add_argument("--pollutants", type=int, default=3)
+    ap.add_argument("--writers", nargs="+", default=["openpyxl", "streaming"])
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.cities, args.pollutants)))
+        return
+
+    rows = 35136 * args.pollutants
+    print(f"year of 15-min data: {args.cities} cities x {args.pollutants} pollutants ({rows} rows)")
+    print(f"{'writer':>10} {'wall (s)':>9} {'peak RSS (MB)':>14} {'file (MB)':>10}")
+    for writer in args.writers:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_xlsx_writer",
+             "--cities", str(args.cities), "--pollutants", str(args.pollutants), "--child", writer],
+            capture_output=True, text=True, check=True,
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['writer']:>10} {r['wall_s']:>9.2f} {r['peak_rss_mb']:>14.1f} {r['file_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()